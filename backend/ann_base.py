@@ -0,0 +1,336 @@
+# ann_base.py
+# What every ANN backend shares: key naming and per-key tuning, index file
+# paths, the cross-process file lock and generation counter, and the _Index
+# base class (tombstones, unsaved changes replayed onto a newer on-disk copy,
+# save). ann_hnsw.py and ann_ivfpq.py implement _Index, ann_sharded.py splits a
+# key across several of one backend, and ann_index.py keeps the registry and
+# the functions the app calls.
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import Dict, Tuple, List, Optional
+from contextlib import contextmanager
+import json, os, threading, time
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+IndexKey = Tuple[str, str, int]  # (model_name, task_type, dim)
+
+_DATA_DIR = os.environ.get("ANN_STORE_DIR", ".ann_store")
+_TUNING_PATH = os.path.join(_DATA_DIR, "ann_tuning.json")
+
+def key_name(key: IndexKey) -> str:
+    m, t, d = key
+    return f"{m}__{t}__{d}".replace("/", "_")
+
+# Two-stage search: with ANN_COARSE_DIM (or "coarse_dim" in a key's tuning) below
+# the key's dim, the index holds re-normalized prefixes of that many dims and
+# search() reranks k * ANN_RERANK_FACTOR candidates against the full-dimension
+# vectors of the registered rerank source (see set_rerank_source()).
+_COARSE_DIM = int(os.getenv("ANN_COARSE_DIM", "0"))
+_RERANK_FACTOR = int(os.getenv("ANN_RERANK_FACTOR", "4"))
+
+def coarse_dim_for(key: IndexKey) -> int:
+    cd = int((tuning_for(key) or {}).get("coarse_dim", _COARSE_DIM) or 0)
+    return cd if 0 < cd < key[2] else 0
+
+# Backends: "hnsw" (hnswlib graph, in memory; ann_hnsw.py) or "ivfpq" (IVF-PQ with
+# memory-mapped posting lists, for corpora that don't fit in every worker's
+# RAM). ANN_BACKEND sets the default; "backend" in a key's tuning overrides it.
+_BACKEND = os.getenv("ANN_BACKEND", "hnsw")
+
+def backend_for(key: IndexKey) -> str:
+    return str((tuning_for(key) or {}).get("backend", _BACKEND))
+
+# Sharding: with ANN_SHARDS (or "shards" in a key's tuning) above 1, a key's
+# labels are split by hash across that many sub-indexes of its backend (see
+# ann_sharded.py), each with its own file, lock and generation.
+_SHARDS = int(os.getenv("ANN_SHARDS", "1"))
+
+def shards_for(key: IndexKey) -> int:
+    return max(1, int((tuning_for(key) or {}).get("shards", _SHARDS) or 1))
+
+def shard_of(labels, shards: int) -> np.ndarray:
+    """Shard number of each label (Knuth multiplicative hash, so strided ids still spread)."""
+    h = (np.atleast_1d(np.asarray(labels, dtype=np.int64)).astype(np.uint64) * np.uint64(2654435761)) & np.uint64(0xFFFFFFFF)
+    return (h % np.uint64(shards)).astype(np.int64)
+
+def _fname(key: IndexKey, shard: Optional[int] = None) -> str:
+    cd, s = coarse_dim_for(key), shards_for(key)
+    # Coarse, sharded and ivfpq indexes are different files; switching means a rebuild (warm-up does it)
+    name = f"{key_name(key)}{f'__c{cd}' if cd else ''}{f'__s{s}' if s > 1 else ''}{'' if shard is None else f'-{shard}'}"
+    return os.path.join(_DATA_DIR, f"{name}.{backend_for(key)}")
+
+def _paths(key: IndexKey) -> List[str]:
+    """The key's index file, or one per shard."""
+    s = shards_for(key)
+    return [_fname(key, i) for i in range(s)] if s > 1 else [_fname(key)]
+
+# ---------------------------
+# cross-process coordination
+# ---------------------------
+# Every uvicorn worker holds its own copy of each index. Saves happen under an
+# exclusive lock on <index>.lock and bump the counter in <index>.gen; other
+# workers compare that counter (at most every ANN_RELOAD_CHECK_SECONDS, <0
+# disables) and reload when it moved.
+_RELOAD_CHECK_SECONDS = float(os.getenv("ANN_RELOAD_CHECK_SECONDS", "1"))
+
+@contextmanager
+def _file_lock(path: str, shared: bool = False):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            # msvcrt has no shared locks; readers take the exclusive one too
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ~10s; keep waiting
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _read_generation(path: str) -> int:
+    try:
+        with open(path + ".gen") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def _write_generation(path: str, gen: int):
+    tmp = path + ".gen.tmp"
+    with open(tmp, "w") as f:
+        f.write(str(gen))
+    os.replace(tmp, path + ".gen")
+
+def _deleted_fname(path: str) -> str:
+    # mark_deleted labels still show up in get_ids_list() after a load, so the
+    # tombstoned labels are saved next to the index.
+    return path + ".deleted.npy"
+
+# ---------------------------
+# per-key tuning
+# ---------------------------
+# ann_tuning.json maps key_name(key) -> {"M", "ef_construction", "ef", "k", ...}.
+# ef is the cheapest value that met the recall target at k during tuning.
+_tuning: Optional[Dict[str, dict]] = None
+
+def _load_tuning() -> Dict[str, dict]:
+    global _tuning
+    if _tuning is None:
+        try:
+            with open(_TUNING_PATH) as f:
+                _tuning = json.load(f)
+        except FileNotFoundError:
+            _tuning = {}
+    return _tuning
+
+def tuning_for(key: IndexKey) -> Optional[dict]:
+    return _load_tuning().get(key_name(key))
+
+class _Index(ABC):
+    """
+    One loaded key. Holds what every backend shares: the file lock and
+    generation, tombstones, and the unsaved changes that get replayed onto a
+    newer on-disk copy. Subclasses implement the structure itself.
+    """
+    lossy = False  # True when knn() distances are approximate enough to be worth reranking
+
+    def __init__(self, space: str, dim: int, key: IndexKey, path: Optional[str] = None):
+        self.space = space
+        self.full_dim = dim
+        self.coarse_dim = coarse_dim_for(key)
+        self.dim = self.coarse_dim or dim   # dims stored in the index
+        self.key = key
+        self.path = path or _fname(key)    # a shard's own file when sharded
+        self.lock = threading.RLock()
+        self.deleted = set()       # labels marked deleted and not re-added (tombstones)
+        self.dirty = False         # added to without saving (add_or_update(save=False))
+        self.saved_at = None       # type: Optional[float]  (epoch seconds)
+        self.loaded_at = time.time()
+        self.used_at = time.time()  # last _get_index(); the registry unloads least recently used first
+        self.tuning = None         # type: Optional[dict]
+        self.generation = 0        # on-disk generation this copy reflects
+        self.checked_at = 0.0      # monotonic time of the last generation check
+        self.adopted = 0           # times a copy was taken from disk (load, reload, merge)
+        # Changes since the last save, replayed onto a newer on-disk copy at save time
+        self.pending_add = set()
+        self.pending_del = set()
+
+    def apply_tuning(self):
+        self.tuning = tuning_for(self.key)
+        self.rerank_factor = int((self.tuning or {}).get("rerank_factor", _RERANK_FACTOR))
+
+    def project(self, arr: np.ndarray) -> np.ndarray:
+        """Vectors as stored in this index: unchanged, or the re-normalized coarse prefix."""
+        if not self.coarse_dim or arr.shape[1] == self.coarse_dim:
+            return arr
+        p = arr[:, :self.coarse_dim]
+        n = np.linalg.norm(p, axis=1, keepdims=True)
+        n[n == 0] = 1.0
+        return (p / n).astype(np.float32)
+
+    @staticmethod
+    def _normalize(arr: np.ndarray) -> np.ndarray:
+        n = np.linalg.norm(arr, axis=1, keepdims=True)
+        n[n == 0] = 1.0
+        return (arr / n).astype(np.float32)
+
+    # --- backend interface ---
+    @staticmethod
+    @abstractmethod
+    def files(path: str) -> List[str]:
+        """Every file of an index at `path` (besides .gen/.lock), for drop()."""
+
+    @abstractmethod
+    def loaded(self) -> bool:
+        ...
+
+    @abstractmethod
+    def _init_new(self, max_elements: int):
+        ...
+
+    @abstractmethod
+    def _read_disk(self, capacity: int) -> tuple:
+        """(backend state, deleted, generation) from the files; hold _file_lock(shared) around it."""
+
+    @abstractmethod
+    def _set_state(self, state):
+        ...
+
+    @abstractmethod
+    def _write(self):
+        """Write the index files (caller holds the exclusive file lock)."""
+
+    @abstractmethod
+    def has(self, label: int) -> bool:
+        ...
+
+    @abstractmethod
+    def live_labels(self) -> set:
+        ...
+
+    @abstractmethod
+    def add(self, arr: np.ndarray, labels: List[int]):
+        """Insert/replace vectors in memory (caller holds self.lock)."""
+
+    @abstractmethod
+    def delete(self, label: int):
+        ...
+
+    @abstractmethod
+    def _vectors(self, labels: List[int]) -> np.ndarray:
+        """Stored vectors of unsaved adds, for replaying them onto another copy."""
+
+    def unchanged(self, arr: np.ndarray, labels: List[int]) -> np.ndarray:
+        """Which of `labels` already hold these vectors as stored (re-adding them would be a no-op)."""
+        return np.zeros(len(labels), dtype=bool)
+
+    @abstractmethod
+    def build(self, arr: np.ndarray, labels: List[int]):
+        """Replace the contents with exactly these items."""
+
+    @abstractmethod
+    def compact(self):
+        """Drop tombstones and save (caller holds no lock)."""
+
+    def sizes(self) -> dict:
+        count, live = self.count(), self.live()
+        return {"count": count, "live": live, "tombstones": max(count - live, 0), "capacity": self.capacity(),
+                "memory_bytes_est": self.memory_estimate(), "file_bytes": self.file_bytes()}
+
+    @abstractmethod
+    def knn(self, q: np.ndarray, n: int) -> Tuple[List[int], List[float]]:
+        """n nearest (labels, cosine distances) for one projected query."""
+
+    @abstractmethod
+    def live(self) -> int:
+        ...
+
+    @abstractmethod
+    def count(self) -> int:
+        """Stored entries, tombstones included."""
+
+    def capacity(self) -> int:
+        return self.count()
+
+    @abstractmethod
+    def memory_estimate(self) -> int:
+        ...
+
+    def describe(self) -> dict:
+        """Backend-specific stats fields."""
+        return {}
+
+    def file_bytes(self) -> Optional[int]:
+        sizes = [os.path.getsize(p) for p in self.files(self.path) if os.path.exists(p)]
+        return sum(sizes) if sizes else None
+
+    # --- shared ---
+    def _adopt(self, loaded: tuple):
+        state, self.deleted, self.generation = loaded
+        self._set_state(state)
+        self.adopted += 1
+        self.saved_at = os.path.getmtime(self.path)
+        self.loaded_at = time.time()
+        self.apply_tuning()
+
+    def _load_or_new(self, expected_capacity: int):
+        if os.path.exists(self.path):
+            with _file_lock(self.path, shared=True):
+                self._adopt(self._read_disk(expected_capacity))
+        else:
+            self._init_new(expected_capacity)
+
+    def _merge_onto_disk_copy(self):
+        # Another process saved since we loaded: take its copy and replay our
+        # unsaved changes on top, so neither side's writes are lost.
+        adds = [lab for lab in self.pending_add if self.has(lab)]
+        vecs = self._vectors(adds) if adds else None
+        dels = list(self.pending_del)
+        self._adopt(self._read_disk(self.capacity()))
+        for lab in dels:
+            if self.has(lab):
+                self.delete(lab)
+        if adds:
+            self.add(vecs, adds)
+
+    def save(self, merge: bool = True):
+        """
+        Write the index under the store's file lock and bump its generation.
+        With merge=True (everything but rebuild) a newer on-disk copy is
+        merged in first instead of being overwritten.
+        """
+        if not self.loaded():
+            return
+        with _file_lock(self.path):
+            disk_gen = _read_generation(self.path)
+            if merge and disk_gen != self.generation and os.path.exists(self.path):
+                self._merge_onto_disk_copy()
+            self._write()
+            self.generation = disk_gen + 1
+            _write_generation(self.path, self.generation)
+        self.pending_add.clear()
+        self.pending_del.clear()
+        self.dirty = False
+        self.saved_at = time.time()
+
+def _save_npy(path: str, arr: np.ndarray):
+    # Temp file and rename, so readers never see a partial file
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
@@ -0,0 +1,202 @@
+# ann_hnsw.py
+# The "hnsw" backend: an in-memory hnswlib graph per key (or shard), saved with
+# its tombstoned labels next to it. M / ef_construction apply at build time, ef
+# per search; all three can be set per key in ann_tuning.json.
+from __future__ import annotations
+from typing import List, Optional, Tuple
+import os
+import numpy as np
+import hnswlib
+from ann_base import IndexKey, _Index, _deleted_fname, _read_generation, _save_npy, tuning_for
+from metrics import timed_lock
+
+# Tuneable; per-key overrides come from ann_tuning.json (scripts/tune_ann.py)
+_DEFAULT_M = int(os.getenv("ANN_M", "32"))
+_DEFAULT_EF_CONSTRUCTION = int(os.getenv("ANN_EF_CONSTRUCTION", "200"))
+_DEFAULT_EF = int(os.getenv("ANN_EF", "128"))
+
+class _HnswIndex(_Index):
+    def __init__(self, space: str, dim: int, key: IndexKey, path: Optional[str] = None):
+        super().__init__(space, dim, key, path)
+        self.index = None          # type: hnswlib.Index
+        self.labels = set()        # track labels present
+        self.ef = _DEFAULT_EF
+        self.touched = None        # type: Optional[set]  (labels written during a compaction)
+
+    @staticmethod
+    def files(path: str) -> List[str]:
+        return [path, _deleted_fname(path)]
+
+    def loaded(self) -> bool:
+        return self.index is not None
+
+    def apply_tuning(self):
+        super().apply_tuning()
+        self.ef = int((self.tuning or {}).get("ef", _DEFAULT_EF))
+        if self.index is not None:
+            self.index.set_ef(self.ef)
+
+    def search_ef(self, k: int) -> int:
+        if not self.tuning or "ef" not in self.tuning:
+            return max(self.ef, k * 2)
+        # tuned ef was measured at tuning["k"]; scale up for larger k
+        return max(self.ef, -(-self.ef * k // int(self.tuning.get("k") or k)), k)
+
+    def _init_new(self, max_elements: int):
+        cfg = tuning_for(self.key) or {}
+        self.index = hnswlib.Index(space=self.space, dim=self.dim)
+        self.index.init_index(
+            max_elements=max(max_elements, 1),
+            M=int(cfg.get("M", _DEFAULT_M)),
+            ef_construction=int(cfg.get("ef_construction", _DEFAULT_EF_CONSTRUCTION)),
+            allow_replace_deleted=True,  # add_or_update re-inserts with replace_deleted=True
+        )
+        self.labels, self.deleted = set(), set()
+        self.apply_tuning()
+
+    def _read_disk(self, capacity: int) -> tuple:
+        index = hnswlib.Index(space=self.space, dim=self.dim)
+        index.load_index(self.path, max_elements=capacity or 1, allow_replace_deleted=True)
+        ids = set(index.get_ids_list())
+        dpath = _deleted_fname(self.path)
+        deleted = set(np.load(dpath).tolist()) & ids if os.path.exists(dpath) else set()
+        return (index, ids - deleted), deleted, _read_generation(self.path)
+
+    def _set_state(self, state):
+        self.index, self.labels = state
+
+    def _write(self):
+        if self.deleted:
+            # replace_deleted may have reused tombstoned slots; drop labels that are gone
+            self.deleted &= set(self.index.get_ids_list())
+        tmp = self.path + ".tmp"
+        self.index.save_index(tmp)
+        os.replace(tmp, self.path)
+        _save_npy(_deleted_fname(self.path), np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)))
+
+    def _ensure_capacity(self, need: int):
+        # hnswlib can grow via resize_index
+        cur_max = self.index.get_max_elements()
+        cur_cnt = self.index.get_current_count()
+        if cur_cnt + need > cur_max:
+            self.index.resize_index(max(cur_cnt + need, int(cur_max * 1.5) + 64))
+
+    def has(self, label: int) -> bool:
+        return label in self.labels
+
+    def live_labels(self) -> set:
+        return set(self.labels)
+
+    def add(self, arr: np.ndarray, labels: List[int]):
+        # Labels the graph already has (live, or tombstoned and un-deleted here)
+        # are updated in place; only new ones take over tombstoned slots. Letting a
+        # known label move into another's slot corrupts hnswlib's label lookup once
+        # that other label is re-added (a batch re-add lost most of its labels).
+        known = np.zeros(len(labels), dtype=bool)
+        for i, lab in enumerate(labels):
+            if lab in self.labels:
+                known[i] = True
+            elif lab in self.deleted:
+                try:
+                    self.index.unmark_deleted(lab)
+                    known[i] = True
+                except RuntimeError:
+                    pass  # its slot was reused by another label; insert it as new
+        self._ensure_capacity(int(np.count_nonzero(~known)))  # in-place updates take no new slot
+        vecs, labs = self.project(arr), np.array(labels, dtype=np.int64)
+        if known.any():
+            self.index.add_items(vecs[known], labs[known])
+        if not known.all():
+            self.index.add_items(vecs[~known], labs[~known], replace_deleted=True)
+        if self.touched is not None:
+            self.touched.update(labels)
+        self.labels.update(labels)
+        self.deleted.difference_update(labels)
+        self.pending_add.update(labels)
+        self.pending_del.difference_update(labels)
+
+    def delete(self, label: int):
+        self.index.mark_deleted(label)
+        self.labels.discard(label)
+        self.deleted.add(label)
+        if self.touched is not None:
+            self.touched.add(label)
+        self.pending_add.discard(label)
+        self.pending_del.add(label)
+
+    def _vectors(self, labels: List[int]) -> np.ndarray:
+        return np.asarray(self.index.get_items(labels), dtype=np.float32)
+
+    def unchanged(self, arr: np.ndarray, labels: List[int]) -> np.ndarray:
+        out = np.zeros(len(labels), dtype=bool)
+        rows = [i for i, lab in enumerate(labels) if lab in self.labels]
+        if rows:
+            # cosine space stores unit vectors
+            new = self._normalize(self.project(np.asarray(arr, dtype=np.float32)[rows]))
+            have = self._vectors([labels[i] for i in rows])
+            out[rows] = np.abs(have - new).max(axis=1) <= 1e-5
+        return out
+
+    def build(self, arr: np.ndarray, labels: List[int]):
+        self._init_new(max_elements=len(labels))
+        if labels:
+            self.index.add_items(self.project(arr), np.array(labels, dtype=np.int64))
+        self.labels = set(labels)
+
+    def compact(self):
+        # Build a dense graph from the live vectors without holding the lock,
+        # then replay what was written meanwhile and swap it in
+        with timed_lock(self.lock, "ann_index", "compact"):
+            labels = list(self.labels)
+            vecs = self._vectors(labels) if labels else np.empty((0, self.dim), dtype=np.float32)
+            self.touched, adopted = set(), self.adopted
+        fresh = _HnswIndex(self.space, self.full_dim, self.key, path=self.path)
+        try:
+            fresh.build(vecs, labels)
+        except Exception:
+            with self.lock:
+                self.touched = None
+            raise
+        with timed_lock(self.lock, "ann_index", "compact"):
+            touched, self.touched = self.touched, None
+            if self.adopted != adopted:
+                return  # took another worker's copy meanwhile; the next check can try again
+            readd = [lab for lab in touched if lab in self.labels]
+            if readd:
+                fresh.add(self._vectors(readd), readd)
+            for lab in touched.difference(readd):
+                if fresh.has(lab):
+                    fresh.delete(lab)
+            self.index, self.labels, self.deleted = fresh.index, fresh.labels, fresh.deleted
+            self.save()
+
+    def knn(self, q: np.ndarray, n: int) -> Tuple[List[int], List[float]]:
+        self.index.set_ef(self.search_ef(n))
+        labels, distances = self.index.knn_query(q, k=n)
+        return [int(x) for x in labels[0].tolist()], [float(d) for d in distances[0].tolist()]
+
+    def live(self) -> int:
+        return len(self.labels)
+
+    def count(self) -> int:
+        return self.index.get_current_count()
+
+    def capacity(self) -> int:
+        return self.index.get_max_elements()
+
+    def memory_estimate(self) -> int:
+        """
+        Rough resident size: hnswlib allocates the full capacity up front
+        (vector + level-0 links + label per slot), plus our Python label sets.
+        Upper-level links are ~1/M of level 0 and ignored.
+        """
+        per_slot = self.dim * 4 + (2 * self.index.M + 1) * 4 + 8
+        return self.capacity() * per_slot + (len(self.labels) + len(self.deleted)) * 60
+
+    def describe(self) -> dict:
+        return {
+            "capacity": self.capacity(),
+            "M": self.index.M,
+            "ef_construction": self.index.ef_construction,
+            "ef": self.ef,
+        }
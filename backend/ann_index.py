@@ -1,82 +1,209 @@
 # ann_index.py
+# Registry of loaded ANN indexes (one per model/task/dim key) and the functions
+# the app calls: add/remove, search with optional rerank, rebuild, save, compact,
+# stats. Shared plumbing is in ann_base.py; the backends in ann_hnsw.py,
+# ann_ivfpq.py and ann_sharded.py.
 from __future__ import annotations
-from typing import Dict, Tuple, List, Iterable
-import os, threading
+from typing import Callable, Tuple, List, Iterable, Optional
+from collections import OrderedDict
+import json, logging, os, threading, time
 import numpy as np
-import hnswlib
-
-IndexKey = Tuple[str, str, int]  # (model_name, task_type, dim)
-
-# Tuneable
-_DEFAULT_M = 32
-_DEFAULT_EF_CONSTRUCTION = 200
-_DEFAULT_EF = 128
-
-_DATA_DIR = os.environ.get("ANN_STORE_DIR", ".ann_store")
-os.makedirs(_DATA_DIR, exist_ok=True)
-
-def _fname(key: IndexKey) -> str:
-    m, t, d = key
-    safe = f"{m}__{t}__{d}".replace("/", "_")
-    return os.path.join(_DATA_DIR, f"{safe}.hnsw")
-
-class _Index:
-    def __init__(self, space: str, dim: int, key: IndexKey):
-        self.space = space
-        self.dim = dim
-        self.key = key
-        self.path = _fname(key)
-        self.lock = threading.RLock()
-        self.index = None          # type: hnswlib.Index
-        self.labels = set()        # track labels present
-
-    def _init_new(self, max_elements: int):
-        self.index = hnswlib.Index(space=self.space, dim=self.dim)
-        self.index.init_index(max_elements=max(max_elements, 1), M=_DEFAULT_M, ef_construction=_DEFAULT_EF_CONSTRUCTION)
-        self.index.set_ef(_DEFAULT_EF)
-
-    def _load_or_new(self, expected_capacity: int):
-        if os.path.exists(self.path):
-            self.index = hnswlib.Index(space=self.space, dim=self.dim)
-            self.index.load_index(self.path, max_elements=expected_capacity or 1)
-            self.index.set_ef(_DEFAULT_EF)
-            # hnswlib doesn’t persist an easy label list; we rebuild lazily as we add.
-            # (We’ll keep labels in-memory across this process; safe enough for dev.)
-            self.labels = set(self.index.get_ids_list())
-        else:
-            self._init_new(expected_capacity)
+from ann_base import (
+    IndexKey, _Index, _DATA_DIR, _TUNING_PATH, _RELOAD_CHECK_SECONDS, _file_lock, _fname, _load_tuning,
+    _paths, _read_generation, _write_generation, backend_for, key_name, shards_for, tuning_for,
+)
+import ann_base
+from ann_hnsw import _HnswIndex
+from ann_ivfpq import _IvfPqIndex
+from ann_sharded import _ShardedIndex, _in_parallel
+from metrics import counter, histogram, stage, timed_lock
+
+logger = logging.getLogger("ISolution.ann")
+
+# (key, full query vector, labels) -> (labels found, cosine similarity of each)
+RerankSource = Callable[[IndexKey, np.ndarray, List[int]], Tuple[List[int], np.ndarray]]
+_rerank_source: Optional[RerankSource] = None
+
+def set_rerank_source(fn: Optional[RerankSource]):
+    global _rerank_source
+    _rerank_source = fn
+
+def save_tuning(key: IndexKey, cfg: dict):
+    """
+    Store a tuned config for `key` and apply its ef / nprobe to the loaded index.
+    M / ef_construction / nlist / pq_m only take effect the next time the index
+    is rebuilt; a new backend or coarse_dim unloads it (warm-up rebuilds).
+    """
+    with _REG_LOCK:
+        tuning = dict(_load_tuning())
+        tuning[key_name(key)] = cfg
+        os.makedirs(_DATA_DIR, exist_ok=True)
+        tmp = _TUNING_PATH + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(tuning, f, indent=2, sort_keys=True)
+        os.replace(tmp, _TUNING_PATH)
+        ann_base._tuning = tuning
+        ix = _REGISTRY.get(key)
+    if ix is not None:
+        if _fname(key) != ix.path:
+            unload(key)  # different backend or layout; next use loads/rebuilds the new file
+            return
+        with ix.lock:
+            ix.apply_tuning()
+
+_BACKENDS = {"hnsw": _HnswIndex, "ivfpq": _IvfPqIndex}
 
-    def save(self):
-        if self.index is not None:
-            self.index.save_index(self.path)
+def _maybe_refresh(ix: _Index):
+    """
+    Reload the index if another process saved a newer generation. Checks the
+    generation file at most every ANN_RELOAD_CHECK_SECONDS; the load happens
+    outside ix.lock so searches keep using the old copy meanwhile.
+    """
+    if _RELOAD_CHECK_SECONDS < 0:
+        return
+    if isinstance(ix, _ShardedIndex):
+        for sh in ix.shards:
+            _maybe_refresh(sh)
+        return
+    now = time.monotonic()
+    if now - ix.checked_at < _RELOAD_CHECK_SECONDS:
+        return
+    ix.checked_at = now
+    if ix.dirty or _read_generation(ix.path) <= ix.generation or not os.path.exists(ix.path):
+        return  # a dirty copy is merged with the newer one when it saves; no file = dropped
+    with stage("ann_reload"), _file_lock(ix.path, shared=True):
+        loaded = ix._read_disk(0)
+    with ix.lock:
+        if not ix.dirty and loaded[2] > ix.generation:
+            ix._adopt(loaded)
 
-# Global registry of indices
-_REGISTRY: Dict[IndexKey, _Index] = {}
+# Global registry of indices, least recently used first
+_REGISTRY: "OrderedDict[IndexKey, _Index]" = OrderedDict()
 _REG_LOCK = threading.RLock()
 
+# With ANN_MEMORY_BUDGET_MB > 0, loading or growing an index past that total
+# (by memory_estimate()) saves and unloads the least recently used other keys;
+# they load again from disk on their next use. 0 = keep everything loaded.
+_MEMORY_BUDGET = int(float(os.getenv("ANN_MEMORY_BUDGET_MB", "0")) * 2**20)
+
+_LOAD_SECONDS = histogram(
+    "ann_index_load_seconds",
+    "Time to load an index from disk (or create it) into the registry",
+    labelnames=("backend",),
+)
+_EVICTIONS = counter(
+    "ann_index_evictions_total",
+    "Indexes unloaded to stay within ANN_MEMORY_BUDGET_MB",
+)
+
 def _get_index(key: IndexKey, dim: int, capacity_hint: int = 0) -> _Index:
     with _REG_LOCK:
         ix = _REGISTRY.get(key)
-        if ix is None:
-            ix = _Index(space="cosine", dim=dim, key=key)
-            ix._load_or_new(capacity_hint)
-            _REGISTRY[key] = ix
-        return ix
-
-def _ensure_capacity(ix: _Index, need: int):
-    # hnswlib can grow via resize_index
-    cur_max = ix.index.get_max_elements()
-    cur_cnt = ix.index.get_current_count()
-    if cur_cnt + need > cur_max:
-        ix.index.resize_index(max(cur_cnt + need, int(cur_max * 1.5) + 64))
+        if ix is not None:
+            _REGISTRY.move_to_end(key)
+            ix.used_at = time.time()
+            return ix
+        t0 = time.perf_counter()
+        cls, n = _BACKENDS[backend_for(key)], shards_for(key)
+        ix = _ShardedIndex(cls, "cosine", dim, key, n) if n > 1 else cls(space="cosine", dim=dim, key=key)
+        ix._load_or_new(capacity_hint)
+        _REGISTRY[key] = ix
+        _LOAD_SECONDS.observe(time.perf_counter() - t0, backend=backend_for(key))
+    _enforce_budget(keep=key)
+    return ix
+
+def _size(ix: _Index) -> int:
+    return ix.memory_estimate() if ix.loaded() else 0
+
+def _enforce_budget(keep: Optional[IndexKey] = None):
+    """
+    Unload least recently used indexes (never `keep`) until the estimate fits
+    the budget. Must not be called with _REG_LOCK held: it takes each victim's
+    lock and then _REG_LOCK, so holding _REG_LOCK first can deadlock.
+    """
+    if _MEMORY_BUDGET <= 0:
+        return
+    with _REG_LOCK:
+        sizes = {k: _size(ix) for k, ix in _REGISTRY.items()}
+        total, victims = sum(sizes.values()), []
+        for k, ix in _REGISTRY.items():
+            if total <= _MEMORY_BUDGET:
+                break
+            if k != keep:
+                victims.append((k, ix))
+                total -= sizes[k]
+    for k, ix in victims:
+        # Save first so a reload (even one racing this) finds the changes on disk
+        with timed_lock(ix.lock, "ann_index", "evict"):
+            if ix.dirty:
+                ix.save()
+            with _REG_LOCK:
+                if _REGISTRY.get(k) is not ix:
+                    continue
+                del _REGISTRY[k]
+        _EVICTIONS.inc()
+        logger.info("Unloaded ANN index %s (~%.1f MB) to stay within ANN_MEMORY_BUDGET_MB",
+                    key_name(k), sizes[k] / 2**20)
+
+def registry_stats() -> dict:
+    with _REG_LOCK:
+        loaded = list(_REGISTRY.values())
+    loads = _LOAD_SECONDS.snapshot().values()
+    return {
+        "loaded": len(loaded),
+        "memory_bytes_est": sum(_size(ix) for ix in loaded),
+        "budget_bytes": _MEMORY_BUDGET or None,
+        "evictions": int(sum(_EVICTIONS.snapshot().values())),
+        "loads": sum(c for _, _, c in loads),
+        "load_seconds": round(sum(t for _, t, _ in loads), 3),
+    }
+
+def generation(key: IndexKey) -> int:
+    """Generation of the loaded index (bumped on every save, here or in another worker); -1 if not loaded."""
+    ix = _REGISTRY.get(key)
+    return ix.generation if ix is not None else -1
+
+def load(key: IndexKey) -> Optional[int]:
+    """
+    Load the key's index from disk into the registry if it isn't already.
+    Returns its live count, or None when there's no file for it yet.
+    """
+    with _REG_LOCK:
+        ix = _REGISTRY.get(key)
+    if ix is None:
+        if not all(os.path.exists(p) for p in _paths(key)):
+            return None
+        # Not under _REG_LOCK: _get_index locks it itself, and its eviction takes index locks
+        ix = _get_index(key, key[2], capacity_hint=0)
+    return ix.live()
+
+def unload(key: IndexKey) -> bool:
+    """Forget a loaded index in this process (its files stay)."""
+    with _REG_LOCK:
+        return _REGISTRY.pop(key, None) is not None
+
+def drop(key: IndexKey):
+    """Unload an index and delete its files (after a model migration cut over)."""
+    unload(key)
+    for path in _paths(key):
+        if not os.path.exists(path):
+            continue
+        with _file_lock(path):
+            for p in _BACKENDS[backend_for(key)].files(path):
+                if os.path.exists(p):
+                    os.remove(p)
+            # Leave .gen (bumped) so other workers notice; .lock is reused if the key comes back
+            _write_generation(path, _read_generation(path) + 1)
 
 def add_or_update(
     key: IndexKey,
     dim: int,
     embeddings: Iterable[Tuple[int, List[float]]],
+    save: bool = True,
 ) -> int:
     """
     Upsert items into the index. Each item is (label, vector).
+    Pass save=False when adding in batches and call save_index() once at the end.
     Returns how many items were added.
     """
     ix = _get_index(key, dim, capacity_hint=0)
@@ -90,57 +217,58 @@ def add_or_update(
     if not labels:
         return 0
 
-    with ix.lock:
-        _ensure_capacity(ix, len(labels))
-        # Normalize input shape
-        arr = np.array(vecs, dtype=np.float32)
-        labs = np.array(labels, dtype=np.int64)
-
-        # If a label already exists, mark it deleted (so new insert replaces it)
-        # hnswlib supports replace_deleted=True in add_items to reuse deleted slots.
-        # We’ll do a best-effort delete for labels we’ve seen in this process.
-        to_del = [lab for lab in labels if lab in ix.labels]
-        for lab in to_del:
-            try:
-                ix.index.mark_deleted(lab)
-            except RuntimeError:
-                pass  # was not present; continue
-
-        ix.index.add_items(arr, labs, replace_deleted=True)
-        ix.labels.update(labels)
-        ix.save()
-        return len(labels)
+    with timed_lock(ix.lock, "ann_index", "add"):
+        ix.add(np.array(vecs, dtype=np.float32), labels)
+        if save or _REGISTRY.get(key) is not ix:
+            ix.save()  # (an evicted copy won't be in save_index()'s sweep)
+        else:
+            ix.dirty = True
+    _enforce_budget(keep=key)
+    return len(labels)
+
+def save_index(key: Optional[IndexKey] = None) -> int:
+    """
+    Persist a loaded index to disk, or with key=None every index that has
+    unsaved additions. Returns how many indexes were written.
+    """
+    with _REG_LOCK:
+        if key is None:
+            targets = [ix for ix in _REGISTRY.values() if ix.dirty]
+        else:
+            targets = [_REGISTRY[key]] if key in _REGISTRY else []
+    for ix in targets:
+        with ix.lock:
+            ix.save()
+    return len(targets)
 
 def rebuild(
     key: IndexKey,
     dim: int,
     all_items: Iterable[Tuple[int, List[float]]],
+    shards: Optional[Iterable[int]] = None,
 ) -> int:
     """
-    Rebuilds the index from scratch with all given items.
+    Rebuilds the index from scratch with all given items. For a sharded key,
+    `shards` limits the rebuild to those shard numbers (items hashing
+    elsewhere are ignored); the other shards keep serving meanwhile.
     """
     items = [(int(lab), vec) for (lab, vec) in all_items if len(vec) == dim]
     labels = [lab for lab, _ in items]
-    if not items:
-        # Create empty index so subsequent upserts work
-        ix = _get_index(key, dim, capacity_hint=1)
-        with ix.lock:
-            ix._init_new(max_elements=1)
-            ix.labels = set()
-            ix.save()
-        return 0
-
-    arr = np.array([vec for _, vec in items], dtype=np.float32)
-    labs = np.array(labels, dtype=np.int64)
+    # An empty rebuild still writes an index so subsequent upserts work
+    arr = np.array([vec for _, vec in items], dtype=np.float32).reshape(-1, dim)
 
-    ix = _get_index(key, dim, capacity_hint=len(items))
-    with ix.lock:
-        ix._init_new(max_elements=len(items))
-        ix.index.add_items(arr, labs)
-        ix.index.set_ef(_DEFAULT_EF)
-        ix.labels = set(labels)
-        ix.save()
-    return len(items)
+    ix = _get_index(key, dim, capacity_hint=max(len(items), 1))
+    if isinstance(ix, _ShardedIndex):
+        built = ix.rebuild(arr, labels, shards)
+    else:
+        with timed_lock(ix.lock, "ann_index", "rebuild"):
+            ix.build(arr, labels)
+            ix.deleted = set()
+            ix.pending_add, ix.pending_del = set(), set()
+            ix.save(merge=False)  # a rebuild replaces whatever other workers saved
+        built = len(items)
+    _enforce_budget(keep=key)
+    return built
 
 def search(
     key: IndexKey,
@@ -149,27 +277,140 @@ def search(
     k: int = 10,
 ) -> List[Tuple[int, float]]:
     """
-    Returns list of (label, distance) with hnswlib cosine space (0..2, lower is closer).
+    Returns list of (label, distance) with cosine distance (0..2, lower is closer).
     """
     ix = _get_index(key, dim, capacity_hint=0)
-    if ix.index is None or not ix.labels:
+    _maybe_refresh(ix)
+    if not ix.loaded() or not ix.live():
         return []
     q = np.asarray([query_vec], dtype=np.float32)
-    with ix.lock:
-        # NEW: scale ef with k for better recall
-        ix.index.set_ef(max(_DEFAULT_EF, k * 2))
-        labels, distances = ix.index.knn_query(q, k=min(k, max(1, len(ix.labels))))
-    labs = labels[0].tolist()
-    dists = distances[0].tolist()
-    return list(zip([int(x) for x in labs], [float(d) for d in dists]))
+    # Truncated or product-quantized candidates get re-scored on full vectors
+    rerank = (ix.coarse_dim or ix.lossy) and _rerank_source is not None
+    n = min(k * ix.rerank_factor if rerank else k, max(1, ix.live()))
+    with timed_lock(ix.lock, "ann_index", "search"):
+        with stage("knn_query"):
+            labs, dists = ix.knn(ix.project(q), n)
+    if rerank:
+        with stage("rerank"):
+            labs, dists = _rerank(key, q[0], labs, dists, k)
+    return list(zip(labs[:k], dists[:k]))
+
+def _rerank(key: IndexKey, q: np.ndarray, labs: List[int], dists: List[float], k: int):
+    # Cosine on full-dimension vectors for the coarse candidates
+    found, sims = _rerank_source(key, q, labs)
+    if not found:
+        return labs, dists
+    order = np.argsort(-sims)[:k]
+    return [found[i] for i in order], [float(1.0 - sims[i]) for i in order]
 
 def remove(key, dim, label: int) -> bool:
     ix = _get_index(key, dim, 0)
-    with ix.lock:
+    with timed_lock(ix.lock, "ann_index", "remove"):
         try:
-            ix.index.mark_deleted(int(label))
-            ix.labels.discard(int(label))
+            ix.delete(int(label))
             ix.save()
             return True
         except Exception:
             return False
+
+def compact(key: IndexKey, min_deleted_fraction: float = 0.0) -> Optional[dict]:
+    """
+    Rebuild the key's loaded index (each shard whose tombstone fraction is
+    above `min_deleted_fraction`) densely from its live vectors and save it.
+    Searches and writes continue meanwhile. Returns the sizes before and
+    after, or None if the key isn't loaded here.
+    """
+    with _REG_LOCK:
+        ix = _REGISTRY.get(key)
+    if ix is None or not ix.loaded():
+        return None
+    t0 = time.perf_counter()
+    before = ix.sizes()
+    parts = ix.shards if isinstance(ix, _ShardedIndex) else [ix]
+    todo = [p for p in parts if p.count() and (p.count() - p.live()) / p.count() > min_deleted_fraction]
+    _in_parallel(lambda p: p.compact(), todo)
+    res = {"key": list(key), "compacted": len(todo), "before": before, "after": ix.sizes(),
+           "seconds": round(time.perf_counter() - t0, 3)}
+    if todo:
+        logger.info("Compacted ANN index %s: %d -> %d slots, ~%.1f -> %.1f MB in %.2fs", key_name(key),
+                    before["capacity"], res["after"]["capacity"], before["memory_bytes_est"] / 2**20,
+                    res["after"]["memory_bytes_est"] / 2**20, res["seconds"])
+    return res
+
+def remove_many(key: IndexKey, dim: int, labels: Iterable[int], save: bool = True) -> int:
+    """Mark every present label deleted; returns how many were. save=False leaves it dirty for save_index()."""
+    ix = _get_index(key, dim, 0)
+    n = 0
+    with timed_lock(ix.lock, "ann_index", "remove"):
+        for lab in labels:
+            if ix.has(int(lab)):
+                ix.delete(int(lab))
+                n += 1
+        if n and (save or _REGISTRY.get(key) is not ix):
+            ix.save()
+        elif n:
+            ix.dirty = True
+    return n
+
+def labels(key: IndexKey) -> Optional[set]:
+    """Live labels of the key's loaded index (None if it isn't loaded here)."""
+    ix = _REGISTRY.get(key)
+    if ix is None or not ix.loaded():
+        return None
+    _maybe_refresh(ix)
+    with ix.lock:
+        return ix.live_labels()
+
+def unchanged(key: IndexKey, labels: List[int], vectors: np.ndarray) -> np.ndarray:
+    """
+    Per label, whether the key's loaded index already holds that vector (as
+    stored: projected, normalized, quantized), so re-inserting it would change
+    nothing. All False when the index isn't loaded here.
+    """
+    ix = _REGISTRY.get(key)
+    if ix is None or not ix.loaded() or not len(labels):
+        return np.zeros(len(labels), dtype=bool)
+    with ix.lock:
+        return ix.unchanged(np.asarray(vectors, dtype=np.float32), list(labels))
+
+# ---------------------------
+# stats
+# ---------------------------
+def _index_stats(ix: _Index) -> dict:
+    with ix.lock:
+        count = ix.count()
+        live = ix.live()
+        # Slots taken by deleted elements; also counts stale slots orphaned by replace_deleted
+        tombstones = max(count - live, 0)
+        m, t, d = ix.key
+        return {
+            "model_name": m,
+            "task_type": t,
+            "dim": d,
+            "backend": backend_for(ix.key),
+            "index_dim": ix.dim,
+            "rerank_factor": ix.rerank_factor if (ix.coarse_dim or ix.lossy) else None,
+            "space": ix.space,
+            "count": count,
+            "live": live,
+            "tombstones": tombstones,
+            "deleted_fraction": round(tombstones / count, 4) if count else 0.0,
+            **ix.describe(),
+            "tuned": ix.tuning is not None,
+            "dirty": ix.dirty,
+            "generation": ix.generation,
+            "file_bytes": ix.file_bytes(),
+            "saved_at": ix.saved_at,
+            "loaded_at": ix.loaded_at,
+            "used_at": ix.used_at,
+            "memory_bytes_est": ix.memory_estimate(),
+        }
+
+def stats(key: Optional[IndexKey] = None) -> List[dict]:
+    """Per-index stats for every loaded index (or just `key`)."""
+    with _REG_LOCK:
+        if key is None:
+            targets = list(_REGISTRY.values())
+        else:
+            targets = [_REGISTRY[key]] if key in _REGISTRY else []
+    return [_index_stats(ix) for ix in targets if ix.loaded()]
@@ -0,0 +1,350 @@
+# ann_ivfpq.py
+# The "ivfpq" backend: IVF-PQ (see ivfpq.py) with memory-mapped posting lists,
+# for corpora that don't fit in every worker's RAM.
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+import os, time
+import numpy as np
+import ivfpq
+from ann_base import IndexKey, _Index, _deleted_fname, _read_generation, _save_npy
+from metrics import stage, timed_lock
+
+_IVF_NLIST = int(os.getenv("ANN_IVF_NLIST", "0"))      # 0 = ~4 * sqrt(n)
+_IVF_PQ_M = int(os.getenv("ANN_IVF_PQ_M", "0"))        # 0 = ~8 dims per one-byte code
+_IVF_NPROBE = int(os.getenv("ANN_IVF_NPROBE", "16"))
+_IVF_TRAIN_SAMPLE = int(os.getenv("ANN_IVF_TRAIN_SAMPLE", "50000"))
+_IVF_MIN_TRAIN = 1024       # below this an ivfpq index keeps raw vectors and scans them
+_IVF_DELTA_FRACTION = 0.1   # fold the in-memory delta into the posting lists past this
+
+class _IvfPqIndex(_Index):
+    """
+    IVF-PQ (see ivfpq.py). The trained posting lists live in memory-mapped
+    .npy files; writes since the last fold go to an in-memory delta, and
+    superseded or deleted base entries are masked via self.deleted. An index
+    with fewer than _IVF_MIN_TRAIN vectors is untrained and scans raw vectors.
+    Files: <path> (centroids, codebooks, offsets, segment name),
+    <path>.<segment>.{ids,codes,sorted}.npy, <path>.delta, <path>.deleted.npy.
+    """
+    lossy = True
+
+    def __init__(self, space: str, dim: int, key: IndexKey, path: Optional[str] = None):
+        super().__init__(space, dim, key, path)
+        self.q = None              # type: Optional[ivfpq.Quantizer]
+        self._empty_base()
+        self.delta: Dict[int, Tuple[int, np.ndarray]] = {}  # label -> (list, codes [m]) since the fold
+        self.raw: Dict[int, np.ndarray] = {}                # label -> vector while untrained
+        self.pending_vecs: Dict[int, np.ndarray] = {}       # vectors of pending_add, for merges
+        self.base_dirty = False    # base changed in memory (build/fold) and must be rewritten
+        self.nprobe = _IVF_NPROBE
+        self._cache = None         # arrays derived from delta/deleted, rebuilt after writes
+
+    def _empty_base(self):
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.codes = np.empty((0, 0), dtype=np.uint8)   # [m, N]
+        self.sorted_ids = np.empty(0, dtype=np.int64)
+        self.segment = ""
+
+    @staticmethod
+    def files(path: str) -> List[str]:
+        d, base = os.path.dirname(path) or ".", os.path.basename(path)
+        segs = [os.path.join(d, f) for f in os.listdir(d)
+                if f.startswith(base + ".seg") and f.endswith(".npy")] if os.path.isdir(d) else []
+        return [path, path + ".delta", _deleted_fname(path)] + segs
+
+    def loaded(self) -> bool:
+        return True
+
+    def apply_tuning(self):
+        super().apply_tuning()
+        self.nprobe = int((self.tuning or {}).get("nprobe", _IVF_NPROBE))
+
+    def _init_new(self, max_elements: int):
+        self.q = None
+        self._empty_base()
+        self.delta, self.raw, self.deleted = {}, {}, set()
+        self.base_dirty = False
+        self._cache = None
+        self.apply_tuning()
+
+    # --- files ---
+    def _seg_path(self, segment: str, part: str) -> str:
+        return f"{self.path}.{segment}.{part}.npy"
+
+    def _read_disk(self, capacity: int) -> tuple:
+        with np.load(self.path) as z:
+            q = ivfpq.Quantizer(z["centroids"], z["codebooks"]) if z["centroids"].size else None
+            offsets, segment = z["offsets"], str(z["segment"])
+        if segment:
+            ids = np.load(self._seg_path(segment, "ids"), mmap_mode="r")
+            codes = np.load(self._seg_path(segment, "codes"), mmap_mode="r")
+            sorted_ids = np.load(self._seg_path(segment, "sorted"), mmap_mode="r")
+        else:
+            m = q.m if q is not None else 0
+            ids, sorted_ids, codes = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((m, 0), np.uint8)
+        delta, raw = {}, {}
+        if os.path.exists(self.path + ".delta"):
+            with np.load(self.path + ".delta") as z:
+                if q is not None:
+                    delta = {int(l): (int(c), z["codes"][:, i].copy())
+                             for i, (l, c) in enumerate(zip(z["ids"].tolist(), z["lists"].tolist()))}
+                else:
+                    raw = {int(l): z["vecs"][i].copy() for i, l in enumerate(z["ids"].tolist())}
+        dpath = _deleted_fname(self.path)
+        deleted = set(np.load(dpath).tolist()) if os.path.exists(dpath) else set()
+        return (q, offsets, ids, codes, sorted_ids, segment, delta, raw), deleted, _read_generation(self.path)
+
+    def _set_state(self, state):
+        self.q, self.offsets, self.ids, self.codes, self.sorted_ids, self.segment, self.delta, self.raw = state
+        self.pending_vecs = {}
+        self.base_dirty = False
+        self._cache = None
+
+    def _write(self):
+        if self.q is None and len(self.raw) >= _IVF_MIN_TRAIN:
+            labels = list(self.raw)
+            self.build(np.stack([self.raw[lab] for lab in labels]), labels)
+        elif self.q is not None and len(self.delta) > max(_IVF_MIN_TRAIN, _IVF_DELTA_FRACTION * len(self.ids)):
+            self._fold()
+        if self.base_dirty or not os.path.exists(self.path):
+            self._write_base()
+        buf = self._delta_arrays()
+        tmp = self.path + ".delta.tmp"
+        with open(tmp, "wb") as f:
+            if self.q is not None:
+                np.savez(f, ids=buf[0], lists=buf[1], codes=buf[2])
+            else:
+                labels = list(self.raw)
+                vecs = np.stack([self.raw[lab] for lab in labels]) if labels else np.empty((0, self.dim), np.float32)
+                np.savez(f, ids=np.asarray(labels, dtype=np.int64), vecs=vecs)
+        os.replace(tmp, self.path + ".delta")
+        _save_npy(_deleted_fname(self.path), np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted)))
+
+    def _write_base(self):
+        # A new segment name each time: other workers keep reading (mapping) the old one
+        segment = f"seg{time.time_ns()}" if len(self.ids) else ""  # (an empty array can't be mapped)
+        if segment:
+            for part, arr in (("ids", self.ids), ("codes", self.codes), ("sorted", self.sorted_ids)):
+                _save_npy(self._seg_path(segment, part), np.ascontiguousarray(arr))
+        empty = self.q is None
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=np.empty((0, self.dim), np.float32) if empty else self.q.centroids,
+                     codebooks=np.empty((0, 0, 0), np.float32) if empty else self.q.codebooks,
+                     offsets=self.offsets, segment=np.array(segment))
+        os.replace(tmp, self.path)
+        for f in self.files(self.path)[3:]:
+            if not segment or f".{segment}." not in f:
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass  # still mapped on Windows; removed by a later write
+        self.segment = segment
+        if segment:
+            self.ids = np.load(self._seg_path(segment, "ids"), mmap_mode="r")
+            self.codes = np.load(self._seg_path(segment, "codes"), mmap_mode="r")
+            self.sorted_ids = np.load(self._seg_path(segment, "sorted"), mmap_mode="r")
+        self.base_dirty = False
+
+    # --- contents ---
+    def _in_base(self, label: int) -> bool:
+        i = int(np.searchsorted(self.sorted_ids, label))
+        return i < len(self.sorted_ids) and int(self.sorted_ids[i]) == label
+
+    def has(self, label: int) -> bool:
+        if self.q is None:
+            return label in self.raw
+        return label in self.delta or (label not in self.deleted and self._in_base(label))
+
+    def live_labels(self) -> set:
+        if self.q is None:
+            return set(self.raw)
+        return (set(self.ids.tolist()) - self.deleted) | set(self.delta)
+
+    def add(self, arr: np.ndarray, labels: List[int]):
+        arr = self._normalize(self.project(arr))
+        if self.q is None:
+            for lab, v in zip(labels, arr):
+                self.raw[lab] = v
+        else:
+            lists, codes = self.q.encode(arr)
+            for i, lab in enumerate(labels):
+                if self._in_base(lab):
+                    self.deleted.add(lab)  # masks the base entry; the delta one wins
+                self.delta[lab] = (int(lists[i]), codes[:, i])
+        for lab, v in zip(labels, arr):
+            self.pending_vecs[lab] = v
+        if self.q is None:
+            self.deleted.difference_update(labels)
+        self.pending_add.update(labels)
+        self.pending_del.difference_update(labels)
+        self._cache = None
+
+    def delete(self, label: int):
+        if not self.has(label):
+            raise KeyError(label)
+        self.raw.pop(label, None)
+        self.delta.pop(label, None)
+        if self.q is not None and self._in_base(label):
+            self.deleted.add(label)
+        self.pending_vecs.pop(label, None)
+        self.pending_add.discard(label)
+        self.pending_del.add(label)
+        self._cache = None
+
+    def _vectors(self, labels: List[int]) -> np.ndarray:
+        return np.stack([self.pending_vecs[lab] for lab in labels])
+
+    def unchanged(self, arr: np.ndarray, labels: List[int]) -> np.ndarray:
+        # Compared as stored: the raw vector while untrained, else the (list, codes) it encodes to
+        out = np.zeros(len(labels), dtype=bool)
+        arr = self._normalize(self.project(np.asarray(arr, dtype=np.float32)))
+        if self.q is None:
+            for i, lab in enumerate(labels):
+                if lab in self.raw:
+                    out[i] = np.abs(self.raw[lab] - arr[i]).max() <= 1e-5
+            return out
+        lists, codes = self.q.encode(arr)
+        labs = np.asarray(labels, dtype=np.int64)
+        in_base = np.isin(self.ids, labs)
+        pos = {int(lab): int(p) for p, lab in zip(np.flatnonzero(in_base), np.asarray(self.ids)[in_base])}
+        for i, lab in enumerate(labels):
+            if lab in self.delta:
+                dl, dc = self.delta[lab]
+                out[i] = dl == lists[i] and np.array_equal(dc, codes[:, i])
+            elif lab in pos and lab not in self.deleted:
+                p = pos[lab]
+                base_list = int(np.searchsorted(self.offsets, p, side="right")) - 1
+                out[i] = base_list == lists[i] and np.array_equal(self.codes[:, p], codes[:, i])
+        return out
+
+    def build(self, arr: np.ndarray, labels: List[int]):
+        self._init_new(0)
+        if not labels:
+            self.base_dirty = True
+            return
+        arr = self._normalize(self.project(arr))
+        if len(labels) < _IVF_MIN_TRAIN:
+            self.raw = dict(zip(labels, arr))
+            self.base_dirty = True
+            return
+        cfg = self.tuning or {}
+        n = len(labels)
+        rng = np.random.default_rng(0)
+        sample = arr[rng.choice(n, min(n, _IVF_TRAIN_SAMPLE), replace=False)]
+        nlist = int(cfg.get("nlist") or _IVF_NLIST or ivfpq.default_nlist(n))
+        m = int(cfg.get("pq_m") or _IVF_PQ_M or ivfpq.default_m(self.dim))
+        with stage("ivfpq_train"):
+            self.q = ivfpq.Quantizer.train(sample, nlist, m)
+        lists, codes = self.q.encode(arr)
+        self._set_base(np.asarray(labels, dtype=np.int64), lists, codes)
+
+    def _set_base(self, ids: np.ndarray, lists: np.ndarray, codes: np.ndarray):
+        order, self.offsets = ivfpq.group(lists, self.q.nlist)
+        self.ids = ids[order]
+        self.codes = np.ascontiguousarray(codes[:, order])
+        self.sorted_ids = np.sort(ids)
+        self.base_dirty = True
+        self._cache = None
+
+    def _fold(self):
+        """Merge the delta into the posting lists, dropping masked entries."""
+        keep = ~np.isin(self.ids, self._masked())
+        lists = np.repeat(np.arange(self.q.nlist), np.diff(self.offsets))[keep]
+        d_ids, d_lists, d_codes = self._delta_arrays()
+        self._set_base(np.concatenate([np.asarray(self.ids)[keep], d_ids]),
+                       np.concatenate([lists, d_lists]),
+                       np.concatenate([np.asarray(self.codes)[:, keep], d_codes], axis=1))
+        self.delta, self.deleted = {}, set()
+
+    def compact(self):
+        # Folding drops masked entries; it is a NumPy pass over the codes, done under the lock
+        with timed_lock(self.lock, "ann_index", "compact"):
+            if self.q is not None:
+                self._fold()
+            self.save()
+
+    def _masked(self) -> np.ndarray:
+        return np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))
+
+    def _delta_arrays(self) -> tuple:
+        if self._cache is None:
+            labels = list(self.delta)
+            m = self.q.m if self.q is not None else 0
+            self._cache = (
+                np.asarray(labels, dtype=np.int64),
+                np.asarray([self.delta[lab][0] for lab in labels], dtype=np.int64),
+                np.stack([self.delta[lab][1] for lab in labels], axis=1) if labels else np.empty((m, 0), np.uint8),
+                self._masked(),
+            )
+        return self._cache[:3]
+
+    def knn(self, q: np.ndarray, n: int) -> Tuple[List[int], List[float]]:
+        qv = self._normalize(q)[0]
+        if self.q is None:
+            labels = list(self.raw)
+            sims = np.stack([self.raw[lab] for lab in labels]) @ qv
+            ids = np.asarray(labels, dtype=np.int64)
+        else:
+            cs = self.q.centroids @ qv
+            nprobe = min(self.nprobe, self.q.nlist)
+            probe = np.sort(np.argpartition(-cs, nprobe - 1)[:nprobe])
+            lut = self.q.lut(qv)
+            d_ids, d_lists, d_codes = self._delta_arrays()
+            masked = self._cache[3]
+            parts_ids, parts_sims = [], []
+            rows = ivfpq.probe_rows(self.offsets, probe)
+            if rows is not None:
+                ids = np.asarray(self.ids[rows])
+                list_of = np.repeat(probe, np.diff(self.offsets)[probe])
+                sims = self.q.score(lut, self.codes[:, rows], cs[list_of])
+                if len(masked):
+                    keep = ~np.isin(ids, masked)
+                    ids, sims = ids[keep], sims[keep]
+                parts_ids.append(ids)
+                parts_sims.append(sims)
+            if len(d_ids):
+                sel = np.isin(d_lists, probe)
+                if sel.any():
+                    parts_ids.append(d_ids[sel])
+                    parts_sims.append(self.q.score(lut, d_codes[:, sel], cs[d_lists[sel]]))
+            if not parts_ids:
+                return [], []
+            ids, sims = np.concatenate(parts_ids), np.concatenate(parts_sims)
+        n = min(n, len(ids))
+        if n <= 0:
+            return [], []
+        part = np.argpartition(-sims, n - 1)[:n]
+        order = part[np.argsort(-sims[part])]
+        return ids[order].tolist(), (1.0 - sims[order]).astype(float).tolist()
+
+    def live(self) -> int:
+        if self.q is None:
+            return len(self.raw)
+        return len(self.ids) - len(self.deleted) + len(self.delta)
+
+    def count(self) -> int:
+        return len(self.ids) + len(self.delta) + len(self.raw)
+
+    def mapped_bytes(self) -> int:
+        return int(self.ids.nbytes + self.codes.nbytes + self.sorted_ids.nbytes)
+
+    def memory_estimate(self) -> int:
+        """Centroids, codebooks, offsets, delta and masks; the mmap'd posting lists are in mapped_bytes."""
+        n = self.offsets.nbytes + len(self.deleted) * 60 + len(self.pending_vecs) * (self.dim * 4 + 100)
+        n += len(self.raw) * (self.dim * 4 + 100)
+        if self.q is not None:
+            n += self.q.centroids.nbytes + self.q.codebooks.nbytes + len(self.delta) * (self.q.m + 150)
+        if not isinstance(self.codes, np.memmap):
+            n += self.mapped_bytes()  # built but not yet written
+        return n
+
+    def describe(self) -> dict:
+        return {
+            "trained": self.q is not None,
+            "nlist": self.q.nlist if self.q is not None else None,
+            "pq_m": self.q.m if self.q is not None else None,
+            "nprobe": self.nprobe,
+            "delta": len(self.delta) + len(self.raw),
+            "mapped_bytes": self.mapped_bytes(),
+        }
@@ -0,0 +1,322 @@
+# ann_maintenance.py
+# Background upkeep for the ANN indexes. warm_up() loads (or rebuilds) every
+# index that has rows in event_embeddings so no user request pays for it.
+# check_health() compares each loaded index against event_embeddings and flags
+# keys that need compaction (too many tombstones) or a rebuild (index and table
+# disagree on how many vectors exist); the periodic check compacts the former in
+# the background (ANN_AUTO_COMPACT). reconcile() fixes drift in place: it adds
+# rows the index is missing, deletes labels whose rows are gone and re-inserts
+# rows updated since the last pass.
+from __future__ import annotations
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+import json, logging, os, threading, time
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from db.database import engine
+from db.models import EventEmbedding, EventEmbeddingNext
+import ann_index
+from ann_index import IndexKey
+
+ANN_HEALTH_INTERVAL_SECONDS = float(os.getenv("ANN_HEALTH_INTERVAL_SECONDS", "300"))  # 0 disables
+ANN_MAX_DELETED_FRACTION = float(os.getenv("ANN_MAX_DELETED_FRACTION", "0.2"))
+ANN_AUTO_COMPACT = os.getenv("ANN_AUTO_COMPACT", "1") != "0"  # compact flagged indexes after each health check
+ANN_MAX_COUNT_DRIFT = float(os.getenv("ANN_MAX_COUNT_DRIFT", "0.01"))  # fraction of the table count
+ANN_WARMUP = os.getenv("ANN_WARMUP", "1") != "0"
+ANN_WARMUP_PROBES = int(os.getenv("ANN_WARMUP_PROBES", "8"))  # probe queries per key after loading
+ANN_WARM_RETRY_SECONDS = float(os.getenv("ANN_WARM_RETRY_SECONDS", "30"))  # min gap between on-demand warms of a key
+ANN_RECONCILE_INTERVAL_SECONDS = float(os.getenv("ANN_RECONCILE_INTERVAL_SECONDS", "600"))  # 0 disables
+ANN_RECONCILE_BATCH = int(os.getenv("ANN_RECONCILE_BATCH", "2000"))  # rows per scan / vector fetch / upsert
+
+logger = logging.getLogger("ISolution.ann")
+
+_last_report: Optional[dict] = None
+_last_warmup: Optional[dict] = None
+_last_reconcile: Optional[dict] = None
+_compactions: deque = deque(maxlen=20)  # most recent compaction results
+_reconciled_at: Dict[IndexKey, datetime] = {}  # key -> start of its last reconcile (app clock, naive UTC)
+_warming: set = set()                # keys with a warm-up thread in flight
+_warmed_at: Dict[object, float] = {}  # key -> monotonic time of its last on-demand warm
+_warm_lock = threading.Lock()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_reconcile_thread: Optional[threading.Thread] = None
+
+def embedding_counts(db: Session) -> Dict[IndexKey, int]:
+    """
+    event_embeddings row count per (model_name, task_type, dim), plus the
+    migration staging rows that feed the target model's index.
+    """
+    counts: Dict[IndexKey, int] = {}
+    for table in (EventEmbedding, EventEmbeddingNext):
+        rows = (
+            db.query(table.model_name, table.task_type, table.dim, func.count())
+            .group_by(table.model_name, table.task_type, table.dim)
+            .all()
+        )
+        for m, t, d, n in rows:
+            counts[(m, t, d)] = counts.get((m, t, d), 0) + n
+    return counts
+
+def _drifted(live: int, want: int) -> bool:
+    return abs(live - want) > max(1, int(want * ANN_MAX_COUNT_DRIFT))
+
+def check_health(db: Session) -> dict:
+    """Flag loaded indexes that should be compacted or rebuilt; also keeps the result for last_report()."""
+    global _last_report
+    expected = embedding_counts(db)
+    keys = []
+    for st in ann_index.stats():
+        key = (st["model_name"], st["task_type"], st["dim"])
+        want = expected.get(key, 0)
+        drift = st["live"] - want
+        flags = []
+        if st["deleted_fraction"] > ANN_MAX_DELETED_FRACTION:
+            flags.append("compact")
+        if _drifted(st["live"], want):
+            flags.append("rebuild")
+        keys.append({**st, "expected": want, "count_drift": drift, "flags": flags})
+        if flags:
+            logger.warning(
+                "ANN index %s needs %s: live=%d expected=%d tombstones=%d (%.1f%%)",
+                key, "+".join(flags), st["live"], want, st["tombstones"], 100 * st["deleted_fraction"],
+            )
+    _last_report = {"checked_at": time.time(), "indexes": keys}
+    return _last_report
+
+def last_report() -> Optional[dict]:
+    return _last_report
+
+def compact_key(key: IndexKey, min_deleted_fraction: float = 0.0) -> Optional[dict]:
+    """Compact one loaded index (see ann_index.compact()) and remember the result."""
+    try:
+        res = ann_index.compact(key, min_deleted_fraction)
+    except Exception as e:
+        logger.warning("ANN compaction of %s failed: %s", key, e)
+        res = {"key": list(key), "error": str(e)}
+    if res is not None:
+        _compactions.append({**res, "finished_at": time.time()})
+    return res
+
+def compact_flagged(report: dict) -> List[dict]:
+    """Compact every index check_health() flagged for it."""
+    out = []
+    for st in report["indexes"]:
+        if "compact" in st["flags"]:
+            res = compact_key((st["model_name"], st["task_type"], st["dim"]), ANN_MAX_DELETED_FRACTION)
+            if res is not None:
+                out.append(res)
+    return out
+
+def last_compactions() -> List[dict]:
+    return list(_compactions)
+
+# ---------------------------
+# warm-up
+# ---------------------------
+def _table_for(db: Session, key: IndexKey):
+    m, t, d = key
+    # A migration target's vectors are still in the staging table
+    return EventEmbeddingNext if db.query(EventEmbeddingNext.id).filter(
+        EventEmbeddingNext.model_name == m, EventEmbeddingNext.dim == d).first() else EventEmbedding
+
+def _rebuild_from_table(db: Session, key: IndexKey) -> int:
+    m, t, d = key
+    table = _table_for(db, key)
+    rows = (
+        db.query(table.event_id, table.vector)
+        .filter(table.model_name == m, table.task_type == t, table.dim == d)
+        .yield_per(1000)
+    )
+    return ann_index.rebuild(key=key, dim=d, all_items=((r.event_id, json.loads(r.vector)) for r in rows))
+
+def _probe(db: Session, key: IndexKey, n: int):
+    # A few real queries so the graph's pages are touched before users arrive
+    m, t, d = key
+    rows = (
+        db.query(EventEmbedding.vector)
+        .filter(EventEmbedding.model_name == m, EventEmbedding.task_type == t, EventEmbedding.dim == d)
+        .limit(n)
+        .all()
+    )
+    for r in rows:
+        ann_index.search(key=key, dim=d, query_vec=json.loads(r.vector), k=10)
+
+def warm_key(db: Session, key: IndexKey, expected: int) -> dict:
+    """Load the key's index from disk; rebuild it from event_embeddings if missing or out of step."""
+    t0 = time.perf_counter()
+    live = ann_index.load(key)
+    if expected and (live is None or _drifted(live, expected)):
+        action, live = "rebuilt", _rebuild_from_table(db, key)
+    else:
+        action = "loaded" if live is not None else "empty"
+    if ANN_WARMUP_PROBES > 0 and live:
+        _probe(db, key, ANN_WARMUP_PROBES)
+    res = {"key": list(key), "action": action, "live": live or 0, "expected": expected,
+           "seconds": round(time.perf_counter() - t0, 3)}
+    logger.info("ANN warm-up %s: %s %d vectors in %.2fs", key, action, res["live"], res["seconds"])
+    return res
+
+def warm_up(keys: Optional[Iterable[IndexKey]] = None) -> dict:
+    """Warm every key in event_embeddings (or just `keys`). Blocking; see request_warm() for the async form."""
+    global _last_warmup
+    t0 = time.perf_counter()
+    out = []
+    with Session(engine) as db:
+        expected = embedding_counts(db)
+        for key in (keys if keys is not None else expected):
+            try:
+                out.append(warm_key(db, key, expected.get(key, 0)))
+            except Exception as e:
+                logger.warning("ANN warm-up of %s failed: %s", key, e)
+                out.append({"key": list(key), "action": "failed", "error": str(e)})
+    _last_warmup = {"finished_at": time.time(), "seconds": round(time.perf_counter() - t0, 3), "keys": out}
+    return _last_warmup
+
+def last_warmup() -> Optional[dict]:
+    return _last_warmup
+
+def request_warm(key: Optional[IndexKey] = None) -> bool:
+    """
+    Warm one key (or all, key=None) in a background thread. Returns False if
+    that warm-up is already running or ran less than ANN_WARM_RETRY_SECONDS
+    ago. Safe to call from request handlers.
+    """
+    tag = key if key is not None else "*"
+    now = time.monotonic()
+    with _warm_lock:
+        if tag in _warming or now - _warmed_at.get(tag, -ANN_WARM_RETRY_SECONDS) < ANN_WARM_RETRY_SECONDS:
+            return False
+        _warming.add(tag)
+        _warmed_at[tag] = now
+
+    def run():
+        try:
+            warm_up([key] if key is not None else None)
+        finally:
+            with _warm_lock:
+                _warming.discard(tag)
+
+    threading.Thread(target=run, name="ann-warmup", daemon=True).start()
+    return True
+
+# ---------------------------
+# reconcile
+# ---------------------------
+_SINCE_OVERLAP = timedelta(seconds=5)  # rows committed just before a pass started
+
+def reconcile_key(db: Session, key: IndexKey) -> dict:
+    """
+    Bring the key's loaded index in line with its table, in batches: upsert
+    rows it lacks or that changed since the last pass (or, on the first pass,
+    since the index was last saved), delete labels with no row. Rows updated
+    since but holding the same vector are left alone. Keys that aren't loaded
+    in this worker are skipped; warm-up handles those.
+    """
+    m, t, d = key
+    t0 = time.perf_counter()
+    # Same clock the app stamps updated_at with; _SINCE_OVERLAP covers skew between workers
+    started = datetime.utcnow()
+    have = ann_index.labels(key)
+    if have is None:
+        return {"key": list(key), "action": "not_loaded"}
+    since = _reconciled_at.get(key)
+    if since is None:
+        saved_at = next((st["saved_at"] for st in ann_index.stats(key)), None)
+        since = datetime.fromtimestamp(saved_at, timezone.utc).replace(tzinfo=None) if saved_at else None
+    table = _table_for(db, key)
+    cols = (table.model_name == m, table.task_type == t, table.dim == d)
+
+    in_table, upsert, missing = set(), [], 0
+    for r in db.query(table.event_id, table.updated_at).filter(*cols).yield_per(ANN_RECONCILE_BATCH):
+        in_table.add(r.event_id)
+        if r.event_id not in have:
+            upsert.append(r.event_id)
+            missing += 1
+        elif since is not None and r.updated_at is not None and r.updated_at > since - _SINCE_OVERLAP:
+            upsert.append(r.event_id)
+
+    added = reinserted = 0
+    for i in range(0, len(upsert), ANN_RECONCILE_BATCH):
+        chunk = upsert[i:i + ANN_RECONCILE_BATCH]
+        rows = db.query(table.event_id, table.vector).filter(*cols, table.event_id.in_(chunk)).all()
+        if not rows:
+            continue
+        labels = [r.event_id for r in rows]
+        vecs = np.asarray([json.loads(r.vector) for r in rows], dtype=np.float32)
+        # updated_at also moves for unchanged vectors (re-saves, the first pass's saved_at guess)
+        changed = ~ann_index.unchanged(key, labels, vecs)
+        reinserted += sum(1 for lab, c in zip(labels, changed) if c and lab in have)
+        if changed.any():
+            added += ann_index.add_or_update(
+                key, d, zip(np.asarray(labels)[changed].tolist(), vecs[changed]), save=False)
+    removed = ann_index.remove_many(key, d, have - in_table, save=False)
+    if added or removed:
+        ann_index.save_index(key)
+    _reconciled_at[key] = started
+    res = {"key": list(key), "action": "reconciled", "rows": len(in_table), "missing": missing,
+           "reinserted": reinserted, "orphans_removed": removed,
+           "seconds": round(time.perf_counter() - t0, 3)}
+    if missing or removed or reinserted:
+        logger.info("ANN reconcile %s: added %d missing, removed %d orphans, re-inserted %d updated",
+                    key, missing, removed, reinserted)
+    return res
+
+def reconcile(keys: Optional[Iterable[IndexKey]] = None) -> dict:
+    """Reconcile every key with rows in the embedding tables (or just `keys`)."""
+    global _last_reconcile
+    t0 = time.perf_counter()
+    out = []
+    with Session(engine) as db:
+        for key in (keys if keys is not None else embedding_counts(db)):
+            try:
+                out.append(reconcile_key(db, key))
+            except Exception as e:
+                logger.warning("ANN reconcile of %s failed: %s", key, e)
+                out.append({"key": list(key), "action": "failed", "error": str(e)})
+    _last_reconcile = {"finished_at": time.time(), "seconds": round(time.perf_counter() - t0, 3), "keys": out}
+    return _last_reconcile
+
+def last_reconcile() -> Optional[dict]:
+    return _last_reconcile
+
+# ---------------------------
+# periodic health check / reconcile
+# ---------------------------
+def _health_loop():
+    while not _stop.wait(ANN_HEALTH_INTERVAL_SECONDS):
+        try:
+            with Session(engine) as db:
+                report = check_health(db)
+            if ANN_AUTO_COMPACT:
+                compact_flagged(report)
+        except Exception as e:
+            logger.warning("ANN health check failed: %s", e)
+
+def _reconcile_loop():
+    while not _stop.wait(ANN_RECONCILE_INTERVAL_SECONDS):
+        try:
+            reconcile()
+        except Exception as e:
+            logger.warning("ANN reconcile failed: %s", e)
+
+def start_health_checks():
+    """Start the periodic health check and reconcile threads (each off when its interval is <= 0)."""
+    global _thread, _reconcile_thread
+    _stop.clear()
+    if ANN_HEALTH_INTERVAL_SECONDS > 0 and (_thread is None or not _thread.is_alive()):
+        _thread = threading.Thread(target=_health_loop, name="ann-health", daemon=True)
+        _thread.start()
+    if ANN_RECONCILE_INTERVAL_SECONDS > 0 and (_reconcile_thread is None or not _reconcile_thread.is_alive()):
+        _reconcile_thread = threading.Thread(target=_reconcile_loop, name="ann-reconcile", daemon=True)
+        _reconcile_thread.start()
+
+def stop():
+    global _thread, _reconcile_thread
+    _stop.set()
+    for th in (_thread, _reconcile_thread):
+        if th is not None:
+            th.join(timeout=5)
+    _thread = _reconcile_thread = None
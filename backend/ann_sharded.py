@@ -0,0 +1,226 @@
+# ann_sharded.py
+# A key split by shard_of() across ANN_SHARDS indexes of one backend, each with
+# its own file, lock and generation. Searches fan out on a thread pool (hnswlib
+# and NumPy release the GIL) and merge the per-shard hits; rebuilds, loads and
+# saves run the shards in parallel.
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Tuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import os, threading, time
+import numpy as np
+from ann_base import IndexKey, _Index, _RERANK_FACTOR, _fname, coarse_dim_for, shard_of, tuning_for
+from metrics import timed_lock
+
+_SHARD_THREADS = int(os.getenv("ANN_SHARD_THREADS", "0"))  # 0 = one per core
+
+def _in_parallel(fn, items) -> list:
+    # Short-lived pool for per-shard builds/loads/saves (kept off the search pool
+    # so a long rebuild never queues searches behind it)
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(x) for x in items]
+    with ThreadPoolExecutor(max_workers=min(len(items), _SHARD_THREADS or os.cpu_count() or 1),
+                            thread_name_prefix="ann-build") as ex:
+        return list(ex.map(fn, items))
+
+_search_pool: Optional[ThreadPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+def _get_search_pool() -> ThreadPoolExecutor:
+    global _search_pool
+    with _POOL_LOCK:
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(max_workers=_SHARD_THREADS or os.cpu_count() or 1,
+                                              thread_name_prefix="ann-search")
+        return _search_pool
+
+class _NoLock:
+    def acquire(self, *a, **kw):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class _ShardedIndex:
+    """
+    A key split by shard_of() across `n` indexes of one backend. Offers the
+    _Index surface the module functions use; each shard keeps its own lock, so
+    the wrapper's lock is a no-op and every operation locks just the shards it
+    touches. Rebuilt shards are built off to the side and swapped in, with
+    writes made meanwhile replayed onto them.
+    """
+
+    def __init__(self, cls, space: str, dim: int, key: IndexKey, n: int):
+        self.cls = cls
+        self.space = space
+        self.full_dim = dim
+        self.coarse_dim = coarse_dim_for(key)
+        self.dim = self.coarse_dim or dim
+        self.key = key
+        self.n = n
+        self.path = _fname(key)   # names the set; each shard has its own file
+        self.lossy = cls.lossy
+        self.lock = _NoLock()
+        self.shards = [cls(space, dim, key, path=_fname(key, i)) for i in range(n)]
+        self._journal: Dict[int, list] = {}  # shard -> writes made while it rebuilds
+        self.used_at = time.time()
+        self.apply_tuning()
+
+    project = _Index.project
+
+    def apply_tuning(self):
+        self.tuning = tuning_for(self.key)
+        self.rerank_factor = int((self.tuning or {}).get("rerank_factor", _RERANK_FACTOR))
+        for sh in self.shards:
+            with sh.lock:
+                sh.apply_tuning()
+
+    @contextmanager
+    def _shard(self, i: int, op: str):
+        # Lock shard i; if a rebuild swapped it while we waited, lock the new one
+        while True:
+            sh = self.shards[i]
+            with timed_lock(sh.lock, "ann_shard", op):
+                if self.shards[i] is sh:
+                    yield sh
+                    return
+
+    def _split(self, labels: List[int]) -> Dict[int, np.ndarray]:
+        part = shard_of(labels, self.n)
+        return {int(i): np.flatnonzero(part == i) for i in np.unique(part)}
+
+    def _load_or_new(self, expected_capacity: int):
+        per = -(-expected_capacity // self.n)
+        _in_parallel(lambda sh: sh._load_or_new(per), self.shards)
+
+    def loaded(self) -> bool:
+        return all(sh.loaded() for sh in self.shards)
+
+    def has(self, label: int) -> bool:
+        return self.shards[int(shard_of(label, self.n)[0])].has(label)
+
+    def live_labels(self) -> set:
+        out = set()
+        for sh in self.shards:
+            with sh.lock:
+                out |= sh.live_labels()
+        return out
+
+    def unchanged(self, arr: np.ndarray, labels: List[int]) -> np.ndarray:
+        out = np.zeros(len(labels), dtype=bool)
+        for i, idx in self._split(labels).items():
+            with self._shard(i, "unchanged") as sh:
+                out[idx] = sh.unchanged(arr[idx], [labels[j] for j in idx])
+        return out
+
+    def add(self, arr: np.ndarray, labels: List[int]):
+        for i, idx in self._split(labels).items():
+            labs = [labels[j] for j in idx]
+            with self._shard(i, "add") as sh:
+                sh.add(arr[idx], labs)
+                sh.dirty = True
+                if i in self._journal:
+                    self._journal[i].append((arr[idx], labs))
+
+    def delete(self, label: int):
+        i = int(shard_of(label, self.n)[0])
+        with self._shard(i, "remove") as sh:
+            sh.delete(label)
+            sh.dirty = True
+            if i in self._journal:
+                self._journal[i].append((None, [label]))
+
+    def save(self, merge: bool = True):
+        def one(i):
+            with self._shard(i, "save") as sh:
+                if sh.dirty or sh.pending_add or sh.pending_del:
+                    sh.save(merge)
+        _in_parallel(one, range(self.n))
+
+    def rebuild(self, arr: np.ndarray, labels: List[int], only: Optional[Iterable[int]] = None) -> int:
+        """Rebuild the shards in `only` (default all) from the items that hash to them; returns how many went in."""
+        parts = self._split(labels)
+        targets = sorted({int(i) for i in only}) if only is not None else list(range(self.n))
+
+        def one(i):
+            with self._shard(i, "rebuild"):
+                self._journal[i] = []
+            idx = parts.get(i, np.empty(0, dtype=np.int64))
+            fresh = self.cls(self.space, self.full_dim, self.key, path=_fname(self.key, i))
+            fresh.build(arr[idx], [labels[j] for j in idx])
+            with self._shard(i, "rebuild"):
+                for vecs, labs in self._journal.pop(i):
+                    if vecs is not None:
+                        fresh.add(vecs, labs)
+                    elif fresh.has(labs[0]):
+                        fresh.delete(labs[0])
+                fresh.save(merge=False)
+                self.shards[i] = fresh
+            return len(idx)
+        return sum(_in_parallel(one, targets))
+
+    def knn(self, q: np.ndarray, n: int) -> Tuple[List[int], List[float]]:
+        def one(sh):
+            with timed_lock(sh.lock, "ann_shard", "search"):
+                live = sh.live() if sh.loaded() else 0
+                return sh.knn(q, min(n, live)) if live else ([], [])
+        shards = list(self.shards)
+        parts = list(_get_search_pool().map(one, shards)) if len(shards) > 1 else [one(sh) for sh in shards]
+        labs = [lab for p in parts for lab in p[0]]
+        dists = np.asarray([d for p in parts for d in p[1]], dtype=np.float64)
+        order = np.argsort(dists, kind="stable")[:n]
+        return [labs[i] for i in order], dists[order].tolist()
+
+    @property
+    def dirty(self) -> bool:
+        return any(sh.dirty for sh in self.shards)
+
+    @dirty.setter
+    def dirty(self, value: bool):
+        pass  # add()/delete() mark the shards they touched
+
+    @property
+    def generation(self) -> int:
+        return sum(sh.generation for sh in self.shards)  # moves whenever any shard saves or reloads
+
+    @property
+    def saved_at(self) -> Optional[float]:
+        times = [sh.saved_at for sh in self.shards if sh.saved_at is not None]
+        return max(times) if times else None
+
+    @property
+    def loaded_at(self) -> float:
+        return min(sh.loaded_at for sh in self.shards)
+
+    def live(self) -> int:
+        return sum(sh.live() for sh in self.shards)
+
+    def count(self) -> int:
+        return sum(sh.count() for sh in self.shards)
+
+    def capacity(self) -> int:
+        return sum(sh.capacity() for sh in self.shards)
+
+    def memory_estimate(self) -> int:
+        return sum(sh.memory_estimate() for sh in self.shards)
+
+    sizes = _Index.sizes
+
+    def file_bytes(self) -> Optional[int]:
+        sizes = [b for b in (sh.file_bytes() for sh in self.shards) if b is not None]
+        return sum(sizes) if sizes else None
+
+    def describe(self) -> dict:
+        out = {}
+        for sh in self.shards:
+            for k, v in sh.describe().items():
+                # sizes add up across shards; settings are the same in each
+                out[k] = out[k] + v if k in ("capacity", "delta", "mapped_bytes") and k in out else out.get(k, v)
+        return {"shards": self.n, "shard_live": [sh.live() for sh in self.shards], **out}
@@ -1,30 +1,167 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import datetime, timedelta
+from typing import Callable, Dict, NamedTuple, Optional, Tuple, TypeVar
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from passlib.hash import bcrypt
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, noload
 from db.database import get_db
 from db.models import User
+from metrics import counter, histogram
 
 SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret")
 ALGO = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 
+# Short-lived cache of decoded tokens -> principal, so repeat requests with the
+# same bearer token skip both the JWT decode and the users lookup.
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+# Password hashing runs on its own small pool so a login storm can't take every
+# request thread. bcrypt releases the GIL, so threads are enough here.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_DEPTH = int(os.getenv("PASSWORD_QUEUE_DEPTH", "16"))
+PASSWORD_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_TIMEOUT_SECONDS", "10"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+class Principal(NamedTuple):
+    """Lightweight projection of the authenticated user (no ORM row, no joins)."""
+    id: int
+    username: str
+
+# token -> (expires_at on the monotonic clock, principal)
+_PRINCIPALS: Dict[str, Tuple[float, Principal]] = {}
+_PRINCIPALS_LOCK = threading.Lock()
+
+_bcrypt = bcrypt.using(rounds=BCRYPT_ROUNDS)
+_PASSWORD_POOL = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="password")
+# Running + queued jobs; anything beyond this is rejected immediately
+_PASSWORD_SLOTS = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE_DEPTH)
+
+_PASSWORD_SECONDS = histogram(
+    "auth_password_seconds",
+    "bcrypt hash/verify time on the password pool",
+    labelnames=("op",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+_PASSWORD_WAIT_SECONDS = histogram(
+    "auth_password_queue_wait_seconds",
+    "Time password jobs spend queued before a worker picks them up",
+    labelnames=("op",),
+)
+_PASSWORD_REJECTED = counter(
+    "auth_password_rejected_total",
+    "Password jobs rejected because the pool was saturated or the job timed out",
+    labelnames=("op",),
+)
+
+T = TypeVar("T")
+
+def _busy(op: str) -> HTTPException:
+    _PASSWORD_REJECTED.inc(op=op)
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many concurrent sign-ins, try again shortly",
+        headers={"Retry-After": "1"},
+    )
+
+def _run_password_job(op: str, fn: Callable[..., T], *args) -> T:
+    if not _PASSWORD_SLOTS.acquire(blocking=False):
+        raise _busy(op)
+    submitted = time.perf_counter()
+
+    def job():
+        started = time.perf_counter()
+        _PASSWORD_WAIT_SECONDS.observe(started - submitted, op=op)
+        try:
+            return fn(*args)
+        finally:
+            _PASSWORD_SECONDS.observe(time.perf_counter() - started, op=op)
+
+    try:
+        fut = _PASSWORD_POOL.submit(job)
+    except BaseException:
+        _PASSWORD_SLOTS.release()
+        raise
+    fut.add_done_callback(lambda _f: _PASSWORD_SLOTS.release())
+    try:
+        return fut.result(timeout=PASSWORD_TIMEOUT_SECONDS)
+    except FutureTimeout:
+        fut.cancel()  # drops it if still queued; a running hash finishes and frees its slot
+        raise _busy(op)
+
 def hash_password(p: str) -> str:
-    return bcrypt.hash(p)
+    return _run_password_job("hash", _bcrypt.hash, p)
 
 def verify_password(p: str, hashed: str) -> bool:
-    return bcrypt.verify(p, hashed)
+    return _run_password_job("verify", _bcrypt.verify, p, hashed)
+
+def verify_and_update(p: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and, when the stored hash uses a different work factor
+    than BCRYPT_ROUNDS, return a fresh hash to store (else None).
+    """
+    def job():
+        if not _bcrypt.verify(p, hashed):
+            return False, None
+        if _bcrypt.needs_update(hashed):
+            return True, _bcrypt.hash(p)
+        return True, None
+    return _run_password_job("verify", job)
 
 def create_access_token(sub: str) -> str:
     exp = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     return jwt.encode({"sub": sub, "exp": exp}, SECRET_KEY, algorithm=ALGO)
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> User:
+def _cache_get(token: str) -> Optional[Principal]:
+    hit = _PRINCIPALS.get(token)
+    if hit is None:
+        return None
+    expires_at, principal = hit
+    if expires_at < time.monotonic():
+        with _PRINCIPALS_LOCK:
+            _PRINCIPALS.pop(token, None)
+        return None
+    return principal
+
+def _cache_put(token: str, principal: Principal, token_exp: Optional[float]):
+    if AUTH_CACHE_TTL_SECONDS <= 0:
+        return
+    ttl = AUTH_CACHE_TTL_SECONDS
+    if token_exp is not None:
+        # Never serve a token from cache past its own expiry
+        ttl = min(ttl, token_exp - time.time())
+    if ttl <= 0:
+        return
+    with _PRINCIPALS_LOCK:
+        if len(_PRINCIPALS) >= AUTH_CACHE_MAX_ENTRIES:
+            now = time.monotonic()
+            for tok in [t for t, (exp, _) in _PRINCIPALS.items() if exp < now]:
+                del _PRINCIPALS[tok]
+            if len(_PRINCIPALS) >= AUTH_CACHE_MAX_ENTRIES:
+                # dicts keep insertion order; drop the oldest entry
+                _PRINCIPALS.pop(next(iter(_PRINCIPALS)))
+        _PRINCIPALS[token] = (time.monotonic() + ttl, principal)
+
+def invalidate_user(user_id: int):
+    """Drop cached principals for a user. Principals are just (id, username), so
+    only a username or password change or a deleted account needs this."""
+    with _PRINCIPALS_LOCK:
+        for tok in [t for t, (_, p) in _PRINCIPALS.items() if p.id == user_id]:
+            del _PRINCIPALS[tok]
+
+def get_current_principal(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> Principal:
+    principal = _cache_get(token)
+    if principal is not None:
+        return principal
+
     cred_exc = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -37,7 +174,22 @@ def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_
             raise cred_exc
     except JWTError:
         raise cred_exc
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+    # Only the columns we need; avoids the joined load of User.attending
+    row = db.query(User.id, User.username).filter(User.username == username).first()
+    if not row:
         raise cred_exc
-    return user
\ No newline at end of file
+    principal = Principal(id=row.id, username=row.username)
+    _cache_put(token, principal, payload.get("exp"))
+    return principal
+
+def get_current_user(db: Session = Depends(get_db), principal: Principal = Depends(get_current_principal)) -> User:
+    """Full ORM user for endpoints that read or modify profile fields."""
+    user = db.get(User, principal.id, options=[noload(User.attending)])
+    if not user:
+        invalidate_user(principal.id)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
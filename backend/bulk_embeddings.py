@@ -0,0 +1,144 @@
+# bulk_embeddings.py
+# Bulk upload of precomputed event / user query vectors. A request body is
+# either NDJSON ({"<id field>": 1, "vector": [...]} per line) or binary:
+# n little-endian int64 ids followed by n * dim little-endian float32 values,
+# row-major (so len(body) == n * (8 + 4 * dim)). All rows are written in one
+# statement and one commit, and event vectors go to the ANN index in one
+# add_items call with one save.
+from __future__ import annotations
+from typing import List, Tuple
+import json, time
+import numpy as np
+from datetime import datetime
+from sqlalchemy.orm import Session
+from db.models import Event, User, UserQueryEmbedding
+from indexing import _dialect_insert, upsert_event_embeddings
+import ann_index
+import user_vectors
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines")
+BINARY_TYPES = ("application/octet-stream",)
+
+def parse_ndjson(body: bytes, id_field: str, dim: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids int64 [n], vectors float32 [n, dim]); dim=0 takes it from the first line."""
+    ids, vecs = [], []
+    for lineno, line in enumerate(body.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+            ids.append(int(obj[id_field]))
+            vec = obj["vector"]
+            if not isinstance(vec, list):
+                raise TypeError(f"vector is {type(vec).__name__}, not a list")
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"line {lineno}: expected {{\"{id_field}\": int, \"vector\": [...]}} ({e})")
+        dim = dim or len(vec)
+        if len(vec) != dim:
+            raise ValueError(f"line {lineno}: vector has {len(vec)} values, expected {dim}")
+        vecs.append(vec)
+    if not vecs:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, dim), dtype=np.float32)
+    arr = np.asarray(vecs, dtype=np.float32)
+    if arr.ndim != 2:
+        raise ValueError("vectors must be flat lists of numbers")
+    return np.asarray(ids, dtype=np.int64), arr
+
+def parse_binary(body: bytes, dim: int) -> Tuple[np.ndarray, np.ndarray]:
+    row = 8 + 4 * dim
+    if dim <= 0 or len(body) % row:
+        raise ValueError(f"binary body must be n int64 ids then n x {dim} float32 values ({row} bytes per row)")
+    n = len(body) // row
+    ids = np.frombuffer(body, dtype="<i8", count=n)
+    vecs = np.frombuffer(body, dtype="<f4", offset=8 * n).reshape(n, dim)
+    return ids.astype(np.int64), vecs.astype(np.float32)
+
+def parse(body: bytes, content_type: str, id_field: str, dim: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    if ctype in NDJSON_TYPES:
+        ids, vecs = parse_ndjson(body, id_field, dim)
+    elif ctype in BINARY_TYPES:
+        ids, vecs = parse_binary(body, dim)
+    else:
+        raise LookupError(f"unsupported content type {ctype!r}; send NDJSON or application/octet-stream")
+    if not np.isfinite(vecs).all():
+        raise ValueError("vectors contain NaN or infinite values")
+    return ids, vecs
+
+def encode_rows(vecs: np.ndarray) -> List[str]:
+    """
+    JSON text for each row, as stored in the vector columns. One %-format per
+    row (9 significant digits round-trips float32) is ~3x faster than json.dumps.
+    """
+    if not len(vecs):
+        return []
+    fmt = "[" + ",".join(["%.9g"] * vecs.shape[1]) + "]"
+    return [fmt % tuple(r) for r in vecs.tolist()]
+
+def _dedupe(ids: np.ndarray, vecs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Last row wins for repeated ids
+    _, last = np.unique(ids[::-1], return_index=True)
+    keep = np.sort(len(ids) - 1 - last)
+    return ids[keep], vecs[keep]
+
+def _existing(db: Session, col, ids: np.ndarray) -> np.ndarray:
+    # One range scan instead of an IN list that could exceed SQLite's parameter limit
+    if not len(ids):
+        return np.zeros(0, dtype=bool)
+    lo, hi = int(ids.min()), int(ids.max())
+    found = np.fromiter((r[0] for r in db.query(col).filter(col >= lo, col <= hi)), dtype=np.int64)
+    return np.isin(ids, found)
+
+def upload_events(db: Session, ids: np.ndarray, vecs: np.ndarray, model_name: str,
+                  task_type: str = "RETRIEVAL_DOCUMENT") -> dict:
+    t0 = time.perf_counter()
+    received = len(ids)
+    ids, vecs = _dedupe(ids, vecs)
+    known = _existing(db, Event.id, ids)
+    unknown = ids[~known]
+    ids, vecs = ids[known], vecs[known]
+    dim = vecs.shape[1] if vecs.ndim == 2 else 0
+    upsert_event_embeddings(db, [
+        dict(event_id=eid, vector=text, dim=dim, model_name=model_name, task_type=task_type, content_hash=None)
+        for eid, text in zip(ids.tolist(), encode_rows(vecs))
+    ])
+    db.commit()
+    written = time.perf_counter()
+    # If this fails the rows are committed anyway; the reconciler picks them up
+    indexed = ann_index.add_or_update((model_name, task_type, dim), dim, zip(ids.tolist(), vecs)) if len(ids) else 0
+    return {
+        "received": received, "written": len(ids), "indexed": indexed,
+        "unknown_ids": unknown[:20].tolist(), "unknown_count": len(unknown),
+        "db_seconds": round(written - t0, 3), "index_seconds": round(time.perf_counter() - written, 3),
+    }
+
+def upload_users(db: Session, ids: np.ndarray, vecs: np.ndarray, model_name: str,
+                 task_type: str = "RETRIEVAL_QUERY") -> dict:
+    t0 = time.perf_counter()
+    received = len(ids)
+    ids, vecs = _dedupe(ids, vecs)
+    known = _existing(db, User.id, ids)
+    unknown = ids[~known]
+    ids, vecs = ids[known], vecs[known]
+    dim = vecs.shape[1] if vecs.ndim == 2 else 0
+    if len(ids):
+        insert = _dialect_insert(db)
+        stmt = insert(UserQueryEmbedding)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserQueryEmbedding.user_id],
+            set_={c: stmt.excluded[c] for c in ("vector", "dim", "model_name", "task_type", "updated_at")},
+        )
+        now = datetime.utcnow()
+        db.execute(stmt, [
+            dict(user_id=uid, vector=text, dim=dim, model_name=model_name, task_type=task_type,
+                 created_at=now, updated_at=now)
+            for uid, text in zip(ids.tolist(), encode_rows(vecs))
+        ])
+        db.commit()
+        for uid in ids.tolist():
+            user_vectors.invalidate(uid)
+    return {
+        "received": received, "written": len(ids),
+        "unknown_ids": unknown[:20].tolist(), "unknown_count": len(unknown),
+        "db_seconds": round(time.perf_counter() - t0, 3),
+    }
@@ -1,11 +1,10 @@
-import os
+import logging, os
 from pathlib import Path
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 BACKEND_DIR = Path(__file__).resolve().parents[1]
 DEFAULT_DB = BACKEND_DIR / "data" / "app.db"
-DEFAULT_DB.parent.mkdir(parents=True, exist_ok=True)
 
 def normalize_sqlite_url(url: str) -> str:
     if not url.startswith("sqlite"):
@@ -18,7 +17,7 @@ def normalize_sqlite_url(url: str) -> str:
     p.parent.mkdir(parents=True, exist_ok=True)
     return f"sqlite:///{p.as_posix()}"
 
-DATABASE_URL = f"sqlite:///{DEFAULT_DB.as_posix()}"
+DATABASE_URL = normalize_sqlite_url(os.getenv("DATABASE_URL", f"sqlite:///{DEFAULT_DB.as_posix()}"))
 
 engine = create_engine(
     DATABASE_URL,
@@ -27,6 +26,35 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+def ensure_schema():
+    """
+    create_all() plus ALTER TABLE ... ADD COLUMN for nullable columns and CREATE INDEX
+    for indexes that were added to the models after a table was created (create_all
+    skips existing tables).
+    Import db.models before calling so the metadata is populated.
+    """
+    Base.metadata.create_all(bind=engine)
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in have or not col.nullable:
+                    continue
+                ddl = col.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {ddl}'))
+    for table in Base.metadata.sorted_tables:
+        have = {i["name"] for i in insp.get_indexes(table.name)}
+        for idx in table.indexes:
+            if idx.name in have:
+                continue
+            try:
+                with engine.begin() as conn:
+                    idx.create(conn, checkfirst=True)
+            except Exception as e:
+                # e.g. existing rows violate a new unique index, or another worker created it first
+                logging.getLogger("ISolution.db").warning("Could not create index %s: %s", idx.name, e)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -117,6 +117,7 @@ class EventEmbedding(Base):
     # Metadata to track which embed model/version was used
     model_name = Column(String, nullable=False)   # e.g., "gemini-embed-text"
     task_type  = Column(String, nullable=False)   # "RETRIEVAL_DOCUMENT"
+    content_hash = Column(String, nullable=True)  # sha256 of the embeddings.event_text() that was embedded
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -139,3 +140,57 @@ class UserQueryEmbedding(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user = relationship("User", back_populates="query_embedding")
+
+
+# --- Embedding model migrations (see migration.py) ---
+# While a migration runs, the new model's vectors are written to these staging
+# tables (same columns as the live ones); cutover moves them into the live
+# tables in one transaction.
+class EventEmbeddingNext(Base):
+    __tablename__ = "event_embeddings_next"
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, ForeignKey("events.id"), nullable=False, unique=True, index=True)
+    vector = Column(String, nullable=False)
+    dim    = Column(Integer, nullable=False)
+    model_name = Column(String, nullable=False)
+    task_type  = Column(String, nullable=False)
+    content_hash = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class UserQueryEmbeddingNext(Base):
+    __tablename__ = "user_query_embeddings_next"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True, index=True)
+    vector = Column(String, nullable=False)
+    dim    = Column(Integer, nullable=False)
+    model_name = Column(String, nullable=False)
+    task_type  = Column(String, nullable=False)
+    content_hash = Column(String, nullable=True)  # sha256 of the user_text() that was embedded
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class EmbeddingMigration(Base):
+    __tablename__ = "embedding_migrations"
+    id = Column(Integer, primary_key=True)
+    source_model = Column(String, nullable=False)
+    source_dim   = Column(Integer, nullable=False)
+    target_model = Column(String, nullable=False)
+    target_dim   = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="running")  # running | cut_over | cancelled
+    events_total = Column(Integer, default=0)
+    events_done  = Column(Integer, default=0)   # staged rows whose text hash is current
+    users_total  = Column(Integer, default=0)
+    users_done   = Column(Integer, default=0)
+    owner = Column(String, nullable=True)         # "host:pid" of the process running the worker
+    heartbeat_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+# At most one running migration: workers starting together race to insert it
+Index("ux_embedding_migrations_running", EmbeddingMigration.status, unique=True,
+      sqlite_where=EmbeddingMigration.status == "running",
+      postgresql_where=EmbeddingMigration.status == "running")
@@ -1,52 +1,168 @@
 import os
-import google.genai as genai
-from google.genai import types
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
 from typing import List, Sequence, Optional
 from dotenv import load_dotenv
+import numpy as np
+from metrics import histogram, stage
 
 load_dotenv() # Tested to be necessary
-EMBED_MODEL = os.getenv("GEMINI_EMBED_MODEL")
-assert(EMBED_MODEL)
-OUTPUT_DIM = 1536
-
-client = genai.Client()
-
-def _embed_single(text: str, task_type: str) -> List[float]:
-    cfg = types.EmbedContentConfig(task_type=task_type)
-    cfg = types.EmbedContentConfig(task_type=task_type, output_dimensionality=OUTPUT_DIM)
-
-    # Note: API accepts a single string or a list of strings ("contents")
-    result = client.models.embed_content(
-        model=EMBED_MODEL,
-        contents=text,
-        config=cfg,
-    )
-    # result.embeddings is a list of Embedding objects; take first
-    [embedding_obj] = result.embeddings
-    return list(embedding_obj.values)
-
-def _embed_batch(texts: Sequence[str], task_type: str) -> List[List[float]]:
-    cfg = types.EmbedContentConfig(task_type=task_type)
-    cfg = types.EmbedContentConfig(task_type=task_type, output_dimensionality=OUTPUT_DIM)
-
-    result = client.models.embed_content(
-        model=EMBED_MODEL,
-        contents=list(texts),
-        config=cfg,
-    )
-    return [list(e.values) for e in result.embeddings]
-
-def embed_document(text: str) -> List[float]:
+# Changing the model or the dim starts a background migration (see migration.py)
+OUTPUT_DIM = int(os.getenv("EMBED_DIM", "1536"))
+
+# Which backend turns text into vectors: "gemini" (default) or "local"
+# (deterministic, offline; for load tests and CI).
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "gemini").strip().lower()
+# Artificial per-call latency for the local provider, to mimic a remote API
+EMBED_LATENCY_MS = float(os.getenv("EMBED_LATENCY_MS", "0"))
+
+
+class EmbeddingProvider(ABC):
+    """Turns a batch of texts into vectors of OUTPUT_DIM floats."""
+    model_name: str
+    dim: int
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str], task_type: str) -> List[List[float]]:
+        ...
+
+
+class GeminiProvider(EmbeddingProvider):
+    def __init__(self, model_name: str, dim: int = OUTPUT_DIM):
+        self.model_name = model_name
+        self.dim = dim
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        # Built on first use so importing this module never touches the network
+        with self._lock:
+            if self._client is None:
+                import google.genai as genai
+                self._client = genai.Client()
+            return self._client
+
+    def embed(self, texts: Sequence[str], task_type: str) -> List[List[float]]:
+        from google.genai import types
+        cfg = types.EmbedContentConfig(task_type=task_type, output_dimensionality=self.dim)
+
+        # Note: API accepts a single string or a list of strings ("contents")
+        result = self._get_client().models.embed_content(
+            model=self.model_name,
+            contents=list(texts),
+            config=cfg,
+        )
+        return [list(e.values) for e in result.embeddings]
+
+
+class LocalHashProvider(EmbeddingProvider):
+    """
+    Deterministic offline embeddings: lowercase word and character-trigram
+    features, hashed (crc32, signed) into `dim` buckets and L2-normalized.
+    Texts sharing words land close together, so ranking behaves plausibly.
+    Query and document vectors share one space (task_type is ignored).
+    """
+
+    def __init__(self, model_name: str, dim: int = OUTPUT_DIM, latency_ms: float = 0.0):
+        self.model_name = model_name
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _features(self, text: str):
+        for word in text.lower().split():
+            word = word.strip(".,;:!?()[]\"'")
+            if not word:
+                continue
+            yield word, 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def _embed_one(self, text: str) -> List[float]:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for feat, weight in self._features(text):
+            h = zlib.crc32(feat.encode("utf-8"))
+            v[h % self.dim] += weight if (h >> 31) & 1 else -weight
+        n = float(np.linalg.norm(v))
+        if n == 0.0:
+            v[0] = 1.0
+        else:
+            v /= n
+        return v.tolist()
+
+    def embed(self, texts: Sequence[str], task_type: str) -> List[List[float]]:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        return [self._embed_one(t) for t in texts]
+
+
+def _configured_model() -> str:
+    if EMBED_PROVIDER == "local":
+        return os.getenv("LOCAL_EMBED_MODEL", "local-hash-v1")
+    if EMBED_PROVIDER == "gemini":
+        return os.getenv("GEMINI_EMBED_MODEL") or "gemini-embedding-001"
+    raise ValueError(f"Unknown EMBED_PROVIDER {EMBED_PROVIDER!r} (expected 'gemini' or 'local')")
+
+# model_name stored with every vector and used in ANN index keys
+EMBED_MODEL = _configured_model()
+
+_providers = {}                      # (model_name, dim) -> EmbeddingProvider
+_provider_lock = threading.Lock()
+
+def get_provider(model_name: Optional[str] = None, dim: Optional[int] = None) -> EmbeddingProvider:
+    """
+    Provider for a model (default: the configured EMBED_MODEL / OUTPUT_DIM),
+    built on first use rather than at import. Other models of the same
+    EMBED_PROVIDER are used while migrating between models.
+    """
+    key = (model_name or EMBED_MODEL, dim or OUTPUT_DIM)
+    p = _providers.get(key)
+    if p is None:
+        with _provider_lock:
+            p = _providers.get(key)
+            if p is None:
+                if EMBED_PROVIDER == "local":
+                    p = LocalHashProvider(key[0], key[1], EMBED_LATENCY_MS)
+                else:
+                    p = GeminiProvider(key[0], key[1])
+                _providers[key] = p
+    return p
+
+_EMBED_SECONDS = histogram(
+    "embedding_call_seconds", "Latency of one embedding provider call",
+    labelnames=("provider", "task"), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+def _embed(texts: Sequence[str], task_type: str, provider: Optional[EmbeddingProvider] = None) -> List[List[float]]:
+    t0 = time.perf_counter()
+    with stage("embed"):
+        vecs = (provider or get_provider()).embed(texts, task_type=task_type)
+    _EMBED_SECONDS.observe(time.perf_counter() - t0, provider=EMBED_PROVIDER, task=task_type)
+    return vecs
+
+def embed_document(text: str, provider: Optional[EmbeddingProvider] = None) -> List[float]:
     """Document-side vectors for your events (RETRIEVAL_DOCUMENT)."""
-    return _embed_single(text, task_type="RETRIEVAL_DOCUMENT")
+    [vec] = _embed([text], task_type="RETRIEVAL_DOCUMENT", provider=provider)
+    return vec
 
-def embed_query(text: str) -> List[float]:
+def embed_query(text: str, provider: Optional[EmbeddingProvider] = None) -> List[float]:
     """Query-side vectors for user intent (RETRIEVAL_QUERY)."""
-    return _embed_single(text, task_type="RETRIEVAL_QUERY")
+    [vec] = _embed([text], task_type="RETRIEVAL_QUERY", provider=provider)
+    return vec
 
-def embed_documents(texts: Sequence[str]) -> List[List[float]]:
+def embed_documents(texts: Sequence[str], provider: Optional[EmbeddingProvider] = None) -> List[List[float]]:
     """Batch version for documents."""
-    return _embed_batch(texts, task_type="RETRIEVAL_DOCUMENT")
+    if not texts:
+        return []
+    return _embed(texts, task_type="RETRIEVAL_DOCUMENT", provider=provider)
+
+def embed_queries(texts: Sequence[str], provider: Optional[EmbeddingProvider] = None) -> List[List[float]]:
+    """Batch version for user query texts."""
+    if not texts:
+        return []
+    return _embed(texts, task_type="RETRIEVAL_QUERY", provider=provider)
 
 def event_text(title: str, tags: str, orgs: str, starts_at: str, location: str, summary: str) -> str:
     """Canonical event text used for embedding."""
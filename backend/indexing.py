@@ -0,0 +1,190 @@
+# indexing.py
+# Batch path from Event rows -> embeddings -> event_embeddings rows -> ANN index.
+# Used by the startup backfill and by scripts/import_csv.py --embed.
+# Each embedding row stores a hash of the text it was built from, so re-delivered
+# feeds only re-embed and re-index events whose canonical text actually changed.
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence
+import hashlib, json, os
+from datetime import datetime
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+from db.models import EventEmbedding
+import ann_index
+
+# Max texts per embed_documents call (Gemini batch embed limit is 100)
+EMBED_BATCH = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+TASK_DOCUMENT = "RETRIEVAL_DOCUMENT"
+
+@dataclass
+class EmbedStats:
+    embedded: int = 0              # documents sent to the embedding API
+    unchanged: int = 0             # documents skipped because their text hash matched
+    stamped: int = 0               # pre-hash rows adopted as current (hash written, no API call)
+    embed_calls: int = 0           # embed_documents() calls made
+    embed_calls_avoided: int = 0   # calls a full re-embed would have made on top of those
+    index_writes: int = 0          # vectors written to the ANN index
+    index_writes_avoided: int = 0
+
+    def __iadd__(self, other: "EmbedStats") -> "EmbedStats":
+        for f in self.__dataclass_fields__:
+            setattr(self, f, getattr(self, f) + getattr(other, f))
+        return self
+
+    def summary(self) -> str:
+        return (
+            f"embedded {self.embedded} ({self.embed_calls} calls), unchanged {self.unchanged}, "
+            f"stamped {self.stamped}; avoided {self.embed_calls_avoided} embedding calls "
+            f"and {self.index_writes_avoided} index writes"
+        )
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def calls_for(n: int) -> int:
+    """embed_documents() calls needed for n documents."""
+    return -(-n // EMBED_BATCH)
+
+def _dialect_insert(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def event_doc_text(ev) -> str:
+    """Canonical embedding text for an Event (ORM row or any object with the same attributes)."""
+    from embeddings import event_text
+    text = event_text(
+        ev.title,
+        ev.tags or "",
+        ev.organizers or "",
+        ev.starts_at,
+        ev.location,
+        ev.description or "",
+    ).strip()
+    if not text:
+        # Extremely unlikely given required fields, but keep a fallback.
+        text = f"title: {ev.title}\nwhere: {ev.location}\nwhen: {ev.starts_at}"
+    return text
+
+def upsert_event_embeddings(db: Session, rows: Sequence[dict], table=EventEmbedding) -> None:
+    """
+    Write event_embeddings rows in one statement, replacing any existing row
+    for the same event. Each row needs event_id, vector (list, or its JSON
+    text), dim, model_name, task_type and content_hash. `table` may be the
+    migration staging table. Caller commits.
+    """
+    if not rows:
+        return
+    insert = _dialect_insert(db)
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.event_id],
+        set_={c: stmt.excluded[c] for c in ("vector", "dim", "model_name", "task_type", "content_hash", "updated_at")},
+    )
+    now = datetime.utcnow()
+    db.execute(stmt, [
+        {**r, "vector": r["vector"] if isinstance(r["vector"], str) else json.dumps(r["vector"]),
+         "created_at": now, "updated_at": now}
+        for r in rows
+    ])
+
+def embed_and_index_events(
+    db: Session,
+    events: Iterable,
+    model_name: str,
+    adopt_unhashed: bool = False,
+    provider=None,
+    table=EventEmbedding,
+    dim: Optional[int] = None,
+    defer_index: Optional[list] = None,
+) -> EmbedStats:
+    """
+    Embed events whose canonical text changed since their stored embedding
+    (or that have none), in API-sized batches; upsert their event_embeddings
+    rows and add the vectors to the ANN index without saving it. Callers
+    commit the session and call ann_index.save_index() once when done.
+
+    Rows stored before content hashes existed have content_hash NULL. With
+    adopt_unhashed=True they are assumed current and only get their hash
+    written; otherwise they are re-embedded.
+
+    `provider` embeds with a model other than the configured one and `table`
+    writes to the migration staging table instead (see migration.py). With
+    `dim` set, rows of another dim count as stale even if the model matches.
+
+    With `defer_index` (a list) the index writes are appended to it instead of
+    applied, so the caller can commit first and then pass it to index_events().
+    """
+    from embeddings import embed_documents
+    events = list(events)
+    stats = EmbedStats()
+    if not events:
+        return stats
+
+    texts = {ev.id: event_doc_text(ev) for ev in events}
+    hashes = {eid: text_hash(t) for eid, t in texts.items()}
+    stored = {
+        row.event_id: row
+        for row in db.query(table.event_id, table.content_hash, table.model_name, table.dim)
+                     .filter(table.event_id.in_(list(texts)))
+    }
+
+    todo, stamp = [], []
+    for ev in events:
+        cur = stored.get(ev.id)
+        if cur is not None and cur.model_name == model_name and (dim is None or cur.dim == dim):
+            if cur.content_hash == hashes[ev.id]:
+                stats.unchanged += 1
+                continue
+            if cur.content_hash is None and adopt_unhashed:
+                stamp.append(ev.id)
+                continue
+        todo.append(ev)
+
+    if stamp:
+        # One executemany rather than an UPDATE per row. Core table, since the
+        # ORM would treat a list of params as bulk update by primary key.
+        t = table.__table__
+        db.execute(
+            update(t).where(t.c.event_id == bindparam("eid")).values(content_hash=bindparam("hash")),
+            [{"eid": eid, "hash": hashes[eid]} for eid in stamp],
+        )
+    stats.stamped = len(stamp)
+
+    for i in range(0, len(todo), EMBED_BATCH):
+        batch = todo[i:i + EMBED_BATCH]
+        vecs: List[List[float]] = embed_documents([texts[ev.id] for ev in batch], provider=provider)
+        stats.embed_calls += 1
+        rows = [
+            dict(event_id=ev.id, vector=vec, dim=len(vec), model_name=model_name,
+                 task_type=TASK_DOCUMENT, content_hash=hashes[ev.id])
+            for ev, vec in zip(batch, vecs)
+        ]
+        upsert_event_embeddings(db, rows, table=table)
+        by_dim = {}
+        for r in rows:
+            by_dim.setdefault(r["dim"], []).append((r["event_id"], r["vector"]))
+        for dim, items in by_dim.items():
+            if defer_index is not None:
+                defer_index.append(((model_name, TASK_DOCUMENT, dim), items))
+                continue
+            stats.index_writes += ann_index.add_or_update(
+                key=(model_name, TASK_DOCUMENT, dim), dim=dim, embeddings=items, save=False
+            )
+        stats.embedded += len(batch)
+
+    skipped = stats.unchanged + stats.stamped
+    stats.index_writes_avoided = skipped
+    stats.embed_calls_avoided = calls_for(len(events)) - stats.embed_calls
+    return stats
+
+def index_events(pending: list) -> int:
+    """Apply index writes collected with embed_and_index_events(defer_index=...). Doesn't save."""
+    written = 0
+    for key, items in pending:
+        written += ann_index.add_or_update(key=key, dim=key[2], embeddings=items, save=False)
+    pending.clear()
+    return written
@@ -0,0 +1,99 @@
+# ivfpq.py
+# IVF-PQ in NumPy, used by ann_index's "ivfpq" backend. Vectors (unit length,
+# cosine) are assigned to the nearest of nlist coarse centroids, and the
+# residual (vector - centroid) is product-quantized into m one-byte codes,
+# 256 centroids per sub-space. Scoring is an inner product:
+#     q.x ~= q.C[list] + sum_j LUT[j, code_j],   LUT[j] = q_j . codebook[j]
+# Posting lists are stored contiguously by list, codes transposed to
+# [m, N] so a probed range is m contiguous slices, and saved as .npy files that
+# ann_index memory-maps: only centroids, codebooks and probed lists touch RAM.
+from __future__ import annotations
+from typing import Optional, Tuple
+import numpy as np
+
+KSUB = 256        # codes per sub-space (one byte)
+_ITERS = 12       # k-means iterations
+_CHUNK = 8192     # rows per assignment chunk
+
+def default_nlist(n: int) -> int:
+    return int(max(1, min(65536, round(4 * np.sqrt(max(n, 1))))))
+
+def default_m(dim: int) -> int:
+    """Sub-spaces: the divisor of dim closest to 8 dims each (1536 -> 192 bytes/vector)."""
+    divisors = [m for m in range(1, dim + 1) if dim % m == 0 and dim // m >= 2]
+    return min(divisors or [1], key=lambda m: abs(dim // m - 8))
+
+def assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest (L2) centroid for each row."""
+    cn = (centroids * centroids).sum(axis=1)
+    out = np.empty(len(x), dtype=np.int64)
+    for i in range(0, len(x), _CHUNK):
+        out[i:i + _CHUNK] = np.argmax(2.0 * (x[i:i + _CHUNK] @ centroids.T) - cn, axis=1)
+    return out
+
+def kmeans(x: np.ndarray, k: int, rng: np.random.Generator, iters: int = _ITERS) -> np.ndarray:
+    k = min(k, len(x))
+    c = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        a = assign(x, c)
+        order = np.argsort(a, kind="stable")
+        counts = np.bincount(a, minlength=k)
+        present = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+        c[present] = np.add.reduceat(x[order], starts, axis=0) / counts[present, None]
+        empty = counts == 0
+        if empty.any():  # re-seed empty clusters from random points
+            c[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return c
+
+class Quantizer:
+    """Coarse centroids [nlist, dim] and PQ codebooks [m, KSUB, dim/m]."""
+
+    def __init__(self, centroids: np.ndarray, codebooks: np.ndarray):
+        self.centroids = centroids.astype(np.float32)
+        self.codebooks = codebooks.astype(np.float32)
+        self.nlist = len(centroids)
+        self.m, self.ksub, self.dsub = codebooks.shape
+
+    @classmethod
+    def train(cls, sample: np.ndarray, nlist: int, m: int, seed: int = 0) -> "Quantizer":
+        rng = np.random.default_rng(seed)
+        centroids = kmeans(sample, nlist, rng)
+        resid = sample - centroids[assign(sample, centroids)]
+        dsub = sample.shape[1] // m
+        books = np.zeros((m, KSUB, dsub), dtype=np.float32)
+        for j in range(m):
+            cb = kmeans(np.ascontiguousarray(resid[:, j * dsub:(j + 1) * dsub]), KSUB, rng)
+            books[j, :len(cb)] = cb
+        return cls(centroids, books)
+
+    def encode(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(list number [n], codes [m, n] uint8)."""
+        lists = assign(x, self.centroids)
+        resid = x - self.centroids[lists]
+        codes = np.empty((self.m, len(x)), dtype=np.uint8)
+        for j in range(self.m):
+            codes[j] = assign(np.ascontiguousarray(resid[:, j * self.dsub:(j + 1) * self.dsub]), self.codebooks[j])
+        return lists, codes
+
+    def lut(self, q: np.ndarray) -> np.ndarray:
+        return np.einsum("jkd,jd->jk", self.codebooks, q.reshape(self.m, self.dsub))
+
+    def score(self, lut: np.ndarray, codes: np.ndarray, base: np.ndarray) -> np.ndarray:
+        """base (q.centroid per row) + ADC sum over sub-spaces; codes is [m, n]."""
+        s = base.astype(np.float32, copy=True)
+        for j in range(self.m):
+            s += lut[j].take(codes[j])
+        return s
+
+def group(lists: np.ndarray, nlist: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(row order that sorts rows by list, offsets [nlist + 1]) for contiguous posting lists."""
+    order = np.argsort(lists, kind="stable")
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(lists, minlength=nlist), out=offsets[1:])
+    return order, offsets
+
+def probe_rows(offsets: np.ndarray, probe: np.ndarray) -> Optional[np.ndarray]:
+    """Row indexes covered by the probed lists, or None if they are all empty."""
+    ranges = [np.arange(offsets[c], offsets[c + 1]) for c in probe if offsets[c + 1] > offsets[c]]
+    return np.concatenate(ranges) if ranges else None
@@ -4,25 +4,40 @@ import logging
 from contextlib import asynccontextmanager
 import json
 from typing import List, Optional, Dict
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Body, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session, noload
-from ann_index import add_or_update as ann_add_or_update
-from db.database import Base, engine, get_db
+from db.database import engine, get_db, ensure_schema
 from db.models import User, Event, EventEmbedding, UserQueryEmbedding
 from schemas import (
     UserCreate, Login, Token, UserOut,
     EventCreate, EventOut,
     EventEmbeddingCreate, EventEmbeddingOut,
-    UserQueryEmbeddingCreate, UserQueryEmbeddingOut, QuizAnswersIn, StringListIn
+    UserQueryEmbeddingCreate, UserQueryEmbeddingOut, QuizAnswersIn, StringListIn,
+    ProfileUpdateIn,
 )
-from auth import hash_password, verify_password, create_access_token, get_current_user
-from embeddings import embed_document, event_text, user_text
+from auth import (
+    hash_password, verify_and_update, create_access_token,
+    get_current_user, get_current_principal, Principal,
+)
+from embeddings import embed_document, user_text
+from indexing import embed_and_index_events, event_doc_text, index_events, text_hash, EmbedStats
+from ann_index import (
+    add_or_update as ann_add_or_update, rebuild as ann_rebuild, search as ann_search,
+    save_index as ann_save_index,
+)
+from metrics import stage
+import ann_index
+import ann_maintenance
+import bulk_embeddings
+import metrics
+import migration
 import os
-from ann_index import add_or_update as ann_add_or_update, rebuild as ann_rebuild, search as ann_search
-
-from sqlalchemy.orm import Session, noload
-import os, json
+import reembed
+import threading
+import user_vectors
+import vector_store
 
 logging.basicConfig(
         level=logging.INFO,
@@ -30,8 +45,12 @@ logging.basicConfig(
     )
 logger = logging.getLogger("ISolution")
 
-def create_missing_embeddings() -> int:
-    model_name = os.getenv("GEMINI_EMBED_MODEL") or "gemini-embedding-001"
+def create_missing_embeddings(stop: Optional[threading.Event] = None) -> int:
+    """Embed users/events that have no (or a stale) vector. `stop` ends it early between batches."""
+    # During a model migration this keeps the live tables on the serving (old) model
+    spec = migration.serving()
+    model_name = spec.model_name
+    provider = migration.serving_provider()
     BATCH = 100
     created = 0
 
@@ -46,9 +65,11 @@ def create_missing_embeddings() -> int:
         )
 
         for user in uq.yield_per(200):
+            if stop is not None and stop.is_set():
+                break
             try:
                 text = user_text(user).strip() or "user: no details"
-                vec = embed_document(text)
+                vec = embed_document(text, provider=provider)
                 ue = UserQueryEmbedding(
                     user_id=user.id,
                     vector=json.dumps(vec),
@@ -65,64 +86,114 @@ def create_missing_embeddings() -> int:
 
         db.commit()  # flush remainder from users
 
-        # ---- Pass 2: EVENTS missing an embedding ----
-        eq = (
-            db.query(Event)
-              .outerjoin(EventEmbedding, EventEmbedding.event_id == Event.id)
-              .filter(EventEmbedding.id.is_(None))
-              .options(noload(Event.attendees), noload(Event.embedding))
-              .execution_options(stream_results=True)
-        )
-
-        for ev in eq.yield_per(200):
+        # ---- Pass 2: EVENTS without an up-to-date embedding ----
+        # Walk all events by id; embed_and_index_events compares text hashes and
+        # only re-embeds new or changed events (batched embed + bulk index).
+        # The index writes wait for the batch commit, so a rolled-back batch
+        # never leaves vectors in the index that the table doesn't have.
+        stats = EmbedStats()
+        last_id = 0
+        while stop is None or not stop.is_set():
+            batch = (
+                db.query(
+                    Event.id, Event.title, Event.tags, Event.organizers,
+                    Event.starts_at, Event.location, Event.description,
+                )
+                .filter(Event.id > last_id)
+                .order_by(Event.id)
+                .limit(BATCH)
+                .all()
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            pending = []
             try:
-                text = event_text(
-                    ev.title,
-                    ev.tags or "",
-                    ev.organizers or "",
-                    ev.starts_at,
-                    ev.location,
-                    ev.description or "",
-                ).strip()
-
-                if not text:
-                    # Extremely unlikely given required fields, but keep a fallback.
-                    text = f"title: {ev.title}\nwhere: {ev.location}\nwhen: {ev.starts_at}"
-
-                vec = embed_document(text)
-                ee = EventEmbedding(
-                    event_id=ev.id,
-                    vector=json.dumps(vec),
-                    dim=len(vec),
-                    model_name=model_name,
-                    task_type="RETRIEVAL_DOCUMENT",
+                stats += embed_and_index_events(
+                    db, batch, model_name, adopt_unhashed=True, provider=provider, dim=spec.dim,
+                    defer_index=pending,
                 )
-                db.add(ee)
-                created += 1
-                key = (ee.model_name, ee.task_type, ee.dim)
-                ann_add_or_update(key=key, dim=ee.dim, embeddings=[(ev.id, vec)])
-                if created % BATCH == 0:
-                    db.commit()
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"[events {batch[0].id}..{batch[-1].id}] auto-embed failed:", e)
+                continue
+            try:
+                stats.index_writes += index_events(pending)
             except Exception as e:
-                print(f"[event {getattr(ev,'id',None)}] auto-embed failed:", e)
+                # Rows are committed; the reconciler adds whatever didn't make it
+                print(f"[events {batch[0].id}..{batch[-1].id}] index write failed:", e)
 
-        db.commit()  # flush remainder from events
-        return created
+        ann_save_index()  # one save per touched index
+        logger.info("Event embedding backfill: %s", stats.summary())
+        return created + stats.embedded
+
+# ---------------------------
+# startup / readiness
+# ---------------------------
+# "background" (default): serve immediately, backfill in a thread, /api/ready is 503 until done.
+# "sync": backfill before serving (old behaviour). "off": skip the backfill.
+STARTUP_BACKFILL = os.getenv("STARTUP_BACKFILL", "background").strip().lower()
+
+# Startup work still pending; /api/ready reports 200 once all are True
+_startup_done: Dict[str, bool] = {"schema": False, "ann_warmup": False, "backfill": False}
+_startup_error: Optional[str] = None
+_stopping = threading.Event()
+
+def _run_startup_work(backfill: bool = True):
+    # Warm indexes first so recommendations work off the stored vectors while
+    # the backfill embeds whatever is new.
+    global _startup_error
+    try:
+        if ann_maintenance.ANN_WARMUP:
+            ann_maintenance.warm_up()
+        _startup_done["ann_warmup"] = True
+    except Exception as e:
+        # Otherwise the thread dies quietly and /api/ready says "starting" forever
+        _startup_error = f"ANN warm-up failed: {e}"
+        logger.exception("Startup ANN warm-up failed")
+        return
+    if not backfill:
+        _startup_done["backfill"] = True
+        return
+    try:
+        created = create_missing_embeddings(stop=_stopping)
+        logger.info("Created %d embeddings at startup.", created)
+        _startup_done["backfill"] = True
+    except Exception as e:
+        _startup_error = f"backfill failed: {e}"
+        logger.exception("Startup embedding backfill failed")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     from db import models
     logger.info("Application startup.")
-    # TODO: Scan database, check if vectors exist for each user, event, if not, 
-    # call Sir gemini to do it
-    Base.metadata.create_all(bind=engine)
-    created = create_missing_embeddings()
-    logger.info("Created %d embeddings at startup.", created)
+    _stopping.clear()
+    ensure_schema()
+    with Session(engine) as db:
+        migration.start_worker(migration.start_if_needed(db))
+    _startup_done["schema"] = True
+    if STARTUP_BACKFILL == "sync":
+        _run_startup_work()
+    else:
+        threading.Thread(
+            target=_run_startup_work, kwargs={"backfill": STARTUP_BACKFILL != "off"},
+            name="startup-backfill", daemon=True,
+        ).start()
+    ann_maintenance.start_health_checks()
     yield
     logger.info("Shutting down backend.")
+    _stopping.set()
+    migration.stop()
+    ann_maintenance.stop()
+    reembed.stop(flush=True)
 
 app = FastAPI(title="ISolution API", lifespan=lifespan)
 
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine)
+ann_index.set_rerank_source(vector_store.rerank)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -147,13 +218,39 @@ def _list_to_csv(lst: Optional[List[str]]) -> Optional[str]:
         return None
     return ",".join([x.strip() for x in lst if str(x).strip()])
 
+def _profile_changed(user_id: int):
+    # After a profile commit: queue one debounced re-embed of the user's query
+    # vector. Cached principals only hold id + username, so profile edits
+    # don't touch them.
+    reembed.schedule(user_id)
+
 # ---------------------------
 # health
 # ---------------------------
 @app.get("/api/health")
 def health():
+    # Liveness only: the process is up and serving. See /api/ready for traffic readiness.
     return {"status": "ok"}
 
+@app.get("/api/ready")
+def ready(response: Response):
+    pending = [name for name, done in _startup_done.items() if not done]
+    db_ok = True
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql("SELECT 1")
+    except Exception:
+        db_ok = False
+    if pending or not db_ok or _startup_error:
+        response.status_code = 503
+        return {"status": "starting" if not _startup_error else "failed",
+                "pending": pending, "db": db_ok, "error": _startup_error}
+    return {"status": "ready", "pending": [], "db": True, "error": None}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 # ---------------------------
 # auth
@@ -180,6 +277,7 @@ def register(payload: UserCreate, db: Session = Depends(get_db)):
     db.add(user)
     db.commit()
     db.refresh(user)
+    reembed.schedule(user.id)
 
     return UserOut(
         id=getattr(user, "id"),
@@ -199,30 +297,45 @@ def register(payload: UserCreate, db: Session = Depends(get_db)):
 
 @app.post("/api/auth/login", response_model=Token)
 def login(payload: Login, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == payload.username).first()
-    if not user or not verify_password(payload.password, user.password_hash):
+    user = (
+        db.query(User)
+          .options(noload(User.attending))
+          .filter(User.username == payload.username)
+          .first()
+    )
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    ok, new_hash = verify_and_update(payload.password, user.password_hash)
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Work factor changed (BCRYPT_ROUNDS); upgrade the stored hash transparently
+        user.password_hash = new_hash
+        db.commit()
     token = create_access_token(user.username)
     return {"access_token": token, "token_type": "bearer"}
 
-@app.get("/api/me", response_model=UserOut)
-def me(current: User = Depends(get_current_user)):
+def _user_out(user: User) -> UserOut:
     return UserOut(
-        id=current.id,
-        username=current.username,
-        name=current.name,
-        age=current.age,
-        school_or_career_type=current.school_or_career_type,
-        interests=_csv_to_list(current.interests),
-        causes_interested=_csv_to_list(current.causes_interested),
-        wake_time=current.wake_time,
-        sleep_time=current.sleep_time,
-        preferred_days=_csv_to_list(current.preferred_days),
-        personality_type=current.personality_type,
-        location=current.location,
-        created_at=current.created_at,
+        id=user.id,
+        username=user.username,
+        name=user.name,
+        age=user.age,
+        school_or_career_type=user.school_or_career_type,
+        interests=_csv_to_list(user.interests),
+        causes_interested=_csv_to_list(user.causes_interested),
+        wake_time=user.wake_time,
+        sleep_time=user.sleep_time,
+        preferred_days=_csv_to_list(user.preferred_days),
+        personality_type=user.personality_type,
+        location=user.location,
+        created_at=user.created_at,
     )
 
+@app.get("/api/me", response_model=UserOut)
+def me(current: User = Depends(get_current_user)):
+    return _user_out(current)
+
 
 # ---------------------------
 # events
@@ -230,7 +343,7 @@ def me(current: User = Depends(get_current_user)):
 @app.post("/api/events", response_model=EventOut)
 def create_event(
     data: EventCreate,
-    current: User = Depends(get_current_user),
+    current: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db),
 ):
     ev = Event(
@@ -255,25 +368,19 @@ def create_event(
     db.commit()
     db.refresh(ev)
     try:
-        text = event_text(
-            ev.title,
-            ev.tags or "",
-            ev.organizers or "",
-            ev.starts_at,
-            ev.location,
-            ev.description or "",
-        )
-        vec = embed_document(text)
+        text = event_doc_text(ev)
+        vec = embed_document(text, provider=migration.serving_provider())
         ee = EventEmbedding(
             event_id=ev.id,
             vector=json.dumps(vec),
             dim=len(vec),
-            model_name=os.getenv("GEMINI_EMBED_MODEL"),
+            model_name=migration.serving().model_name,
             task_type="RETRIEVAL_DOCUMENT",
+            content_hash=text_hash(text),
         )
         db.add(ee)
         db.commit()
-        key = (ee.model_name or "gemini-embedding-001", ee.task_type, ee.dim)
+        key = (ee.model_name, ee.task_type, ee.dim)
         ann_add_or_update(
             key=key,
             dim=ee.dim,
@@ -368,17 +475,6 @@ def _encode_vec(vec: List[float]) -> str:
 def _decode_vec(s: str) -> List[float]:
     return json.loads(s)
 
-def _cosine(a: List[float], b: List[float]) -> float:
-    # Using the cos dot product formula to compare similarity of the vectors
-    # based on theta
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    import math
-    dot = sum(x*y for x, y in zip(a, b))
-    na = math.sqrt(sum(x*x for x in a))
-    nb = math.sqrt(sum(y*y for y in b))
-    return dot / (na * nb) if na and nb else 0.0
-
 @app.post("/api/embeddings/events", response_model=EventEmbeddingOut)
 def create_event_embedding(payload: EventEmbeddingCreate, db: Session = Depends(get_db)):
     ev = db.query(Event).filter(Event.id == payload.event_id).first()
@@ -452,6 +548,7 @@ def upsert_user_query_embedding(payload: UserQueryEmbeddingCreate, db: Session =
         existing.task_type = payload.task_type
         db.commit()
         db.refresh(existing)
+        user_vectors.put(existing.user_id, existing.model_name, existing.dim, payload.vector, existing.updated_at)
         return existing
 
     ue = UserQueryEmbedding(
@@ -464,8 +561,45 @@ def upsert_user_query_embedding(payload: UserQueryEmbeddingCreate, db: Session =
     db.add(ue)
     db.commit()
     db.refresh(ue)
+    user_vectors.put(ue.user_id, ue.model_name, ue.dim, payload.vector, ue.updated_at)
     return ue
 
+_BULK_BODY = Body(..., media_type="application/x-ndjson",
+                  description="NDJSON lines, or application/octet-stream: n int64 ids then n x dim float32 (little-endian)")
+
+def _parse_bulk(request: Request, body: bytes, id_field: str, dim: int):
+    try:
+        return bulk_embeddings.parse(body, request.headers.get("content-type", ""), id_field, dim)
+    except LookupError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/embeddings/events/bulk")
+def bulk_upload_event_embeddings(
+    request: Request,
+    body: bytes = _BULK_BODY,
+    model_name: str = Query(...),
+    task_type: str = Query("RETRIEVAL_DOCUMENT"),
+    dim: int = Query(0, ge=0, description="Vector length; required for binary bodies"),
+    db: Session = Depends(get_db),
+):
+    # One upsert statement, one commit and one ANN add_items + save for the whole body
+    ids, vecs = _parse_bulk(request, body, "event_id", dim)
+    return bulk_embeddings.upload_events(db, ids, vecs, model_name, task_type)
+
+@app.post("/api/embeddings/users/bulk")
+def bulk_upload_user_embeddings(
+    request: Request,
+    body: bytes = _BULK_BODY,
+    model_name: str = Query(...),
+    task_type: str = Query("RETRIEVAL_QUERY"),
+    dim: int = Query(0, ge=0, description="Vector length; required for binary bodies"),
+    db: Session = Depends(get_db),
+):
+    ids, vecs = _parse_bulk(request, body, "user_id", dim)
+    return bulk_embeddings.upload_users(db, ids, vecs, model_name, task_type)
+
 
 # ---------------------------
 # test recommendations (cosine over stored vectors)
@@ -477,38 +611,20 @@ def test_recommendations(
     top_k: int = Query(10, ge=1, le=100),
     db: Session = Depends(get_db),
 ):
-    uq = db.query(UserQueryEmbedding).filter(UserQueryEmbedding.user_id == user_id).first()
+    uq = user_vectors.get(db, user_id)
     if not uq:
         raise HTTPException(status_code=404, detail="No user query embedding. POST /api/embeddings/user first.")
 
-    qvec = _decode_vec(uq.vector)
-    dim = uq.dim
-
-    # load event embeddings with the same model/task/dim (simple filter)
-    eembs = (
-        db.query(EventEmbedding)
-        .filter(
-            EventEmbedding.dim == dim,
-            EventEmbedding.model_name == uq.model_name,
-            EventEmbedding.task_type == "RETRIEVAL_DOCUMENT",
-        )
-        .all()
-    )
-    if not eembs:
+    # brute-force cosine over the key's int8 vector store (see vector_store.py)
+    key = (uq.model_name, "RETRIEVAL_DOCUMENT", uq.dim)
+    with stage("score"):
+        hits = vector_store.top_k(key, uq.vector, top_k)
+    if not hits:
         return []
 
-    # score by cosine
-    scored: list[tuple[float, Event]] = []
-    for ee in eembs:
-        ev = db.query(Event).filter(Event.id == ee.event_id).first()
-        if not ev:
-            continue
-        score = _cosine(qvec, _decode_vec(ee.vector))
-        scored.append((score, ev))
-
-    # sort and take top_k
-    scored.sort(key=lambda t: t[0], reverse=True)
-    top = scored[:top_k]
+    with stage("fetch_events"):
+        by_id = {e.id: e for e in db.query(Event).filter(Event.id.in_([eid for eid, _ in hits])).all()}
+    top = [(score, by_id[eid]) for eid, score in hits if eid in by_id]
 
     # Map to EventOut (you can also include the score in a debug field if you like)
     results: List[EventOut] = []
@@ -546,31 +662,19 @@ def ann_recommendations(
     db: Session = Depends(get_db),
 ):
     # 1) Load the user query vector
-    uq = db.query(UserQueryEmbedding).filter(UserQueryEmbedding.user_id == user_id).first()
+    uq = user_vectors.get(db, user_id)
     if not uq:
         raise HTTPException(status_code=404, detail="No user query embedding. POST /api/embeddings/user first.")
-    qvec = _decode_vec(uq.vector)
+    qvec = uq.vector
 
     # 2) Search ANN with the same model/task/dim
     key = (uq.model_name, "RETRIEVAL_DOCUMENT", uq.dim)
-    hits = ann_search(key=key, dim=uq.dim, query_vec=qvec, k=top_k)
-
-    # Optional: lazy warm the index if it’s cold/empty
-    if not hits:
-        rows = (
-            db.query(EventEmbedding)
-              .filter(
-                  EventEmbedding.model_name == uq.model_name,
-                  EventEmbedding.task_type == "RETRIEVAL_DOCUMENT",
-                  EventEmbedding.dim == uq.dim
-              ).all()
-        )
-        if rows:
-            items = [(r.event_id, _decode_vec(r.vector)) for r in rows]
-            ann_rebuild(key=key, dim=uq.dim, all_items=items)
-            hits = ann_search(key=key, dim=uq.dim, query_vec=qvec, k=top_k)
+    with stage("ann_search"):
+        hits = ann_search(key=key, dim=uq.dim, query_vec=qvec, k=top_k)
 
     if not hits:
+        # Cold or empty index: warm it in the background, never rebuild in the request
+        ann_maintenance.request_warm(key)
         return []
 
     # 3) Fetch the corresponding events in hit order
@@ -578,40 +682,42 @@ def ann_recommendations(
     rank = {eid: i for i, eid in enumerate(event_ids)}
     dist_map = {lab: float(dist) for (lab, dist) in hits}
 
-    events = db.query(Event).filter(Event.id.in_(event_ids)).all()
+    with stage("fetch_events"):
+        events = db.query(Event).filter(Event.id.in_(event_ids)).all()
     events.sort(key=lambda e: rank.get(e.id, 1_000_000))
 
     # 4) Map to EventOut and attach similarity (0..1)
     results: List[EventOut] = []
-    for e in events:
-        d = dist_map.get(e.id, 2.0)
-        sim = 1.0 - (d / 2.0)
-        sim = max(0.0, min(1.0, sim))
-        results.append(EventOut(
-            id=e.id,
-            title=e.title,
-            description=e.description,
-            src_url=e.src_url,
-            starts_at=e.starts_at,
-            ends_at=e.ends_at,
-            venue=e.venue,                # <- add back
-            location=e.location,
-            latitude=e.latitude,          # <- add back
-            longitude=e.longitude,        # <- add back
-            tags=_csv_to_list(e.tags),
-            organizers=_csv_to_list(e.organizers),
-            price_amount=e.price_amount,
-            price_currency=e.price_currency,
-            people_cap=e.people_cap,
-            source=e.source,
-            evidence_urls=e.evidence_urls or [],
-            dedupe_id=e.dedupe_id,
-            num_going=len(e.attendees),
-            usernames_going=[u.username for u in e.attendees],
-            created_at=e.created_at,
-            updated_at=e.updated_at,
-            score=round(sim, 6),
-        ))
+    with stage("build_response"):
+        for e in events:
+            d = dist_map.get(e.id, 2.0)
+            sim = 1.0 - (d / 2.0)
+            sim = max(0.0, min(1.0, sim))
+            results.append(EventOut(
+                id=e.id,
+                title=e.title,
+                description=e.description,
+                src_url=e.src_url,
+                starts_at=e.starts_at,
+                ends_at=e.ends_at,
+                venue=e.venue,                # <- add back
+                location=e.location,
+                latitude=e.latitude,          # <- add back
+                longitude=e.longitude,        # <- add back
+                tags=_csv_to_list(e.tags),
+                organizers=_csv_to_list(e.organizers),
+                price_amount=e.price_amount,
+                price_currency=e.price_currency,
+                people_cap=e.people_cap,
+                source=e.source,
+                evidence_urls=e.evidence_urls or [],
+                dedupe_id=e.dedupe_id,
+                num_going=len(e.attendees),
+                usernames_going=[u.username for u in e.attendees],
+                created_at=e.created_at,
+                updated_at=e.updated_at,
+                score=round(sim, 6),
+            ))
     return results
 
 def _event_category(e: Event) -> str:
@@ -633,16 +739,18 @@ def ann_recommendations_by_category(
     db: Session = Depends(get_db),
 ):
     # 1) user query vec
-    uq = db.query(UserQueryEmbedding).filter(UserQueryEmbedding.user_id == user_id).first()
+    uq = user_vectors.get(db, user_id)
     if not uq:
         raise HTTPException(status_code=404, detail="No user query embedding.")
-    qvec = _decode_vec(uq.vector)
+    qvec = uq.vector
     key = (uq.model_name, "RETRIEVAL_DOCUMENT", uq.dim)
 
     # 2) ANN search (overfetch)
     k = top_k * overfetch
-    hits = ann_search(key=key, dim=uq.dim, query_vec=qvec, k=k)
+    with stage("ann_search"):
+        hits = ann_search(key=key, dim=uq.dim, query_vec=qvec, k=k)
     if not hits:
+        ann_maintenance.request_warm(key)
         return {"volunteering": [], "events": []}
 
     event_ids = [lab for (lab, _d) in hits]
@@ -650,7 +758,8 @@ def ann_recommendations_by_category(
     dist_map = {lab: float(d) for (lab, d) in hits}
 
     # 3) fetch + order
-    events = db.query(Event).filter(Event.id.in_(event_ids)).all()
+    with stage("fetch_events"):
+        events = db.query(Event).filter(Event.id.in_(event_ids)).all()
     events.sort(key=lambda e: rank.get(e.id, 10**9))
 
     # 4) bucketize + cap at top_k each
@@ -716,24 +825,117 @@ def rebuild_ann_index(
     count = ann_rebuild(key=key, dim=dim, all_items=items)
     return {"ok": True, "count": count}
 
-@app.post("/api/profile/quiz")
-def save_quiz_answers(
-    payload: QuizAnswersIn,
-    current: User = Depends(get_current_user),
+@app.get("/api/embeddings/migration")
+def embedding_migration_status(db: Session = Depends(get_db)):
+    return migration.status(db)
+
+@app.post("/api/embeddings/migration/cutover")
+def embedding_migration_cutover(db: Session = Depends(get_db)):
+    # For EMBED_MIGRATION_AUTO_CUTOVER=0: runs a final catch-up pass, then swaps if coverage is 100%
+    m = migration.running(db)
+    if m is None:
+        raise HTTPException(status_code=404, detail="No embedding migration is running")
+    if not migration.cutover(db, m):
+        raise HTTPException(status_code=409, detail=migration.status(db)["migration"])
+    return migration.status(db)
+
+@app.get("/api/ann/stats")
+def ann_stats(
+    check: bool = Query(False, description="Run the health check now instead of returning the last result"),
     db: Session = Depends(get_db),
 ):
+    health = ann_maintenance.check_health(db) if check else ann_maintenance.last_report()
+    return {"indexes": ann_index.stats(), "registry": ann_index.registry_stats(), "health": health,
+            "warmup": ann_maintenance.last_warmup(), "reconcile": ann_maintenance.last_reconcile(),
+            "compactions": ann_maintenance.last_compactions(), "vector_store": vector_store.stats()}
+
+@app.post("/api/ann/compact")
+def compact_ann_index(
+    model_name: str = Query(...),
+    task_type: str = Query("RETRIEVAL_DOCUMENT"),
+    dim: int = Query(..., ge=1),
+):
+    res = ann_maintenance.compact_key((model_name, task_type, dim))
+    if res is None:
+        raise HTTPException(status_code=404, detail="Index is not loaded")
+    return res
+
+@app.post("/api/ann/reconcile")
+def reconcile_ann_indexes(
+    model_name: Optional[str] = Query(None, description="Reconcile only this key (with task_type and dim)"),
+    task_type: str = Query("RETRIEVAL_DOCUMENT"),
+    dim: Optional[int] = Query(None, ge=1),
+):
+    # Incremental alternative to /api/ann/rebuild: only missing, deleted and updated rows are touched
+    key = (model_name, task_type, dim) if model_name and dim else None
+    return ann_maintenance.reconcile([key] if key else None)
+
+@app.post("/api/ann/warmup", status_code=202)
+def warmup_ann_indexes(
+    model_name: Optional[str] = Query(None, description="Warm only this key (with task_type and dim)"),
+    task_type: str = Query("RETRIEVAL_DOCUMENT"),
+    dim: Optional[int] = Query(None, ge=1),
+):
+    key = (model_name, task_type, dim) if model_name and dim else None
+    return {"started": ann_maintenance.request_warm(key), "key": list(key) if key else None}
+
+# ---------------------------
+# profile
+# The per-field endpoints and PATCH /api/profile share these setters.
+# ---------------------------
+def _apply_quiz(user: User, payload: QuizAnswersIn):
     # Map quiz answers -> user profile fields
     if payload.schoolStatus:
-        current.school_or_career_type = payload.schoolStatus
+        user.school_or_career_type = payload.schoolStatus
     if payload.wakeTime:
-        current.wake_time = payload.wakeTime
+        user.wake_time = payload.wakeTime
     if payload.sleepTime:
-        current.sleep_time = payload.sleepTime
+        user.sleep_time = payload.sleepTime
     if payload.freeDays is not None:
-        current.preferred_days = _list_to_csv(payload.freeDays)
+        user.preferred_days = _list_to_csv(payload.freeDays)
 
+def _apply_personality(user: User, selected: List[str]):
+    # If frontend sends ["Q: A", "Q2: A2", ...], join to one string for storage
+    user.personality_type = ",".join(selected) if selected else None
+
+def _apply_location(user: User, location: Optional[str]):
+    user.location = (location or "").strip() or None
+
+@app.patch("/api/profile", response_model=UserOut)
+def update_profile(
+    payload: ProfileUpdateIn,
+    current: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # Any subset of the onboarding fields in one transaction and one re-embed
+    sent = payload.model_fields_set
+    if "quiz" in sent and payload.quiz is not None:
+        _apply_quiz(current, payload.quiz)
+    if "personality" in sent:
+        _apply_personality(current, payload.personality or [])
+    if "interests" in sent:
+        current.interests = _list_to_csv(payload.interests or [])
+    if "causes" in sent:
+        current.causes_interested = _list_to_csv(payload.causes or [])
+    if "location" in sent:
+        _apply_location(current, payload.location)
+
+    if sent:
+        db.commit()
+        _profile_changed(current.id)
+        db.refresh(current)
+    return _user_out(current)
+
+@app.post("/api/profile/quiz")
+def save_quiz_answers(
+    payload: QuizAnswersIn,
+    current: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    _apply_quiz(current, payload)
     db.add(current)
     db.commit()
+    _profile_changed(current.id)
     db.refresh(current)
     return {"ok": True}
 
@@ -743,10 +945,10 @@ def set_personality(
     current: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    # If frontend sends ["Q: A", "Q2: A2", ...], join to one string for storage
-    current.personality_type = ",".join(payload.selected) if payload.selected else None
+    _apply_personality(current, payload.selected)
     db.add(current)
     db.commit()
+    _profile_changed(current.id)
     return {"ok": True}
 
 @app.post("/api/profile/interests")
@@ -758,6 +960,7 @@ def set_interests(
     current.interests = _list_to_csv(payload.selected)
     db.add(current)
     db.commit()
+    _profile_changed(current.id)
     return {"ok": True}
 
 @app.post("/api/profile/causes")
@@ -769,10 +972,12 @@ def set_causes(
     current.causes_interested = _list_to_csv(payload.selected)
     db.add(current)
     db.commit()
+    _profile_changed(current.id)
     return {"ok": True}
 
 @app.post("/api/profile/location")
 def set_location(payload: dict, current: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    current.location = (payload.get("location") or "").strip() or None
+    _apply_location(current, payload.get("location"))
     db.add(current); db.commit()
-    return {"ok": True}
\ No newline at end of file
+    _profile_changed(current.id)
+    return {"ok": True}
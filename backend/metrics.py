@@ -0,0 +1,254 @@
+# metrics.py
+# Tiny in-process metrics (counters + histograms), no external dependency.
+# Per-request stage timings are collected through a contextvar and flushed by
+# MetricsMiddleware; render() produces the Prometheus text exposition format.
+# METRICS_ENABLED=0 turns stage/lock timing and the middleware into no-ops.
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+import os, threading, time
+
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * n_buckets
+        self.sum = 0.0
+        self.count = 0
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, _HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = _HistogramSeries(len(self.buckets))
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s.counts[i] += 1
+                    break
+            s.sum += value
+            s.count += 1
+
+    def snapshot(self) -> Dict[LabelValues, Tuple[List[int], float, int]]:
+        """Per label set: (non-cumulative bucket counts, sum, count)."""
+        with self._lock:
+            return {k: (list(s.counts), s.sum, s.count) for k, s in self._series.items()}
+
+# Global registry, name -> metric
+_REGISTRY: Dict[str, object] = {}
+_REG_LOCK = threading.Lock()
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    with _REG_LOCK:
+        m = _REGISTRY.get(name)
+        if m is None:
+            m = _REGISTRY[name] = Counter(name, help, labelnames)
+        return m
+
+def histogram(
+    name: str,
+    help: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    with _REG_LOCK:
+        m = _REGISTRY.get(name)
+        if m is None:
+            m = _REGISTRY[name] = Histogram(name, help, labelnames, buckets)
+        return m
+
+
+# ---------------------------
+# per-request stage timing
+# ---------------------------
+class _RequestStats:
+    __slots__ = ("stages", "queries")
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+        self.queries = 0
+
+_CURRENT: ContextVar[Optional[_RequestStats]] = ContextVar("metrics_request", default=None)
+_NULL_CTX = nullcontext()
+
+STAGE_SECONDS = histogram(
+    "request_stage_seconds", "Time spent in a named stage of a request",
+    labelnames=("route", "stage"),
+)
+HTTP_SECONDS = histogram(
+    "http_request_seconds", "End-to-end request latency",
+    labelnames=("method", "route", "status"),
+)
+HTTP_DB_QUERIES = histogram(
+    "http_request_db_queries", "SQL statements executed per request",
+    labelnames=("route",), buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100, 250),
+)
+DB_QUERIES = counter("db_queries_total", "SQL statements executed")
+LOCK_WAIT_SECONDS = histogram(
+    "lock_wait_seconds", "Time spent waiting to acquire an instrumented lock",
+    labelnames=("lock", "op"), buckets=(0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+LOCK_HOLD_SECONDS = histogram(
+    "lock_hold_seconds", "Time an instrumented lock was held",
+    labelnames=("lock", "op"), buckets=(0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+@contextmanager
+def _timed_stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t0
+        req = _CURRENT.get()
+        if req is not None:
+            req.stages.append((name, dt))
+        else:
+            STAGE_SECONDS.observe(dt, route="-", stage=name)  # background work
+
+def stage(name: str):
+    """`with stage("ann_search"): ...` records the block under the current request's route."""
+    return _timed_stage(name) if ENABLED else _NULL_CTX
+
+@contextmanager
+def timed_lock(lock, name: str, op: str):
+    """Acquire `lock`, recording wait and hold time separately."""
+    if not ENABLED:
+        with lock:
+            yield
+        return
+    t0 = time.perf_counter()
+    lock.acquire()
+    t1 = time.perf_counter()
+    try:
+        yield
+    finally:
+        lock.release()
+        t2 = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(t1 - t0, lock=name, op=op)
+        LOCK_HOLD_SECONDS.observe(t2 - t1, lock=name, op=op)
+
+def instrument_engine(engine):
+    """Count SQL statements (globally and per request) on a SQLAlchemy engine."""
+    if not ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERIES.inc()
+        req = _CURRENT.get()
+        if req is not None:
+            req.queries += 1
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency, per-stage histograms and DB query counts per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        req = _RequestStats()
+        token = _CURRENT.set(req)
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            dt = time.perf_counter() - t0
+            _CURRENT.reset(token)
+            # Route template (e.g. /api/events/{event_id}/rsvp) keeps label cardinality bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_SECONDS.observe(dt, method=scope.get("method", ""), route=route, status=status[0])
+            HTTP_DB_QUERIES.observe(req.queries, route=route)
+            for name, sdt in req.stages:
+                STAGE_SECONDS.observe(sdt, route=route, stage=name)
+
+# ---------------------------
+# exposition
+# ---------------------------
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render() -> str:
+    """All registered metrics in Prometheus text exposition format (0.0.4)."""
+    with _REG_LOCK:
+        metrics = list(_REGISTRY.values())
+    out: List[str] = []
+    for m in metrics:
+        if isinstance(m, Counter):
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} counter")
+            for lv, v in sorted(m.snapshot().items()):
+                out.append(f"{m.name}{_labels(m.labelnames, lv)} {v}")
+        elif isinstance(m, Histogram):
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} histogram")
+            for lv, (counts, total, n) in sorted(m.snapshot().items()):
+                cum = 0
+                for b, c in zip(m.buckets, counts):
+                    cum += c
+                    le = 'le="%s"' % b
+                    out.append(f"{m.name}_bucket{_labels(m.labelnames, lv, le)} {cum}")
+                le = 'le="+Inf"'
+                out.append(f"{m.name}_bucket{_labels(m.labelnames, lv, le)} {n}")
+                out.append(f"{m.name}_sum{_labels(m.labelnames, lv)} {total}")
+                out.append(f"{m.name}_count{_labels(m.labelnames, lv)} {n}")
+    return "\n".join(out) + "\n"
@@ -0,0 +1,418 @@
+# migration.py
+# Zero-downtime switch to a new embedding model or dim. When the configured
+# model (EMBED_MODEL / EMBED_DIM) differs from the one the live tables hold,
+# a migration row is created and a background worker embeds every event and
+# user with the new model into the *_next staging tables and the new model's
+# ANN index. Live rows, the old index and all write paths keep using the old
+# ("serving") model meanwhile. At 100% coverage the staging rows replace the
+# live ones in one transaction, and the old index is deleted.
+from __future__ import annotations
+from typing import NamedTuple, Optional
+import json, logging, os, socket, threading, time
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, noload
+from db.database import engine
+from db.models import (
+    Event, EventEmbedding, EventEmbeddingNext, EmbeddingMigration,
+    User, UserQueryEmbedding, UserQueryEmbeddingNext,
+)
+import ann_index
+import user_vectors
+import vector_store
+from indexing import EMBED_BATCH, TASK_DOCUMENT, _dialect_insert, embed_and_index_events, index_events, text_hash
+
+EMBED_MIGRATION = os.getenv("EMBED_MIGRATION", "auto").strip().lower()  # auto | off
+EMBED_MIGRATION_AUTO_CUTOVER = os.getenv("EMBED_MIGRATION_AUTO_CUTOVER", "1") != "0"
+EMBED_MIGRATION_RESCAN_SECONDS = float(os.getenv("EMBED_MIGRATION_RESCAN_SECONDS", "30"))
+# How often each process re-reads which model is serving (so all workers switch at cutover)
+EMBED_SERVING_CHECK_SECONDS = float(os.getenv("EMBED_SERVING_CHECK_SECONDS", "10"))
+_LEASE_SECONDS = 60   # a worker that hasn't heartbeated this long loses the migration
+TASK_QUERY = "RETRIEVAL_QUERY"
+
+logger = logging.getLogger("ISolution.migration")
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+class ModelSpec(NamedTuple):
+    model_name: str
+    dim: int
+
+def target() -> ModelSpec:
+    from embeddings import EMBED_MODEL, OUTPUT_DIM
+    return ModelSpec(EMBED_MODEL, OUTPUT_DIM)
+
+def _doc_key(spec: ModelSpec):
+    return (spec.model_name, TASK_DOCUMENT, spec.dim)
+
+# ---------------------------
+# serving model
+# ---------------------------
+_serving: Optional[ModelSpec] = None
+_serving_checked = 0.0
+_serving_lock = threading.Lock()
+
+def running(db: Session) -> Optional[EmbeddingMigration]:
+    return (
+        db.query(EmbeddingMigration)
+        .filter(EmbeddingMigration.status == "running")
+        .order_by(EmbeddingMigration.id)
+        .first()
+    )
+
+def _set_serving(spec: ModelSpec):
+    global _serving
+    old, _serving = _serving, spec
+    if old is not None and old != spec:
+        # A cutover happened (here or in another worker): cached query vectors
+        # and the old index belong to the previous model.
+        user_vectors.clear()
+        ann_index.unload(_doc_key(old))
+        vector_store.unload(_doc_key(old))
+        logger.info("Serving embeddings from %s (was %s)", spec, old)
+
+def serving(db: Optional[Session] = None) -> ModelSpec:
+    """
+    The model live rows and write paths use: the source model while a
+    migration is running, otherwise the configured one.
+    """
+    global _serving_checked
+    now = time.monotonic()
+    if _serving is not None and now - _serving_checked < EMBED_SERVING_CHECK_SECONDS:
+        return _serving
+    with _serving_lock:
+        if _serving is None or now - _serving_checked >= EMBED_SERVING_CHECK_SECONDS:
+            try:
+                if db is not None:
+                    m = running(db)
+                else:
+                    with Session(engine) as s:
+                        m = running(s)
+                _set_serving(ModelSpec(m.source_model, m.source_dim) if m else target())
+            except Exception as e:  # e.g. schema not created yet
+                logger.debug("serving model lookup failed: %s", e)
+                if _serving is None:
+                    _set_serving(target())
+            _serving_checked = now
+    return _serving
+
+def serving_provider():
+    from embeddings import get_provider
+    spec = serving()
+    return get_provider(spec.model_name, spec.dim)
+
+def _refresh_serving(db: Session):
+    global _serving_checked
+    _serving_checked = 0.0
+    serving(db)
+
+# ---------------------------
+# start / status
+# ---------------------------
+def live_model(db: Session) -> Optional[ModelSpec]:
+    """Most common (model_name, dim) in the live tables, events first."""
+    for model, task in ((EventEmbedding, TASK_DOCUMENT), (UserQueryEmbedding, TASK_QUERY)):
+        row = (
+            db.query(model.model_name, model.dim, func.count())
+            .filter(model.task_type == task)
+            .group_by(model.model_name, model.dim)
+            .order_by(func.count().desc())
+            .first()
+        )
+        if row is not None:
+            return ModelSpec(row[0], row[1])
+    return None
+
+def _clear_staging(db: Session):
+    db.execute(delete(EventEmbeddingNext))
+    db.execute(delete(UserQueryEmbeddingNext))
+
+def start_if_needed(db: Session) -> Optional[EmbeddingMigration]:
+    """
+    Create a migration row when the configured model differs from the live
+    one (or resume the running one). Call at startup after ensure_schema().
+    """
+    tgt = target()
+    m = running(db)
+    if m is not None and ModelSpec(m.target_model, m.target_dim) != tgt:
+        # Configuration changed again mid-migration: abandon the old target
+        logger.warning("Cancelling embedding migration %d to %s/%d (now configured: %s)",
+                       m.id, m.target_model, m.target_dim, tgt)
+        m.status, m.finished_at = "cancelled", datetime.utcnow()
+        _clear_staging(db)
+        db.commit()
+        ann_index.drop((m.target_model, TASK_DOCUMENT, m.target_dim))
+        m = None
+    if m is None and EMBED_MIGRATION != "off":
+        live = live_model(db)
+        if live is not None and live != tgt:
+            m = EmbeddingMigration(
+                source_model=live.model_name, source_dim=live.dim,
+                target_model=tgt.model_name, target_dim=tgt.dim,
+            )
+            db.add(m)
+            try:
+                db.flush()
+            except IntegrityError:
+                # Another worker created the running migration first (unique index); follow that one
+                db.rollback()
+                m = running(db)
+            else:
+                _clear_staging(db)
+                db.commit()
+                logger.info("Embedding model changed %s -> %s: migrating in the background (migration %d)",
+                            live, tgt, m.id)
+    _refresh_serving(db)
+    return m
+
+def status(db: Session) -> dict:
+    m = db.query(EmbeddingMigration).order_by(EmbeddingMigration.id.desc()).first()
+    out = {"serving": serving(db)._asdict(), "target": target()._asdict(), "migration": None}
+    if m is not None:
+        out["migration"] = {
+            "id": m.id, "status": m.status,
+            "source": {"model_name": m.source_model, "dim": m.source_dim},
+            "target": {"model_name": m.target_model, "dim": m.target_dim},
+            "events": {"done": m.events_done, "total": m.events_total},
+            "users": {"done": m.users_done, "total": m.users_total},
+            "coverage": round(_coverage(m), 4),
+            "owner": m.owner, "heartbeat_at": m.heartbeat_at, "error": m.error,
+            "started_at": m.started_at, "finished_at": m.finished_at,
+        }
+    return out
+
+def _coverage(m: EmbeddingMigration) -> float:
+    total = (m.events_total or 0) + (m.users_total or 0)
+    return ((m.events_done or 0) + (m.users_done or 0)) / total if total else 1.0
+
+# ---------------------------
+# sync passes
+# ---------------------------
+def _update_progress(db: Session, m: EmbeddingMigration):
+    m.events_total = db.query(func.count(Event.id)).scalar() or 0
+    m.events_done = (
+        db.query(func.count(EventEmbeddingNext.id))
+        .join(Event, Event.id == EventEmbeddingNext.event_id)
+        .scalar() or 0
+    )
+    m.users_total = db.query(func.count(User.id)).scalar() or 0
+    m.users_done = (
+        db.query(func.count(UserQueryEmbeddingNext.id))
+        .join(User, User.id == UserQueryEmbeddingNext.user_id)
+        .scalar() or 0
+    )
+    m.heartbeat_at = datetime.utcnow()
+    db.commit()
+
+def _sync_events(db: Session, m: EmbeddingMigration, provider, stop: threading.Event) -> int:
+    embedded, last_id, last_progress = 0, 0, time.monotonic()
+    while not stop.is_set():
+        batch = (
+            db.query(
+                Event.id, Event.title, Event.tags, Event.organizers,
+                Event.starts_at, Event.location, Event.description,
+            )
+            .filter(Event.id > last_id)
+            .order_by(Event.id)
+            .limit(EMBED_BATCH)
+            .all()
+        )
+        if not batch:
+            break
+        last_id = batch[-1].id
+        pending = []
+        stats = embed_and_index_events(
+            db, batch, m.target_model, provider=provider, table=EventEmbeddingNext, dim=m.target_dim,
+            defer_index=pending,
+        )
+        db.commit()
+        index_events(pending)  # after the commit, so the index never runs ahead of the table
+        embedded += stats.embedded
+        if time.monotonic() - last_progress > 2:
+            _update_progress(db, m)
+            last_progress = time.monotonic()
+    ann_index.save_index((m.target_model, TASK_DOCUMENT, m.target_dim))
+    return embedded
+
+def _sync_users(db: Session, m: EmbeddingMigration, provider, stop: threading.Event) -> int:
+    from embeddings import embed_queries, user_text
+    embedded, last_id, last_progress = 0, 0, time.monotonic()
+    insert_ = _dialect_insert(db)
+    while not stop.is_set():
+        users = (
+            db.query(User)
+            .filter(User.id > last_id)
+            .order_by(User.id)
+            .options(noload(User.attending), noload(User.query_embedding))
+            .limit(EMBED_BATCH)
+            .all()
+        )
+        if not users:
+            break
+        last_id = users[-1].id
+        texts = {u.id: user_text(u).strip() or "user: no details" for u in users}
+        hashes = {uid: text_hash(t) for uid, t in texts.items()}
+        stored = {
+            r.user_id: r.content_hash
+            for r in db.query(UserQueryEmbeddingNext.user_id, UserQueryEmbeddingNext.content_hash)
+                       .filter(UserQueryEmbeddingNext.user_id.in_(list(texts)))
+        }
+        todo = [uid for uid in texts if stored.get(uid) != hashes[uid]]
+        if todo:
+            vecs = embed_queries([texts[uid] for uid in todo], provider=provider)
+            now = datetime.utcnow()
+            stmt = insert_(UserQueryEmbeddingNext)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[UserQueryEmbeddingNext.user_id],
+                set_={c: stmt.excluded[c] for c in ("vector", "dim", "model_name", "task_type", "content_hash", "updated_at")},
+            )
+            db.execute(stmt, [
+                dict(user_id=uid, vector=json.dumps(vec), dim=len(vec), model_name=m.target_model,
+                     task_type=TASK_QUERY, content_hash=hashes[uid], created_at=now, updated_at=now)
+                for uid, vec in zip(todo, vecs)
+            ])
+            db.commit()
+            embedded += len(todo)
+        # Heartbeat here too, or a long user pass loses the lease to another worker
+        if time.monotonic() - last_progress > 2:
+            _update_progress(db, m)
+            last_progress = time.monotonic()
+    return embedded
+
+def sync_pass(db: Session, m: EmbeddingMigration, stop: Optional[threading.Event] = None) -> int:
+    """Embed new/changed events and users with the target model. Returns how many were embedded."""
+    from embeddings import get_provider
+    stop = stop or threading.Event()
+    provider = get_provider(m.target_model, m.target_dim)
+    n = _sync_events(db, m, provider, stop) + _sync_users(db, m, provider, stop)
+    _update_progress(db, m)
+    return n
+
+# ---------------------------
+# cutover
+# ---------------------------
+_EVENT_COLS = ("event_id", "vector", "dim", "model_name", "task_type", "content_hash", "created_at", "updated_at")
+_USER_COLS = ("user_id", "vector", "dim", "model_name", "task_type", "created_at", "updated_at")
+
+def cutover(db: Session, m: EmbeddingMigration) -> bool:
+    """
+    Final catch-up pass, then (only at 100% coverage) swap the staging rows
+    into the live tables in one transaction and delete the old index.
+    Returns False if coverage is still short.
+    """
+    sync_pass(db, m)
+    if m.events_done < m.events_total or m.users_done < m.users_total:
+        logger.info("Migration %d not ready to cut over: events %d/%d, users %d/%d",
+                    m.id, m.events_done, m.events_total, m.users_done, m.users_total)
+        return False
+
+    db.execute(delete(EventEmbedding).where(EventEmbedding.event_id.in_(select(EventEmbeddingNext.event_id))))
+    db.execute(insert(EventEmbedding).from_select(
+        _EVENT_COLS, select(*[getattr(EventEmbeddingNext, c) for c in _EVENT_COLS])))
+    db.execute(delete(UserQueryEmbedding).where(UserQueryEmbedding.user_id.in_(select(UserQueryEmbeddingNext.user_id))))
+    db.execute(insert(UserQueryEmbedding).from_select(
+        _USER_COLS, select(*[getattr(UserQueryEmbeddingNext, c) for c in _USER_COLS])))
+    _clear_staging(db)
+    m.status, m.finished_at = "cut_over", datetime.utcnow()
+    db.commit()
+    logger.info("Migration %d cut over to %s/%d", m.id, m.target_model, m.target_dim)
+
+    ann_index.drop((m.source_model, TASK_DOCUMENT, m.source_dim))
+    vector_store.drop((m.source_model, TASK_DOCUMENT, m.source_dim))
+    _refresh_serving(db)
+    _catch_up_stragglers(db, ModelSpec(m.target_model, m.target_dim))
+    return True
+
+def _catch_up_stragglers(db: Session, spec: ModelSpec):
+    # Rows written with the old model between the last pass and the swap
+    from embeddings import get_provider
+    from reembed import reembed_user
+    provider = get_provider(spec.model_name, spec.dim)
+    stale = or_(EventEmbedding.model_name != spec.model_name, EventEmbedding.dim != spec.dim)
+    ids = [r[0] for r in db.query(EventEmbedding.event_id).filter(stale)]
+    for i in range(0, len(ids), EMBED_BATCH):
+        events = (
+            db.query(
+                Event.id, Event.title, Event.tags, Event.organizers,
+                Event.starts_at, Event.location, Event.description,
+            )
+            .filter(Event.id.in_(ids[i:i + EMBED_BATCH]))
+            .all()
+        )
+        pending = []
+        embed_and_index_events(db, events, spec.model_name, provider=provider, dim=spec.dim, defer_index=pending)
+        db.commit()
+        index_events(pending)
+    ann_index.save_index()
+    stale_users = or_(UserQueryEmbedding.model_name != spec.model_name, UserQueryEmbedding.dim != spec.dim)
+    uids = [r[0] for r in db.query(UserQueryEmbedding.user_id).filter(stale_users)]
+    for uid in uids:
+        reembed_user(uid)
+    if ids or uids:
+        logger.info("Re-embedded %d events and %d users written during cutover", len(ids), len(uids))
+
+# ---------------------------
+# background worker
+# ---------------------------
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+def _claim(db: Session, mid: int) -> bool:
+    """Take (or keep) the migration's lease so only one process runs it."""
+    now = datetime.utcnow()
+    n = (
+        db.query(EmbeddingMigration)
+        .filter(
+            EmbeddingMigration.id == mid,
+            EmbeddingMigration.status == "running",
+            or_(
+                EmbeddingMigration.owner.is_(None),
+                EmbeddingMigration.owner == _OWNER,
+                EmbeddingMigration.heartbeat_at < now - timedelta(seconds=_LEASE_SECONDS),
+            ),
+        )
+        .update({EmbeddingMigration.owner: _OWNER, EmbeddingMigration.heartbeat_at: now},
+                synchronize_session=False)
+    )
+    db.commit()
+    return n == 1
+
+def _worker(mid: int):
+    while not _stop.is_set():
+        wait = EMBED_MIGRATION_RESCAN_SECONDS
+        with Session(engine) as db:
+            m = db.get(EmbeddingMigration, mid)
+            if m is None or m.status != "running":
+                _refresh_serving(db)
+                return
+            if not _claim(db, mid):
+                wait = _LEASE_SECONDS / 2  # someone else is running it; check back for a dead lease
+            else:
+                try:
+                    db.refresh(m)
+                    n = sync_pass(db, m, _stop)
+                    logger.info("Migration %d: embedded %d; coverage %.1f%%", mid, n, 100 * _coverage(m))
+                    if (EMBED_MIGRATION_AUTO_CUTOVER and not _stop.is_set() and _coverage(m) >= 1.0
+                            and cutover(db, m)):
+                        return
+                except Exception as e:
+                    db.rollback()
+                    logger.exception("Migration %d pass failed", mid)
+                    m.error = str(e)[:2000]
+                    db.commit()
+        _stop.wait(wait)
+
+def start_worker(m: Optional[EmbeddingMigration]):
+    global _thread
+    if m is None or m.status != "running" or (_thread is not None and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_worker, args=(m.id,), name="embed-migration", daemon=True)
+    _thread.start()
+
+def stop():
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=10)
+    _thread = None
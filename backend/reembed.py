@@ -0,0 +1,96 @@
+# reembed.py
+# Debounced re-embedding of user profiles. Profile endpoints call schedule()
+# after they commit; once a user has been quiet for USER_REEMBED_QUIET_SECONDS
+# their user_text is rebuilt and embedded once, however many writes came in.
+from __future__ import annotations
+from typing import Dict, Optional
+import json, logging, os, threading, time
+from sqlalchemy.orm import Session, noload
+from db.database import engine
+from db.models import User, UserQueryEmbedding
+import user_vectors
+
+USER_REEMBED_ENABLED = os.getenv("USER_REEMBED", "1") != "0"
+USER_REEMBED_QUIET_SECONDS = float(os.getenv("USER_REEMBED_QUIET_SECONDS", "3"))
+
+logger = logging.getLogger("ISolution.reembed")
+
+_due: Dict[int, float] = {}          # user_id -> monotonic deadline
+_cond = threading.Condition()
+_thread: Optional[threading.Thread] = None
+_stopping = False
+
+def reembed_user(user_id: int) -> bool:
+    """Rebuild user_text, embed it and upsert the user's query vector. Returns False if the user is gone."""
+    from embeddings import embed_query, user_text
+    import migration
+    with Session(engine) as db:
+        user = db.get(User, user_id, options=[noload(User.attending), noload(User.query_embedding)])
+        if user is None:
+            return False
+        model_name = migration.serving(db).model_name
+        vec = embed_query(user_text(user).strip() or "user: no details", provider=migration.serving_provider())
+        row = db.query(UserQueryEmbedding).filter(UserQueryEmbedding.user_id == user_id).first()
+        if row is None:
+            row = UserQueryEmbedding(user_id=user_id)
+            db.add(row)
+        row.vector = json.dumps(vec)
+        row.dim = len(vec)
+        row.model_name = model_name
+        row.task_type = "RETRIEVAL_QUERY"
+        db.commit()
+        updated_at = row.updated_at
+    user_vectors.put(user_id, model_name, len(vec), vec, updated_at)
+    return True
+
+def _run_due(user_ids):
+    for uid in user_ids:
+        try:
+            reembed_user(uid)
+        except Exception as e:
+            logger.warning("re-embed of user %s failed: %s", uid, e)
+
+def _worker():
+    while True:
+        with _cond:
+            while True:
+                if _stopping:
+                    return
+                if _due:
+                    now = time.monotonic()
+                    ready = [uid for uid, t in _due.items() if t <= now]
+                    if ready:
+                        for uid in ready:
+                            del _due[uid]
+                        break
+                    _cond.wait(min(_due.values()) - now)
+                else:
+                    _cond.wait()
+        _run_due(ready)
+
+def schedule(user_id: int):
+    """(Re)start the quiet-period timer for a user's re-embed."""
+    global _thread
+    if not USER_REEMBED_ENABLED:
+        return
+    with _cond:
+        _due[user_id] = time.monotonic() + USER_REEMBED_QUIET_SECONDS
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_worker, name="user-reembed", daemon=True)
+            _thread.start()
+        _cond.notify()
+
+def stop(flush: bool = True):
+    """Stop the worker; with flush=True pending users are re-embedded now instead of dropped."""
+    global _stopping, _thread
+    with _cond:
+        _stopping = True
+        pending = list(_due)
+        _due.clear()
+        _cond.notify()
+    if _thread is not None:
+        _thread.join(timeout=5)
+    _thread = None
+    _stopping = False
+    if flush:
+        _run_due(pending)
@@ -201,4 +201,13 @@ class QuizAnswersIn(BaseModel):
     freeDays: Optional[List[str]] = None
 
 class StringListIn(BaseModel):
-    selected: List[str]
\ No newline at end of file
+    selected: List[str]
+
+
+class ProfileUpdateIn(BaseModel):
+    # PATCH /api/profile: send any subset; omitted fields are left unchanged
+    quiz: Optional[QuizAnswersIn] = None
+    personality: Optional[List[str]] = None     # same as /api/profile/personality "selected"
+    interests: Optional[List[str]] = None
+    causes: Optional[List[str]] = None
+    location: Optional[str] = None
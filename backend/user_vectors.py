@@ -0,0 +1,82 @@
+# user_vectors.py
+# Small in-process cache of decoded user query vectors, so recommendation
+# requests don't re-read and JSON-decode the UserQueryEmbedding row each time.
+# The cache is per worker: an entry older than USER_VECTOR_CACHE_TTL_SECONDS is
+# revalidated against the row's updated_at (one indexed column, no vector), so a
+# write made in another worker shows up within the TTL.
+from __future__ import annotations
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+import json, os, threading, time
+from sqlalchemy.orm import Session
+from db.models import UserQueryEmbedding
+from metrics import stage
+
+USER_VECTOR_CACHE_SIZE = int(os.getenv("USER_VECTOR_CACHE_SIZE", "10000"))
+USER_VECTOR_CACHE_TTL_SECONDS = float(os.getenv("USER_VECTOR_CACHE_TTL_SECONDS", "5"))
+
+class UserVector(NamedTuple):
+    model_name: str
+    dim: int
+    vector: List[float]
+
+# user_id -> (vector, row updated_at, monotonic time last checked)
+_CACHE: "OrderedDict[int, Tuple[UserVector, Optional[datetime], float]]" = OrderedDict()
+_LOCK = threading.Lock()
+
+def put(user_id: int, model_name: str, dim: int, vector: List[float],
+        updated_at: Optional[datetime] = None) -> UserVector:
+    """Cache a vector; pass the row's updated_at so revalidation can keep it."""
+    uv = UserVector(model_name, dim, vector)
+    if USER_VECTOR_CACHE_SIZE <= 0:
+        return uv
+    with _LOCK:
+        _CACHE[user_id] = (uv, updated_at, time.monotonic())
+        _CACHE.move_to_end(user_id)
+        while len(_CACHE) > USER_VECTOR_CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return uv
+
+def invalidate(user_id: int):
+    with _LOCK:
+        _CACHE.pop(user_id, None)
+
+def clear():
+    """Drop every cached vector (after an embedding model cutover)."""
+    with _LOCK:
+        _CACHE.clear()
+
+def get(db: Session, user_id: int) -> Optional[UserVector]:
+    """Cached query vector for a user, loading it from user_query_embeddings on a miss."""
+    with _LOCK:
+        hit = _CACHE.get(user_id)
+        if hit is not None:
+            _CACHE.move_to_end(user_id)
+    if hit is not None:
+        uv, updated_at, checked = hit
+        if time.monotonic() - checked < USER_VECTOR_CACHE_TTL_SECONDS:
+            return uv
+        with stage("user_vector_check"):
+            current = (db.query(UserQueryEmbedding.updated_at)
+                         .filter(UserQueryEmbedding.user_id == user_id).first())
+        if current is None:
+            invalidate(user_id)
+            return None
+        if updated_at is not None and current.updated_at == updated_at:
+            with _LOCK:
+                if user_id in _CACHE:
+                    _CACHE[user_id] = (uv, updated_at, time.monotonic())
+            return uv
+    with stage("user_vector_load"):
+        row = (
+            db.query(UserQueryEmbedding.model_name, UserQueryEmbedding.dim, UserQueryEmbedding.vector,
+                     UserQueryEmbedding.updated_at)
+              .filter(UserQueryEmbedding.user_id == user_id)
+              .first()
+        )
+    if row is None:
+        return None
+    with stage("json_decode"):
+        vec = json.loads(row.vector)
+    return put(user_id, row.model_name, row.dim, vec, row.updated_at)
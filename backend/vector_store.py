@@ -0,0 +1,452 @@
+# vector_store.py
+# In-memory int8 copies of event vectors per index key, for exact scoring
+# without re-reading JSON from the DB: the rerank step after a coarse ANN pass
+# (ann_index.set_rerank_source) and the brute-force /api/recommendations/test.
+#
+# Scalar quantization per dimension j, fitted on min/max over the key's vectors:
+#     x_j ~= offset_j + scale_j * c_j,  c_j int8
+# A query is scored as q.offset + a * (w_q . c) with w_q = round(q * scale / a)
+# in int8, so the hot loop is an int32-accumulated integer dot product.
+# 1 byte per dim instead of 4 (float32) or ~20 (JSON).
+#
+# The store follows event_embeddings by updated_at: it re-syncs when the key's
+# ANN index generation moves (any worker saved) or every VECTOR_STORE_SYNC_SECONDS.
+# Each sync also diffs the key's event_ids against the store and drops rows that
+# are gone (deleted, or moved to another model/dim), like ann_maintenance's reconcile.
+# With VECTOR_STORE_MMAP=1 the codes are written next to the ANN index files and
+# memory-mapped, so worker processes share one copy in the page cache. A refit
+# rewrites the file, and so does a sync that leaves a large tail, so a restart
+# only syncs rows changed since the last write.
+from __future__ import annotations
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import json, logging, os, threading, time
+import numpy as np
+from sqlalchemy.orm import Session
+from db.database import engine
+from db.models import EventEmbedding, EventEmbeddingNext
+import ann_index
+from ann_index import IndexKey
+from metrics import stage
+
+VECTOR_STORE_MMAP = os.getenv("VECTOR_STORE_MMAP", "0") == "1"
+VECTOR_STORE_SYNC_SECONDS = float(os.getenv("VECTOR_STORE_SYNC_SECONDS", "30"))
+
+_FIT_SAMPLE = 20000          # rows used to fit offset/scale on a full build
+_SYNC_OVERLAP = timedelta(seconds=5)  # re-read a little before synced_at; upserts are idempotent
+_CHUNK = 16384               # rows per scoring chunk
+_RESAVE_ROWS = 1000          # with mmap, fold the tail into the file once it holds this many rows
+
+logger = logging.getLogger("ISolution.vectors")
+
+def _staged(db: Session, key: IndexKey) -> bool:
+    m, _, d = key
+    return db.query(EventEmbeddingNext.id).filter(
+        EventEmbeddingNext.model_name == m, EventEmbeddingNext.dim == d).first() is not None
+
+def _fname(key: IndexKey) -> str:
+    # Metadata (ids, norms, offset/scale, synced_at, codes file name); codes live in a sibling .npy
+    return os.path.join(ann_index._DATA_DIR, f"{ann_index.key_name(key)}.q8.npz")
+
+class _Segment:
+    """ids / int8 codes / dequantized norms / alive mask; codes may be a read-only mmap."""
+
+    def __init__(self, ids: np.ndarray, codes: np.ndarray, norms: np.ndarray, n: Optional[int] = None):
+        self.ids = ids
+        self.codes = codes
+        self.norms = norms
+        self.n = len(ids) if n is None else n
+        self.alive = np.ones(len(ids), dtype=bool)
+
+    @staticmethod
+    def empty(dim: int) -> "_Segment":
+        return _Segment(np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.int8), np.empty(0, dtype=np.float32))
+
+class _Store:
+    def __init__(self, key: IndexKey):
+        self.key = key
+        self.dim = key[2]
+        self.lock = threading.RLock()
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        self.base: Optional[_Segment] = None   # built (possibly mmap'd), immutable
+        self.tail: Optional[_Segment] = None   # appended since; grows in memory
+        self.rows: Dict[int, Tuple[int, int]] = {}  # event_id -> (segment 0/1, row)
+        self.synced_at: Optional[datetime] = None
+        self.generation = -1
+        self.checked_at = 0.0
+        self.clipped = 0                        # values outside the fitted range since the build
+        self.mmap = False
+
+    # --- quantization ---
+    def _fit(self, sample: np.ndarray):
+        lo, hi = sample.min(axis=0), sample.max(axis=0)
+        scale = (hi - lo) / 255.0
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        self.offset = (lo + 128.0 * scale).astype(np.float32)  # centre so codes are signed
+
+    def _quantize(self, arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        c = np.rint((arr - self.offset) / self.scale)
+        self.clipped += int(np.count_nonzero((c < -128) | (c > 127)))
+        codes = np.clip(c, -128, 127).astype(np.int8)
+        norms = np.linalg.norm(self.offset + self.scale * codes, axis=1).astype(np.float32)
+        norms[norms == 0] = 1.0
+        return codes, norms
+
+    # --- writes ---
+    def put(self, ids: List[int], arr: np.ndarray, skip_unchanged: bool = False):
+        if not ids:
+            return
+        codes, norms = self._quantize(arr)
+        with self.lock:
+            if skip_unchanged:
+                # sync overlap re-reads rows we already hold; keep only new or changed ones
+                keep = [i for i, eid in enumerate(ids) if not self._same(eid, codes[i])]
+                ids, codes, norms = [ids[i] for i in keep], codes[keep], norms[keep]
+                if not ids:
+                    return
+            t = self.tail
+            need = t.n + len(ids)
+            if need > len(t.ids):
+                cap = max(need, 2 * len(t.ids), 64)
+                grown = _Segment(np.empty(cap, dtype=np.int64), np.empty((cap, self.dim), dtype=np.int8),
+                                 np.empty(cap, dtype=np.float32), n=t.n)
+                grown.ids[:t.n], grown.codes[:t.n], grown.norms[:t.n] = t.ids[:t.n], t.codes[:t.n], t.norms[:t.n]
+                grown.alive[:t.n] = t.alive[:t.n]
+                self.tail = t = grown
+            for i, eid in enumerate(ids):
+                old = self.rows.get(eid)
+                if old is not None:
+                    (self.base if old[0] == 0 else t).alive[old[1]] = False
+                row = t.n
+                t.ids[row], t.codes[row], t.norms[row], t.alive[row] = eid, codes[i], norms[i], True
+                t.n += 1
+                self.rows[eid] = (1, row)
+
+    def remove(self, ids: Iterable[int]) -> int:
+        """Mark rows dead (they stay in their segment until the next refit)."""
+        n = 0
+        with self.lock:
+            for eid in ids:
+                r = self.rows.pop(eid, None)
+                if r is not None:
+                    (self.base if r[0] == 0 else self.tail).alive[r[1]] = False
+                    n += 1
+        return n
+
+    def _same(self, eid: int, code: np.ndarray) -> bool:
+        r = self.rows.get(eid)
+        return r is not None and np.array_equal((self.base if r[0] == 0 else self.tail).codes[r[1]], code)
+
+    def needs_refit(self) -> bool:
+        # Refit once the tail (or dead rows) outgrow the base, or the fitted range no longer covers the data
+        dead = self.base.n + self.tail.n - len(self.rows)
+        return (self.tail.n > max(1000, self.base.n) or dead > max(1000, len(self.rows))
+                or self.clipped > 0.001 * self.dim * max(1, len(self.rows)))
+
+    def folded(self) -> "_Store":
+        """Copy with the live rows of base and tail merged into one base (same fit, no re-quantizing)."""
+        st = _Store(self.key)
+        with self.lock:
+            live = [(seg, seg.alive[:seg.n]) for seg in (self.base, self.tail)]
+            ids = np.concatenate([seg.ids[:seg.n][m] for seg, m in live])
+            codes = np.concatenate([np.asarray(seg.codes[:seg.n])[m] for seg, m in live])
+            norms = np.concatenate([seg.norms[:seg.n][m] for seg, m in live])
+            st.offset, st.scale, st.synced_at, st.clipped = self.offset, self.scale, self.synced_at, self.clipped
+        st.base = _Segment(ids, codes.reshape(-1, self.dim), norms)
+        st.tail = _Segment.empty(self.dim)
+        st.rows = {int(e): (0, i) for i, e in enumerate(ids.tolist())}
+        return st
+
+    # --- reads ---
+    def _query(self, q: np.ndarray) -> Tuple[np.ndarray, float, float]:
+        w = q * self.scale
+        a = float(np.abs(w).max()) / 127.0 or 1.0
+        wq = np.rint(w / a).astype(np.int8)
+        return wq, a, float(q @ self.offset)
+
+    def _sims(self, seg: _Segment, rows, wq, a, base, qn) -> np.ndarray:
+        codes = seg.codes[rows]
+        dots = np.einsum("ij,j->i", codes, wq, dtype=np.int32)
+        return (base + a * dots) / (qn * seg.norms[rows])
+
+    def score(self, q: np.ndarray, labels: List[int]) -> Tuple[List[int], np.ndarray]:
+        """Cosine similarity for the labels present in the store."""
+        wq, a, base = self._query(q)
+        qn = float(np.linalg.norm(q)) or 1.0
+        found, parts = [], []
+        with self.lock:
+            by_seg = ([], []), ([], [])
+            for lab in labels:
+                r = self.rows.get(lab)
+                if r is not None:
+                    by_seg[r[0]][0].append(lab)
+                    by_seg[r[0]][1].append(r[1])
+            for seg, (labs, rows) in zip((self.base, self.tail), by_seg):
+                if rows:
+                    found.extend(labs)
+                    parts.append(self._sims(seg, np.asarray(rows), wq, a, base, qn))
+        return found, (np.concatenate(parts) if parts else np.empty(0, dtype=np.float32))
+
+    def top_k(self, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Brute-force top-k (ids, cosine similarity) over every live vector."""
+        wq, a, base = self._query(q)
+        qn = float(np.linalg.norm(q)) or 1.0
+        ids, sims = [], []
+        with self.lock:
+            for seg in (self.base, self.tail):
+                for i in range(0, seg.n, _CHUNK):
+                    s = self._sims(seg, slice(i, min(i + _CHUNK, seg.n)), wq, a, base, qn)
+                    s[~seg.alive[i:i + len(s)]] = -np.inf
+                    ids.append(seg.ids[i:i + len(s)])
+                    sims.append(s)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids, sims = np.concatenate(ids), np.concatenate(sims)
+        k = min(k, int(np.count_nonzero(np.isfinite(sims))))
+        if k <= 0:
+            return ids[:0], sims[:0]
+        part = np.argpartition(-sims, k - 1)[:k]
+        order = part[np.argsort(-sims[part])]
+        return ids[order], sims[order]
+
+    def memory_bytes(self) -> int:
+        n = 0
+        for seg in (self.base, self.tail):
+            if not (self.mmap and seg is self.base):
+                n += seg.codes.nbytes
+            n += seg.ids.nbytes + seg.norms.nbytes + seg.alive.nbytes
+        return n + len(self.rows) * 100
+
+# ---------------------------
+# build / sync
+# ---------------------------
+def _table(db: Session, key: IndexKey):
+    return EventEmbeddingNext if _staged(db, key) else EventEmbedding
+
+def _rows(db: Session, key: IndexKey, since: Optional[datetime] = None):
+    m, t, d = key
+    table = _table(db, key)
+    q = (db.query(table.event_id, table.vector, table.updated_at)
+         .filter(table.model_name == m, table.task_type == t, table.dim == d))
+    if since is not None:
+        q = q.filter(table.updated_at >= since - _SYNC_OVERLAP)
+    return q.yield_per(2000)
+
+def _decode(rows) -> Tuple[List[int], np.ndarray, Optional[datetime]]:
+    ids = [r.event_id for r in rows]
+    latest = max((r.updated_at for r in rows if r.updated_at is not None), default=None)
+    return ids, np.asarray([json.loads(r.vector) for r in rows], dtype=np.float32), latest
+
+def _build(db: Session, key: IndexKey) -> _Store:
+    st = _Store(key)
+    d = st.dim
+    it = iter(_rows(db, key))
+    first = []
+    for r in it:
+        first.append(r)
+        if len(first) >= _FIT_SAMPLE:
+            break
+    ids, arr, latest = _decode(first)
+    arr = arr.reshape(-1, d)
+    st._fit(arr if len(arr) else np.zeros((1, d), dtype=np.float32))
+    codes, norms = st._quantize(arr)
+    id_parts, code_parts, norm_parts = [np.asarray(ids, dtype=np.int64)], [codes], [norms]
+    batch = []
+    for r in it:
+        batch.append(r)
+        if len(batch) >= 2000:
+            id_parts, latest = _append_batch(st, batch, id_parts, code_parts, norm_parts, latest)
+            batch = []
+    if batch:
+        id_parts, latest = _append_batch(st, batch, id_parts, code_parts, norm_parts, latest)
+    ids = np.concatenate(id_parts)
+    st.base = _Segment(ids, np.concatenate(code_parts).reshape(-1, d), np.concatenate(norm_parts))
+    st.tail = _Segment.empty(d)
+    st.rows = {int(e): (0, i) for i, e in enumerate(ids.tolist())}
+    st.synced_at = latest
+    return st
+
+def _append_batch(st, batch, id_parts, code_parts, norm_parts, latest):
+    ids, arr, last = _decode(batch)
+    codes, norms = st._quantize(arr.reshape(-1, st.dim))
+    id_parts.append(np.asarray(ids, dtype=np.int64))
+    code_parts.append(codes)
+    norm_parts.append(norms)
+    return id_parts, max(filter(None, (latest, last)), default=None)
+
+def _save(st: _Store):
+    path = _fname(st.key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Codes go to a fresh file each time so processes still mapping the old one are unaffected
+    codes_name = f"{os.path.basename(path)[:-4]}.{os.getpid()}.{time.time_ns()}.npy"
+    np.save(os.path.join(os.path.dirname(path), codes_name), np.ascontiguousarray(st.base.codes))
+    tmp = f"{path}.tmp.{os.getpid()}.npz"
+    np.savez(tmp, ids=st.base.ids, norms=st.base.norms, offset=st.offset, scale=st.scale,
+             codes=np.array(codes_name), synced_at=np.array(st.synced_at.isoformat() if st.synced_at else ""))
+    os.replace(tmp, path)
+    prefix = os.path.basename(path)[:-4] + "."
+    for f in os.listdir(os.path.dirname(path)):
+        if f.startswith(prefix) and f.endswith(".npy") and f != codes_name:
+            try:
+                os.remove(os.path.join(os.path.dirname(path), f))
+            except OSError:
+                pass  # still mapped on Windows; removed by a later save
+
+def _open(key: IndexKey) -> Optional[_Store]:
+    path = _fname(key)
+    if not os.path.exists(path):
+        return None
+    st = _Store(key)
+    with np.load(path) as z:
+        ids, norms = z["ids"], z["norms"]
+        st.offset, st.scale = z["offset"], z["scale"]
+        codes_name, synced = str(z["codes"]), str(z["synced_at"])
+    codes = np.load(os.path.join(os.path.dirname(path), codes_name), mmap_mode="r")
+    if codes.shape != (len(ids), st.dim):
+        return None
+    st.base = _Segment(ids, codes, norms)
+    st.tail = _Segment.empty(st.dim)
+    st.rows = {int(e): (0, i) for i, e in enumerate(ids.tolist())}
+    st.synced_at = datetime.fromisoformat(synced) if synced else None
+    st.mmap = True
+    return st
+
+# ---------------------------
+# registry
+# ---------------------------
+_REGISTRY: Dict[IndexKey, _Store] = {}
+_REG_LOCK = threading.Lock()
+_build_locks: Dict[IndexKey, threading.Lock] = {}
+
+def _rebuild(db: Session, key: IndexKey) -> _Store:
+    t0 = time.perf_counter()
+    st = _build(db, key)
+    logger.info("Vector store %s: quantized %d vectors in %.2fs", key, st.base.n, time.perf_counter() - t0)
+    if VECTOR_STORE_MMAP:
+        _save(st)
+        st = _open(key) or st
+    return st
+
+def _settle(db: Session, st: _Store) -> _Store:
+    """After a sync: refit if due; with mmap, write a large tail back to the
+    file so the next restart only catches up on rows newer than that."""
+    if st.needs_refit():
+        return _rebuild(db, st.key)
+    if VECTOR_STORE_MMAP and st.tail.n >= max(_RESAVE_ROWS, st.base.n // 10):
+        folded = st.folded()
+        _save(folded)
+        fresh = _open(st.key) or folded
+        fresh.clipped = st.clipped
+        return fresh
+    return st
+
+def _load(key: IndexKey) -> _Store:
+    with Session(engine) as db:
+        st = _open(key) if VECTOR_STORE_MMAP else None
+        if st is None:
+            st = _rebuild(db, key)
+        else:
+            _sync(db, st)
+            st = _settle(db, st)
+    st.generation = ann_index.generation(key)
+    st.checked_at = time.monotonic()
+    return st
+
+def _sync(db: Session, st: _Store):
+    """Pull rows updated since the last sync into the tail, and drop rows no longer in the table."""
+    rows = list(_rows(db, st.key, since=st.synced_at)) if st.synced_at else list(_rows(db, st.key))
+    if rows:
+        ids, arr, latest = _decode(rows)
+        st.put(ids, arr.reshape(-1, st.dim), skip_unchanged=True)
+        st.synced_at = max(filter(None, (st.synced_at, latest)), default=None)
+    # updated_at never shows a delete, so diff the ids (only the id column; cheap next to the vectors)
+    m, t, d = st.key
+    table = _table(db, st.key)
+    present = {r[0] for r in db.query(table.event_id).filter(
+        table.model_name == m, table.task_type == t, table.dim == d).yield_per(20000)}
+    with st.lock:
+        gone = [eid for eid in st.rows if eid not in present]
+    if gone:
+        st.remove(gone)
+        logger.info("Vector store %s: dropped %d deleted vectors", st.key, len(gone))
+
+def get(key: IndexKey) -> _Store:
+    """The key's store, built on first use and kept in step with event_embeddings."""
+    with _REG_LOCK:
+        st = _REGISTRY.get(key)
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+    if st is None:
+        with build_lock:
+            st = _REGISTRY.get(key)
+            if st is None:
+                with stage("vector_store_build"):
+                    st = _load(key)
+                with _REG_LOCK:
+                    _REGISTRY[key] = st
+        return st
+    gen = ann_index.generation(key)
+    now = time.monotonic()
+    if gen == st.generation and now - st.checked_at < VECTOR_STORE_SYNC_SECONDS:
+        return st
+    if not build_lock.acquire(blocking=False):
+        return st  # another thread is syncing; serve what we have
+    try:
+        st.generation, st.checked_at = gen, now
+        with stage("vector_store_sync"), Session(engine) as db:
+            _sync(db, st)
+            fresh = _settle(db, st)
+        if fresh is not st:
+            fresh.generation, fresh.checked_at = gen, now
+            with _REG_LOCK:
+                _REGISTRY[key] = st = fresh
+    finally:
+        build_lock.release()
+    return st
+
+def unload(key: IndexKey):
+    with _REG_LOCK:
+        _REGISTRY.pop(key, None)
+
+def drop(key: IndexKey):
+    """Forget a key (e.g. the old model after a migration cutover) and delete its files."""
+    unload(key)
+    path = _fname(key)
+    prefix = os.path.basename(path)[:-4] + "."
+    if os.path.isdir(os.path.dirname(path)):
+        for f in os.listdir(os.path.dirname(path)):
+            if f == os.path.basename(path) or (f.startswith(prefix) and f.endswith(".npy")):
+                try:
+                    os.remove(os.path.join(os.path.dirname(path), f))
+                except OSError:
+                    pass
+
+# ---------------------------
+# scoring entry points
+# ---------------------------
+def rerank(key: IndexKey, query: np.ndarray, labels: List[int]) -> Tuple[List[int], np.ndarray]:
+    """ann_index rerank source: cosine similarity of `query` to each known label."""
+    return get(key).score(np.asarray(query, dtype=np.float32), labels)
+
+def top_k(key: IndexKey, query: Iterable[float], k: int) -> List[Tuple[int, float]]:
+    """Brute-force (event_id, cosine similarity) top-k over the key's vectors."""
+    ids, sims = get(key).top_k(np.asarray(query, dtype=np.float32), k)
+    return list(zip(ids.tolist(), sims.tolist()))
+
+def stats() -> List[dict]:
+    with _REG_LOCK:
+        stores = list(_REGISTRY.values())
+    out = []
+    for st in stores:
+        with st.lock:
+            m, t, d = st.key
+            n = len(st.rows)
+            out.append({
+                "model_name": m, "task_type": t, "dim": d, "count": n,
+                "tail": st.tail.n, "clipped": st.clipped, "mmap": st.mmap,
+                "synced_at": st.synced_at.isoformat() if st.synced_at else None,
+                "memory_bytes": st.memory_bytes(),
+                "float32_bytes": n * d * 4,
+            })
+    return out
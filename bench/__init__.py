@@ -0,0 +1,10 @@
+# bench/
+# Performance benchmarks. Run modules from the repo root, e.g.:
+#   python -m bench.endpoints --sizes 1000,10000     (recommendation hot paths)
+#   python -m bench.import_parse --rows 1000000     (CSV import parsing)
+#   python -m bench.embed_paths --rows 100000       (import/backfill embedding paths)
+#   python -m bench.startup --events 5000           (cold start: import, serving, /api/ready)
+#   python -m bench.quantized --events 20000        (int8 vector store vs float32: recall, memory, latency)
+#   python -m bench.ann_backends --n 100000         (hnswlib vs IVF-PQ: memory, latency, recall)
+#   python -m bench.sharded --n 200000              (1 vs S shards: build, search, one-shard rebuild)
+#   python -m bench.bulk_upload --n 100000          (bulk vector upload: DB write, JSON encoding, ANN insert)
@@ -0,0 +1,90 @@
+# bench/ann_backends.py
+# hnswlib vs the IVF-PQ backend of ann_index on the same vectors: build time,
+# resident memory estimate vs memory-mapped bytes, on-disk size, search
+# latency and recall@k against exact cosine. IVF-PQ is measured at several
+# nprobe values, with and without the full-vector rerank (a float32 source here;
+# the app uses the int8 vector store). Vectors are clustered (a mixture of
+# Gaussians), which is closer to real embeddings than uniform noise.
+# Usage: python -m bench.ann_backends [--n 100000] [--dim 256] [--nprobe 8,16,32] [--queries 200]
+
+import argparse, os, time
+
+import numpy as np
+
+from bench.common import use_scratch_backend, print_table, summarize
+
+
+def clustered(n: int, dim: int, rng: np.random.Generator, clusters: int = 500) -> np.ndarray:
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    x = centres[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def _dir_bytes(path: str, prefix: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path) if f.startswith(prefix))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare ANN backends: memory, latency, recall.")
+    ap.add_argument("--n", type=int, default=100000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--nprobe", default="8,16,32")
+    ap.add_argument("--rerank-factor", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir")
+    args = ap.parse_args(argv)
+
+    work = use_scratch_backend(args.workdir)
+    import ann_index
+
+    rng = np.random.default_rng(args.seed)
+    print(f"Generating {args.n} x {args.dim} clustered vectors ...")
+    data = clustered(args.n, args.dim, rng)
+    labels = np.arange(1, args.n + 1)
+    queries = data[rng.integers(0, args.n, args.queries)] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    truth = [set((np.argsort(-(data @ q))[:args.k] + 1).tolist()) for q in queries]
+
+    def full_vectors(key, q, labs):
+        return labs, data[np.asarray(labs) - 1] @ (q / np.linalg.norm(q))
+
+    configs = [("hnsw", {}, False)]
+    for nprobe in [int(x) for x in args.nprobe.split(",")]:
+        configs += [("ivfpq", {"nprobe": nprobe}, False), ("ivfpq", {"nprobe": nprobe}, True)]
+
+    rows, built = [], {}
+    for backend, extra, rerank in configs:
+        key = (f"bench-{backend}", "RETRIEVAL_DOCUMENT", args.dim)
+        ann_index.save_tuning(key, {"backend": backend, "rerank_factor": args.rerank_factor, **extra})
+        if key not in built:
+            t0 = time.perf_counter()
+            ann_index.rebuild(key, args.dim, zip(labels.tolist(), data))
+            built[key] = time.perf_counter() - t0
+        ann_index.set_rerank_source(full_vectors if rerank else None)
+        lat, hits = [], 0
+        for q, want in zip(queries, truth):
+            t0 = time.perf_counter()
+            res = ann_index.search(key, args.dim, q, args.k)
+            lat.append(time.perf_counter() - t0)
+            hits += len(want & {lab for lab, _ in res})
+        st = ann_index.stats(key)[0]
+        rows.append({
+            "backend": backend + (f" nprobe={extra['nprobe']}" if extra else "") + (" +rerank" if rerank else ""),
+            "build_s": built[key],
+            f"recall@{args.k}": round(hits / (len(queries) * args.k), 4),
+            "resident_MB": st["memory_bytes_est"] / 1e6,
+            "mapped_MB": (st.get("mapped_bytes") or 0) / 1e6,
+            "disk_MB": _dir_bytes(os.path.join(work, "ann_store"), ann_index.key_name(key)) / 1e6,
+            **{k: v for k, v in summarize(lat, sum(lat)).items() if k in ("p50_ms", "p95_ms")},
+        })
+    ann_index.set_rerank_source(None)
+
+    print(f"\n{args.n} vectors, dim {args.dim}, {args.queries} queries, k={args.k} "
+          f"(rerank = top k*{args.rerank_factor} re-scored on full vectors):")
+    print_table(rows, ["backend", "build_s", f"recall@{args.k}", "resident_MB", "mapped_MB", "disk_MB",
+                       "p50_ms", "p95_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# bench/bulk_upload.py
+# POST /api/embeddings/events/bulk with precomputed vectors, binary and NDJSON:
+# request time split into the DB write (JSON text encoding + one upsert) and the
+# ANN insert, plus rows/s. The vector columns hold JSON text, so encode_rows()
+# is timed on its own too; at high dims it is most of the DB share.
+# Usage: python -m bench.bulk_upload [--n 100000] [--dim 1536] [--batch 10000] [--formats binary,ndjson]
+
+import argparse, json, os, time
+
+import numpy as np
+
+from bench.common import use_scratch_backend, print_table
+
+
+def _bodies(fmt: str, ids: np.ndarray, vecs: np.ndarray):
+    if fmt == "binary":
+        return ids.astype("<i8").tobytes() + vecs.astype("<f4").tobytes(), "application/octet-stream"
+    lines = (json.dumps({"event_id": e, "vector": v}) for e, v in zip(ids.tolist(), vecs.tolist()))
+    return "\n".join(lines).encode(), "application/x-ndjson"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark bulk embedding uploads.")
+    ap.add_argument("--n", type=int, default=100000)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--batch", type=int, default=10000, help="rows per request")
+    ap.add_argument("--formats", default="binary,ndjson")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir")
+    args = ap.parse_args(argv)
+
+    # Events exist under a small seed model; the uploads go to their own keys
+    os.environ.update(STARTUP_BACKFILL="off", EMBED_MIGRATION="off", LOCAL_EMBED_MODEL="bench-seed", EMBED_DIM="8")
+    use_scratch_backend(args.workdir)
+    from fastapi.testclient import TestClient
+    from bench import synthetic
+    import bulk_embeddings, main as app_main
+
+    print(f"Seeding {args.n} events ...")
+    synthetic.grow_corpus(args.n, 0, 8, "bench-seed")
+    ids = np.asarray(sorted(synthetic.event_ids())[:args.n], dtype=np.int64)
+    rng = np.random.default_rng(args.seed)
+
+    sample = synthetic.unit_vectors(min(2000, args.n), args.dim, rng)
+    t0 = time.perf_counter()
+    bulk_embeddings.encode_rows(sample)
+    encode_ms = (time.perf_counter() - t0) / len(sample) * 1000
+    print(f"encode_rows: {encode_ms:.3f} ms/row at dim {args.dim}")
+
+    rows = []
+    with TestClient(app_main.app) as c:
+        for fmt in args.formats.split(","):
+            db_s = index_s = wall = 0.0
+            for i in range(0, len(ids), args.batch):
+                chunk = ids[i:i + args.batch]
+                body, ctype = _bodies(fmt, chunk, synthetic.unit_vectors(len(chunk), args.dim, rng))
+                t0 = time.perf_counter()
+                r = c.post("/api/embeddings/events/bulk", content=body, headers={"content-type": ctype},
+                           params={"model_name": f"bench-bulk-{fmt}", "dim": args.dim})
+                wall += time.perf_counter() - t0
+                r.raise_for_status()
+                db_s += r.json()["db_seconds"]
+                index_s += r.json()["index_seconds"]
+            rows.append({"format": fmt, "rows": len(ids), "total_s": wall, "db_s": db_s, "index_s": index_s,
+                         "other_s": wall - db_s - index_s, "rows_per_s": len(ids) / wall,
+                         "encode_est_s": encode_ms * len(ids) / 1000})
+
+    print(f"\n{len(ids)} vectors, dim {args.dim}, {args.batch} rows per request "
+          f"(other = HTTP body + parsing):")
+    print_table(rows, ["format", "rows", "total_s", "db_s", "encode_est_s", "index_s", "other_s", "rows_per_s"])
+
+
+if __name__ == "__main__":
+    main()
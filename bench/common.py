@@ -0,0 +1,61 @@
+# bench/common.py
+# Shared helpers: point the backend at a scratch DB / ANN store and summarize timings.
+import os, sys, tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = PROJECT_ROOT / "backend"
+
+
+def use_scratch_backend(workdir: Optional[str] = None) -> Path:
+    """
+    Configure env so backend modules use a throwaway SQLite DB and ANN store,
+    then put backend/ on sys.path. Call before importing any backend module.
+    """
+    work = Path(workdir or tempfile.mkdtemp(prefix="isolution-bench-"))
+    work.mkdir(parents=True, exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite:///{(work / 'bench.db').as_posix()}"
+    os.environ["ANN_STORE_DIR"] = str(work / "ann_store")
+    os.environ.setdefault("EMBED_PROVIDER", "local")  # offline, deterministic embeddings
+    os.environ["USER_REEMBED"] = "0"          # no background embedding calls
+    os.environ.setdefault("STARTUP_BACKFILL", "sync")  # lifespan finishes its backfill before timing starts
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+    return work
+
+
+def percentile(sorted_vals: Sequence[float], p: float) -> float:
+    if not sorted_vals:
+        return float("nan")
+    i = min(len(sorted_vals) - 1, max(0, int(round(p / 100.0 * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+def summarize(latencies: List[float], wall_seconds: float, errors: int = 0) -> Dict[str, float]:
+    """Latencies in seconds -> {n, errors, p50/p95/p99 in ms, qps}."""
+    lat = sorted(latencies)
+    return {
+        "n": len(lat),
+        "errors": errors,
+        "p50_ms": percentile(lat, 50) * 1000,
+        "p95_ms": percentile(lat, 95) * 1000,
+        "p99_ms": percentile(lat, 99) * 1000,
+        "qps": len(lat) / wall_seconds if wall_seconds > 0 else float("nan"),
+    }
+
+
+def print_table(rows: List[Dict], columns: Sequence[str]):
+    widths = {c: max(len(c), *(len(_fmt(r.get(c))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(_fmt(r.get(c)).ljust(widths[c]) for c in columns))
+
+
+def _fmt(v) -> str:
+    if isinstance(v, float):
+        return f"{v:,.2f}"
+    if isinstance(v, int):
+        return f"{v:,}"
+    return "" if v is None else str(v)
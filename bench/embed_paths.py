@@ -0,0 +1,42 @@
+# bench/embed_paths.py
+# Throughput of the embedding write paths with the offline local provider:
+# CSV import with --embed, an unchanged re-import (delta path), and the
+# startup backfill. Set EMBED_LATENCY_MS to mimic the remote API per call.
+# Usage: python -m bench.embed_paths [--rows 100000] [--workers N] [--latency-ms 0]
+
+import argparse, os, time
+from pathlib import Path
+
+from bench.common import use_scratch_backend
+
+
+def _timed(label: str, fn, rows: int):
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    print(f"-- {label}: {dt:.2f}s ({rows / dt:,.0f} rows/s)\n")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark import/backfill embedding paths offline.")
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="artificial latency per embedding call")
+    ap.add_argument("--workdir")
+    args = ap.parse_args(argv)
+
+    os.environ["EMBED_PROVIDER"] = "local"
+    os.environ["EMBED_LATENCY_MS"] = str(args.latency_ms)
+    work = use_scratch_backend(args.workdir)
+    from bench.import_parse import make_synthetic_csv, import_csv
+    import main as app_main
+
+    csv_path = make_synthetic_csv(Path(work) / "events.csv", args.rows)
+    cli = [str(csv_path), "--embed", "--workers", str(args.workers)]
+    _timed("import --embed (cold)", lambda: import_csv.main(cli), args.rows)
+    _timed("import --embed (unchanged re-import)", lambda: import_csv.main(cli), args.rows)
+    _timed("startup backfill (nothing to do)", app_main.create_missing_embeddings, args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# bench/endpoints.py
+# Latency/QPS of the recommendation hot paths at several corpus sizes.
+# Runs the real FastAPI app in-process (TestClient) against a scratch DB.
+# Usage: python -m bench.endpoints [--sizes 1000,10000] [--users 200] [--dim 1536]
+#                                  [--requests 200] [--concurrency 1] [--json out.json]
+
+import argparse, json, random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import use_scratch_backend, summarize, print_table
+
+
+def _run(client, n: int, concurrency: int, make_request):
+    """Call make_request(client, i) n times; return (latencies, wall seconds, errors)."""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        t0 = time.perf_counter()
+        r = make_request(client, i)
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+            if r.status_code >= 400:
+                errors += 1
+
+    t0 = time.perf_counter()
+    if concurrency <= 1:
+        for i in range(n):
+            one(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(n)))
+    return latencies, time.perf_counter() - t0, errors
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark recommendation hot paths.")
+    ap.add_argument("--sizes", default="1000,10000", help="comma-separated event counts")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    ap.add_argument("--rebuild-requests", type=int, default=3)
+    ap.add_argument("--test-max-events", type=int, default=20000,
+                    help="skip the exact-scan /test endpoint above this corpus size")
+    ap.add_argument("--concurrency", type=int, default=1)
+    ap.add_argument("--workdir", help="keep the scratch DB/ANN store here (default: temp dir)")
+    ap.add_argument("--json", help="also write results to this file")
+    args = ap.parse_args(argv)
+
+    work = use_scratch_backend(args.workdir)
+    # Backend imports must come after use_scratch_backend()
+    from fastapi.testclient import TestClient
+    import main as app_main
+    from auth import create_access_token
+    from embeddings import EMBED_MODEL as model
+    from bench import synthetic
+
+    sizes = sorted(int(s) for s in args.sizes.split(",") if s.strip())
+    results = []
+    print(f"scratch dir: {work}")
+
+    for size in sizes:
+        t0 = time.perf_counter()
+        n_events, n_users = synthetic.grow_corpus(size, args.users, args.dim, model)
+        print(f"\n== {n_events:,} events, {n_users:,} users, dim {args.dim} "
+              f"(generated in {time.perf_counter() - t0:.1f}s) ==")
+        users = synthetic.user_ids_and_names()
+        events = synthetic.event_ids()
+        tokens = {uid: {"Authorization": f"Bearer {create_access_token(name)}"} for uid, name in users}
+        rnd = random.Random(size)
+
+        def uid():
+            return rnd.choice(users)[0]
+
+        cases = [
+            ("GET /api/recommendations/ann", args.requests,
+             lambda c, i: c.get("/api/recommendations/ann", params={"user_id": uid(), "top_k": 10})),
+            ("GET /api/recommendations/ann/by_category", args.requests,
+             lambda c, i: c.get("/api/recommendations/ann/by_category", params={"user_id": uid(), "top_k": 5})),
+            ("GET /api/events", max(1, args.requests // 20),
+             lambda c, i: c.get("/api/events")),
+            ("POST /api/events/{id}/rsvp", args.requests,
+             lambda c, i: c.post(f"/api/events/{rnd.choice(events)}/rsvp", headers=tokens[uid()])),
+            ("POST /api/ann/rebuild", args.rebuild_requests,
+             lambda c, i: c.post("/api/ann/rebuild", params={"model_name": model, "dim": args.dim})),
+        ]
+        if n_events <= args.test_max_events:
+            cases.insert(2, ("GET /api/recommendations/test", max(1, args.requests // 10),
+                             lambda c, i: c.get("/api/recommendations/test", params={"user_id": uid(), "top_k": 10})))
+
+        with TestClient(app_main.app) as client:
+            for name, n, fn in cases:
+                _run(client, min(3, n), 1, fn)  # warm-up
+                lat, wall, errors = _run(client, n, args.concurrency, fn)
+                row = {"events": n_events, "endpoint": name, **summarize(lat, wall, errors)}
+                results.append(row)
+                print_table([row], ["endpoint", "n", "errors", "p50_ms", "p95_ms", "p99_ms", "qps"])
+
+    print("\n== summary ==")
+    print_table(results, ["events", "endpoint", "n", "errors", "p50_ms", "p95_ms", "p99_ms", "qps"])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
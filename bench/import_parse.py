@@ -0,0 +1,99 @@
+# bench/import_parse.py
+# Parse throughput of scripts/import_csv.py over a synthetic CSV derived from
+# external_data/events.csv: serial without memoization (old behaviour),
+# serial with memoized date/time parsing, and the chunked process pool.
+# Usage: python -m bench.import_parse [--rows 1000000] [--workers N] [--csv out.csv]
+
+import argparse, csv, os, random, sys, tempfile, time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(PROJECT_ROOT / "scripts"))
+
+import import_csv  # noqa: E402
+
+SOURCE_CSV = PROJECT_ROOT / "external_data" / "events.csv"
+
+
+def _date_pool(n: int, rng: random.Random):
+    """A few hundred date strings in the formats real feeds use."""
+    fmts = ("%B %d, %Y", "%b %d %Y", "%m/%d/%Y", "%Y-%m-%d", "%B %dth")
+    start = time.mktime((2025, 9, 1, 0, 0, 0, 0, 0, -1))
+    out = []
+    for i in range(n):
+        t = time.localtime(start + 86400 * rng.randrange(0, 365))
+        out.append(time.strftime(rng.choice(fmts), t))
+    out += ["Daily", "Ongoing", "September 1 through November 30, 2025"]
+    return out
+
+
+def make_synthetic_csv(path: Path, rows: int, seed: int = 7) -> Path:
+    rng = random.Random(seed)
+    with open(SOURCE_CSV, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        base = [r for r in reader if (r.get(import_csv.COLS["title"]) or "").strip()]
+    dates = _date_pool(300, rng)
+    times = ["9:00 AM", "1:00 PM", "7pm", "18:30", "noon", "TBD", ""]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=fieldnames)
+        w.writeheader()
+        for i in range(rows):
+            r = dict(base[i % len(base)])
+            r[import_csv.COLS["title"]] = f"{r[import_csv.COLS['title']]} #{i}"
+            r[import_csv.COLS["date"]] = rng.choice(dates)
+            r[import_csv.COLS["start_time"]] = rng.choice(times)
+            r[import_csv.COLS["end_time"]] = rng.choice(times)
+            w.writerow(r)
+    return path
+
+
+def _run(path: Path, workers: int, chunk_size: int) -> int:
+    parsed = 0
+    chunks = import_csv._chunked(import_csv._iter_rows(path), chunk_size)
+    for records, _skipped, _problems in import_csv._parse_chunks(chunks, workers):
+        parsed += len(records)
+    return parsed
+
+
+def _timed(label: str, fn, rows: int):
+    t0 = time.perf_counter()
+    parsed = fn()
+    dt = time.perf_counter() - t0
+    print(f"{label:<32} {dt:8.2f}s  {rows / dt:12,.0f} rows/s  ({parsed:,} parsed)")
+    return dt
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunk-size", type=int, default=import_csv.DEFAULT_CHUNK_SIZE)
+    ap.add_argument("--csv", help="where to write the synthetic CSV (default: temp file)")
+    args = ap.parse_args(argv)
+
+    path = Path(args.csv) if args.csv else Path(tempfile.mkstemp(suffix=".csv")[1])
+    print(f"Generating {args.rows:,} rows -> {path}")
+    make_synthetic_csv(path, args.rows)
+
+    try:
+        # Baseline: no memoization (what the importer did before)
+        cached_date, cached_time = import_csv._parse_date_loose, import_csv._parse_time_loose
+        import_csv._parse_date_loose = cached_date.__wrapped__
+        import_csv._parse_time_loose = cached_time.__wrapped__
+        try:
+            base = _timed("serial, no memoization", lambda: _run(path, 1, args.chunk_size), args.rows)
+        finally:
+            import_csv._parse_date_loose, import_csv._parse_time_loose = cached_date, cached_time
+
+        memo = _timed("serial, memoized", lambda: _run(path, 1, args.chunk_size), args.rows)
+        par = _timed(f"process pool x{args.workers}, memoized",
+                     lambda: _run(path, args.workers, args.chunk_size), args.rows)
+        print(f"speedup: memoized {base / memo:.2f}x, parallel {base / par:.2f}x")
+    finally:
+        if not args.csv:
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
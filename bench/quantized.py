@@ -0,0 +1,88 @@
+# bench/quantized.py
+# What the int8 vector store (backend/vector_store.py) costs in accuracy and
+# buys in memory/latency, against exact float32 cosine over the same vectors:
+# recall@k of the brute-force top-k, score error, bytes per vector, and the
+# latency of a full scan and of reranking k * factor candidates.
+# Usage: python -m bench.quantized [--events 20000] [--dim 768] [--k 10] [--queries 200] [--mmap]
+
+import argparse, json, os, time
+
+import numpy as np
+
+from bench.common import use_scratch_backend, print_table, summarize
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the int8 vector store against float32.")
+    ap.add_argument("--events", type=int, default=20000)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--rerank", type=int, default=40, help="candidates per rerank call")
+    ap.add_argument("--mmap", action="store_true", help="VECTOR_STORE_MMAP=1")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir")
+    args = ap.parse_args(argv)
+
+    os.environ["VECTOR_STORE_MMAP"] = "1" if args.mmap else "0"
+    use_scratch_backend(args.workdir)
+    from bench import synthetic
+    from db.database import SessionLocal
+    from db.models import EventEmbedding
+    import vector_store
+
+    model = "bench-q8"
+    key = (model, "RETRIEVAL_DOCUMENT", args.dim)
+    print(f"Seeding {args.events} events (dim {args.dim}) ...")
+    synthetic.grow_corpus(args.events, 0, args.dim, model)
+
+    with SessionLocal() as db:
+        rows = (db.query(EventEmbedding.event_id, EventEmbedding.vector)
+                .filter(EventEmbedding.model_name == model, EventEmbedding.dim == args.dim).all())
+    ids = np.array([r.event_id for r in rows], dtype=np.int64)
+    full = np.array([json.loads(r.vector) for r in rows], dtype=np.float32)
+    full /= np.linalg.norm(full, axis=1, keepdims=True)
+
+    t0 = time.perf_counter()
+    store = vector_store.get(key)
+    build_s = time.perf_counter() - t0
+
+    rng = np.random.default_rng(args.seed)
+    base = full[rng.integers(0, len(full), args.queries)]
+    queries = base + rng.standard_normal(base.shape).astype(np.float32) * 0.05  # near, not on, a vector
+
+    pos = {e: i for i, e in enumerate(ids.tolist())}
+    hits, err = 0, []
+    lat = {"float32 scan": [], "int8 scan": [], "float32 rerank": [], "int8 rerank": []}
+    for q in queries:
+        qn = q / np.linalg.norm(q)
+        t0 = time.perf_counter()
+        sims = full @ qn
+        exact = np.argpartition(-sims, args.k - 1)[:args.k]
+        lat["float32 scan"].append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        got, got_sims = store.top_k(q, args.k)
+        lat["int8 scan"].append(time.perf_counter() - t0)
+        hits += len(set(ids[exact].tolist()) & set(got.tolist()))
+
+        cand = rng.choice(len(ids), args.rerank, replace=False)
+        t0 = time.perf_counter()
+        _ = full[cand] @ qn
+        lat["float32 rerank"].append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        found, q8 = store.score(q, ids[cand].tolist())
+        lat["int8 rerank"].append(time.perf_counter() - t0)
+        err.extend(np.abs(q8 - sims[[pos[e] for e in found]]).tolist())
+
+    st = vector_store.stats()[0]
+    print(f"\nint8 store: built in {build_s:.2f}s, {st['memory_bytes'] / 1e6:.1f} MB resident "
+          f"(float32 would be {st['float32_bytes'] / 1e6:.1f} MB){' + mmap codes' if args.mmap else ''}")
+    print(f"recall@{args.k} vs float32 exact: {hits / (args.queries * args.k):.4f}   "
+          f"|cosine error| mean {np.mean(err):.5f} max {np.max(err):.5f}\n")
+    rows = [{"path": name, **summarize(v, sum(v))} for name, v in lat.items()]
+    print_table(rows, ["path", "n", "p50_ms", "p95_ms", "p99_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# bench/sharded.py
+# One index vs the same vectors split across S shards (ANN_SHARDS / "shards"
+# tuning): full rebuild time, single-query latency (the per-shard queries run on
+# the fan-out pool), recall@k against exact cosine, the time to rebuild one
+# shard, and search latency while that rebuild runs. The fan-out only pays off
+# with spare cores; on a single core expect higher latency per query.
+# Usage: python -m bench.sharded [--n 200000] [--dim 128] [--shards 1,2,4,8] [--queries 200]
+
+import argparse, os, threading, time
+
+import numpy as np
+
+from bench.common import use_scratch_backend, print_table, summarize
+from bench.ann_backends import clustered
+
+
+def _search(ann_index, key, dim, queries, truth, k):
+    lat, hits = [], 0
+    for q, want in zip(queries, truth):
+        t0 = time.perf_counter()
+        res = ann_index.search(key, dim, q, k)
+        lat.append(time.perf_counter() - t0)
+        hits += len(want & {lab for lab, _ in res})
+    return lat, hits
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compare sharded and unsharded ANN indexes.")
+    ap.add_argument("--n", type=int, default=200000)
+    ap.add_argument("--dim", type=int, default=128)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--shards", default="1,2,4,8")
+    ap.add_argument("--backend", default="hnsw")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir")
+    args = ap.parse_args(argv)
+
+    use_scratch_backend(args.workdir)
+    import ann_index
+
+    rng = np.random.default_rng(args.seed)
+    print(f"Generating {args.n} x {args.dim} clustered vectors ({os.cpu_count()} cores) ...")
+    data = clustered(args.n, args.dim, rng)
+    items = list(zip(range(1, args.n + 1), data))
+    queries = data[rng.integers(0, args.n, args.queries)] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    truth = [set((np.argsort(-(data @ q))[:args.k] + 1).tolist()) for q in queries]
+
+    rows = []
+    for s in [int(x) for x in args.shards.split(",")]:
+        key = (f"bench-shards{s}", "RETRIEVAL_DOCUMENT", args.dim)
+        ann_index.save_tuning(key, {"backend": args.backend, "shards": s})
+        t0 = time.perf_counter()
+        ann_index.rebuild(key, args.dim, items)
+        build_s = time.perf_counter() - t0
+        lat, hits = _search(ann_index, key, args.dim, queries, truth, args.k)
+
+        # Rebuild shard 0 (the whole index when unsharded) while searching
+        during = []
+        t0 = time.perf_counter()
+        th = threading.Thread(target=ann_index.rebuild, args=(key, args.dim, items),
+                              kwargs={"shards": [0]} if s > 1 else {})
+        th.start()
+        while th.is_alive():
+            during.extend(_search(ann_index, key, args.dim, queries[:20], truth[:20], args.k)[0])
+        th.join()
+        one_shard_s = time.perf_counter() - t0
+
+        rows.append({
+            "shards": s,
+            "build_s": build_s,
+            f"recall@{args.k}": round(hits / (len(queries) * args.k), 4),
+            **{k: v for k, v in summarize(lat, sum(lat)).items() if k in ("p50_ms", "p95_ms")},
+            "rebuild_1_s": one_shard_s,
+            "p95_during_ms": summarize(during, sum(during))["p95_ms"] if during else None,
+        })
+        ann_index.drop(key)
+
+    print(f"\n{args.n} vectors, dim {args.dim}, backend {args.backend}, {args.queries} queries, k={args.k}:")
+    print_table(rows, ["shards", "build_s", f"recall@{args.k}", "p50_ms", "p95_ms", "rebuild_1_s", "p95_during_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench/startup.py
+# Cold-start cost of the API: each run is a fresh interpreter that imports
+# main, enters the lifespan (TestClient) and polls /api/health and /api/ready.
+# Compares STARTUP_BACKFILL=sync with background, with every event needing an
+# embedding ("cold") and with nothing to backfill ("warm").
+# Usage: python -m bench.startup [--events 5000] [--repeat 3] [--latency-ms 0]
+
+import argparse, json, os, shutil, statistics, subprocess, sys, time
+
+from bench.common import BACKEND_DIR, use_scratch_backend, print_table
+
+_CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {backend!r})
+import main
+t_import = time.perf_counter() - t0
+from fastapi.testclient import TestClient
+t1 = time.perf_counter()
+with TestClient(main.app) as c:
+    t_serving = time.perf_counter() - t1
+    assert c.get("/api/health").status_code == 200
+    t_health = time.perf_counter() - t1
+    deadline = time.monotonic() + 600
+    while c.get("/api/ready").status_code != 200:
+        if time.monotonic() > deadline:
+            raise SystemExit("not ready after 600s")
+        time.sleep(0.005)
+    t_ready = time.perf_counter() - t1
+print(json.dumps(dict(import_s=t_import, serving_s=t_import + t_serving,
+                      health_s=t_import + t_health, ready_s=t_import + t_ready)))
+"""
+
+
+def _run_child(env) -> dict:
+    t0 = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD.format(backend=str(BACKEND_DIR))],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    res["process_s"] = time.perf_counter() - t0
+    return res
+
+
+def _wipe_event_embeddings(work):
+    from db.database import SessionLocal
+    from db.models import EventEmbedding
+    with SessionLocal() as db:
+        db.query(EventEmbedding).delete()
+        db.commit()
+    shutil.rmtree(os.path.join(work, "ann_store"), ignore_errors=True)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark API cold start and readiness.")
+    ap.add_argument("--events", type=int, default=5000)
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="artificial latency per embedding call")
+    ap.add_argument("--workdir")
+    args = ap.parse_args(argv)
+
+    os.environ["EMBED_PROVIDER"] = "local"
+    os.environ["EMBED_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["ANN_HEALTH_INTERVAL_SECONDS"] = "0"
+    work = use_scratch_backend(args.workdir)
+    from bench import synthetic
+    from embeddings import EMBED_MODEL, OUTPUT_DIM
+
+    print(f"Seeding {args.events} events / {args.users} users ...")
+    synthetic.grow_corpus(args.events, args.users, OUTPUT_DIM, EMBED_MODEL)
+
+    rows = []
+    for mode in ("sync", "background"):
+        for state in ("cold", "warm"):
+            runs = []
+            for _ in range(args.repeat):
+                if state == "cold":
+                    _wipe_event_embeddings(work)
+                runs.append(_run_child({**os.environ, "STARTUP_BACKFILL": mode}))
+            row = {"backfill": mode, "state": state}
+            for k in ("import_s", "serving_s", "health_s", "ready_s", "process_s"):
+                row[k] = statistics.median(r[k] for r in runs)
+            rows.append(row)
+            print(f"  {mode}/{state}: ready in {row['ready_s']:.2f}s")
+
+    print(f"\nMedian of {args.repeat} fresh processes, seconds since `import main` began "
+          f"(process_s is wall time incl. interpreter start):")
+    print_table(rows, ["backfill", "state", "import_s", "serving_s", "health_s", "ready_s", "process_s"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# bench/synthetic.py
+# Synthetic events/users with realistic fields and random unit vectors,
+# written through the real models, plus the matching ann_index stores.
+# Import bench.common.use_scratch_backend() first so this targets a scratch DB.
+import json, random
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+import numpy as np
+from sqlalchemy import insert, func
+
+import ann_index
+from db.database import SessionLocal, ensure_schema
+from db.models import Event, EventEmbedding, User, UserQueryEmbedding
+from indexing import event_doc_text, text_hash
+
+TASK_DOC, TASK_QUERY = "RETRIEVAL_DOCUMENT", "RETRIEVAL_QUERY"
+
+_WORDS = (
+    "hack night ai meetup crab feast karaoke dance volunteer cleanup dog shelter "
+    "career fair resume workshop coding jam improv film art craft club run 5k "
+    "book swap climate talk startup pitch mentoring robotics music open mic"
+).split()
+_TAGS = ["ai", "music", "volunteering", "social", "career", "tech", "outdoors", "arts",
+         "food", "health", "education", "climate", "sports", "networking"]
+_ORGS = ["henhacks", "hophacks", "cssg", "baltimore animal services", "high hopes for haiti",
+         "collage craft club", "elevated home", "litterzilla", "playlist set"]
+_CITIES = [("Newark, DE", 39.68, -75.75), ("Baltimore, MD", 39.29, -76.61),
+           ("Philadelphia, PA", 39.95, -75.17), ("Wilmington, DE", 39.74, -75.55),
+           ("Washington, DC", 38.90, -77.04)]
+_ROLES = ["high school", "college", "grad school", "working", "career change"]
+_DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def unit_vectors(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    v = rng.standard_normal((n, dim)).astype(np.float32)
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    return v
+
+
+def _event_row(i: int, rnd: random.Random) -> dict:
+    city, lat, lon = rnd.choice(_CITIES)
+    start = datetime(2025, 9, 1, 9) + timedelta(days=rnd.randrange(365), hours=rnd.randrange(12))
+    tags = rnd.sample(_TAGS, rnd.randint(1, 4))
+    if rnd.random() < 0.3:
+        tags.append("volunteering")
+    return dict(
+        title=" ".join(rnd.sample(_WORDS, rnd.randint(2, 5))).title() + f" #{i}",
+        description=" ".join(rnd.choices(_WORDS, k=rnd.randint(10, 40))),
+        src_url=f"https://example.org/events/{i}",
+        starts_at=start.isoformat(),
+        ends_at=(start + timedelta(hours=rnd.randint(1, 4))).isoformat(),
+        venue=f"{rnd.choice(_WORDS).title()} Hall",
+        location=city,
+        latitude=lat + rnd.uniform(-0.1, 0.1),
+        longitude=lon + rnd.uniform(-0.1, 0.1),
+        tags=",".join(dict.fromkeys(tags)),
+        organizers=rnd.choice(_ORGS),
+        price_amount=rnd.choice([None, 0.0, 5.0, 20.0]),
+        price_currency="USD",
+        people_cap=None,  # keep RSVP benchmarks from hitting "Event is full"
+        source="cache",
+        evidence_urls=[],
+        dedupe_id=f"synthetic-{i}",
+    )
+
+
+def _user_row(i: int, rnd: random.Random, password_hash: str) -> dict:
+    return dict(
+        username=f"bench_user_{i}",
+        password_hash=password_hash,
+        name=f"Bench User {i}",
+        age=rnd.randint(15, 40),
+        school_or_career_type=rnd.choice(_ROLES),
+        interests=",".join(rnd.sample(_TAGS, 3)),
+        causes_interested=",".join(rnd.sample(_TAGS, 2)),
+        wake_time="07:00",
+        sleep_time="23:00",
+        preferred_days=",".join(rnd.sample(_DAYS, 3)),
+        location=rnd.choice(_CITIES)[0],
+    )
+
+
+def grow_corpus(n_events: int, n_users: int, dim: int, model_name: str,
+                seed: int = 42, batch: int = 1000) -> Tuple[int, int]:
+    """
+    Add synthetic events/users (with embeddings) until the DB holds at least
+    n_events / n_users, then rebuild the ANN index for (model_name, DOC, dim).
+    Returns the (events, users) totals.
+    """
+    ensure_schema()
+    rnd = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    from passlib.hash import bcrypt
+    pw_hash = bcrypt.using(rounds=4).hash("bench")  # users share one cheap hash
+    now = datetime.utcnow()
+
+    with SessionLocal() as db:
+        have_e = db.query(func.count(Event.id)).scalar()
+        have_u = db.query(func.count(User.id)).scalar()
+
+        for start in range(have_e, n_events, batch):
+            stop = min(n_events, start + batch)
+            rnd_e = random.Random(seed * 1_000_003 + start)
+            rows = [_event_row(i, rnd_e) for i in range(start, stop)]
+            db.execute(insert(Event), rows)
+            ids = [eid for (eid,) in db.query(Event.id).filter(
+                Event.dedupe_id.in_([r["dedupe_id"] for r in rows]))]
+            evs = db.query(Event.id, Event.title, Event.tags, Event.organizers, Event.starts_at,
+                           Event.location, Event.description).filter(Event.id.in_(ids)).all()
+            vecs = unit_vectors(len(evs), dim, rng)
+            db.execute(insert(EventEmbedding), [
+                dict(event_id=ev.id, vector=json.dumps(v.tolist()), dim=dim, model_name=model_name,
+                     task_type=TASK_DOC, content_hash=text_hash(event_doc_text(ev)),
+                     created_at=now, updated_at=now)
+                for ev, v in zip(evs, vecs)
+            ])
+            db.commit()
+
+        for start in range(have_u, n_users, batch):
+            stop = min(n_users, start + batch)
+            db.execute(insert(User), [_user_row(i, rnd, pw_hash) for i in range(start, stop)])
+            ids = [uid for (uid,) in db.query(User.id).filter(
+                User.username.in_([f"bench_user_{i}" for i in range(start, stop)]))]
+            vecs = unit_vectors(len(ids), dim, rng)
+            db.execute(insert(UserQueryEmbedding), [
+                dict(user_id=uid, vector=json.dumps(v.tolist()), dim=dim, model_name=model_name,
+                     task_type=TASK_QUERY, created_at=now, updated_at=now)
+                for uid, v in zip(ids, vecs)
+            ])
+            db.commit()
+
+        items = [(eid, json.loads(vec)) for eid, vec in
+                 db.query(EventEmbedding.event_id, EventEmbedding.vector)
+                   .filter(EventEmbedding.model_name == model_name, EventEmbedding.dim == dim)]
+        ann_index.rebuild(key=(model_name, TASK_DOC, dim), dim=dim, all_items=items)
+        total_e = db.query(func.count(Event.id)).scalar()
+        total_u = db.query(func.count(User.id)).scalar()
+    return total_e, total_u
+
+
+def user_ids_and_names() -> List[Tuple[int, str]]:
+    with SessionLocal() as db:
+        return [(u.id, u.username) for u in db.query(User.id, User.username)]
+
+
+def event_ids() -> List[int]:
+    with SessionLocal() as db:
+        return [eid for (eid,) in db.query(Event.id)]
@@ -12,6 +12,8 @@ import FriendsCard from "./components/FriendsCard";
 import CareersCard from "./components/CareersCard";
 import LocationQuiz from "./components/LocationQuiz";
 
+import { saveProfile } from "./api";
+
 import "./components/TextSwiper.css";
 import "./app.css";
 
@@ -20,6 +22,13 @@ export default function App() {
   const [view, setView] = useState("login");
   const cardSize = { width: 360, height: 560 };
 
+  // Quiz screens call this with their profile fields ({ quiz }, { personality }, ...).
+  // Each screen is one PATCH /api/profile, so nothing is lost if the app closes midway.
+  const quizDone = (next) => async (fields) => {
+    await saveProfile(fields);
+    setView(next);
+  };
+
   // If you want to auto-skip login when a token exists, uncomment:
   // useEffect(() => {
   //   if (localStorage.getItem("token")) setView("home");
@@ -71,7 +80,7 @@ export default function App() {
       {view === "introQuiz" && (
         <IntroQuiz
           {...cardSize}
-          onDone={() => setView("home")} // after intro survey, go to home
+          onDone={quizDone("home")} // after intro survey, go to home
         />
       )}
 
@@ -79,7 +88,7 @@ export default function App() {
       {view === "personality" && (
         <PersonalityQuiz
           {...cardSize}
-          onDone={() => setView("additional")} // after submit, back to Additional Info
+          onDone={quizDone("additional")} // after submit, back to Additional Info
         />
       )}
 
@@ -87,21 +96,13 @@ export default function App() {
       {view === "interests/causes" && (
         <InterestsCausesQuiz
           {...cardSize}
-          onDone={(answers) => {
-            console.log("Interests/Causes saved:", answers);
-            // e.g., api.saveQuiz("interests_causes", answers);
-            setView("additional"); // back to Additional Info page
-          }}
+          onDone={quizDone("additional")} // back to Additional Info page
         />
       )}
       {view === "location" && (
         <LocationQuiz
           {...cardSize}
-          onDone={(answers) => {
-            console.log("Location saved:", answers);
-            // e.g., api.saveQuiz("location", answers);
-            setView("additional"); // back to Additional Info page
-          }}
+          onDone={quizDone("additional")} // back to Additional Info page
         />
       )}
 
@@ -41,4 +41,20 @@ export async function apiAuthPost(path, body) {
   try { data = await r.json(); } catch {}
   if (!r.ok) throw new Error((data && (data.detail || data.message)) || `HTTP ${r.status}`);
   return data ?? {};
-}
\ No newline at end of file
+}
+
+export async function apiAuthPatch(path, body) {
+  const r = await fetch(path, {
+    method: "PATCH",
+    headers: authHeaders(),
+    body: JSON.stringify(body ?? {}),
+  });
+  let data = null;
+  try { data = await r.json(); } catch {}
+  if (!r.ok) throw new Error((data && (data.detail || data.message)) || `HTTP ${r.status}`);
+  return data ?? {};
+}
+
+// Onboarding/profile writes: any subset of { quiz, personality, interests, causes, location }
+// in one request, one transaction and one re-embed on the server.
+export const saveProfile = (fields) => apiAuthPatch("/api/profile", fields);
\ No newline at end of file
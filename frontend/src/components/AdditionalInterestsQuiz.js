@@ -2,13 +2,12 @@ import React, { useMemo, useRef, useState } from "react";
 import QuizPage from "./QuizPage";              // your shared renderer
 import "./quiz.css";
 import "./TextSwiper.css";
-import { apiAuthPost } from "../api";
 
 /**
  * AdditionalInterestsQuiz (Swiper)
  * - Two pages, both require EXACTLY 3 picks to advance.
  * - Fields are declared as dropdown multi-selects; selected items show as chips.
- * - onDone() is the ONLY navigation (parent should route back to Additional Info).
+ * - onDone({ interests, causes }) is the ONLY navigation; the parent saves the profile.
  * - Optional `log(sectionKey, payload)` preserves your logging.
  */
 export default function AdditionalInterestsQuiz({
@@ -155,15 +154,11 @@ export default function AdditionalInterestsQuiz({
 
   setSubmitting(true);
   try {
-    // NEW: persist to backend for the logged-in user
-    await apiAuthPost("/api/profile/interests", { selected: interests });
-    await apiAuthPost("/api/profile/causes",    { selected: causes });
-
     // Original logging behavior
     await logSection("interests", { selected: interests });
     await logSection("causes", { selected: causes });
 
-    onDone?.(); // parent handles navigation back to Additional Info
+    await onDone?.({ interests, causes }); // parent saves and navigates
   } catch (e) {
     console.error("Failed to save Additional Interests/Causes:", e);
     alert(e.message || "Failed to save your answers");
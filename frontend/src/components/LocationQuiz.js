@@ -3,13 +3,12 @@ import React, { useMemo, useRef, useState } from "react";
 import QuizPage from "./QuizPage";          // same renderer you already use
 import "./quiz.css";
 import "./TextSwiper.css";
-import { apiAuthPost } from "../api";       // ⬅️ added
 
 export default function LocationQuiz({
   width = 360,
   height = 560,
   durationMs = 320,
-  onDone,              // parent should route back to Additional Info
+  onDone,              // callback({ location }); the parent saves and navigates
   log                  // optional: async (sectionKey, payload) => Promise<void>
 }) {
   // One-page quiz definition
@@ -78,9 +77,6 @@ export default function LocationQuiz({
 
     setSubmitting(true);
     try {
-      // NEW: persist to backend for the logged-in user
-      await apiAuthPost("/api/profile/location", { location });
-
       // Original logging behavior
       if (typeof log === "function") {
         await log("location", { location });
@@ -90,7 +86,7 @@ export default function LocationQuiz({
         console.log("[Quiz Log] location:", location);
       }
 
-      onDone?.({ location });  // parent navigates back to Additional Information
+      await onDone?.({ location });  // parent saves and navigates
     } catch (e) {
       console.error("Failed to save location:", e);
       alert(e.message || "Failed to save your location");
@@ -3,13 +3,12 @@ import personalityPages from "../personalityPages";
 import QuizPage from "./QuizPage";        // same renderer you already have
 import "./quiz.css";                      // same styles as the original survey
 import "./TextSwiper.css";                // .stage, .box, .content, animations
-import { apiAuthPost } from "../api";
 
 export default function PersonalityQuiz({
   width = 360,
   height = 560,
   durationMs = 320,
-  onDone // callback(answers) -> navigate back to Additional Info
+  onDone // callback({ personality }) -> the parent saves and navigates
 }) {
   const [index, setIndex] = useState(0);
   const [phase, setPhase] = useState("idle");
@@ -69,10 +68,7 @@ export default function PersonalityQuiz({
 
     setSubmitting(true);
     try {
-      await apiAuthPost("/api/profile/personality", { selected });
-      // optional: also persist raw answers if you later add a dedicated field
-      // await apiAuthPost("/api/profile/personality-raw", answers);
-      onDone?.(answers);
+      await onDone?.({ personality: selected });
     } catch (e) {
       console.error("Failed to save personality:", e);
       alert(e.message || "Failed to save personality");
@@ -3,13 +3,12 @@ import quizPages from "../quizPages";
 import QuizPage from "./QuizPage";
 import "./quiz.css";
 import "./TextSwiper.css"; // reuse your swiper animations (box, stage, etc.)
-import { apiAuthPost } from "../api";
 
 export default function QuizSwiper({
   width = 360,
   height = 560,
   durationMs = 320,
-  onDone // optional callback(answers)
+  onDone // callback({ quiz }) -> the parent saves the profile
 }) {
   const [index, setIndex] = useState(0);
   const [phase, setPhase] = useState("idle"); // idle | exit | enter
@@ -60,13 +59,12 @@ export default function QuizSwiper({
 
   const submit = async () => {
     try {
-      // Map all answers for this multi-page quiz to backend
-      await apiAuthPost("/api/profile/quiz", answers);
+      // Map all answers for this multi-page quiz to the profile's quiz field
+      if (onDone) await onDone({ quiz: answers });
     } catch (e) {
       console.error(e);
       alert("Failed to save quiz answers");
     }
-    if (onDone) onDone(answers);
   };
 
   // wire up style vars
@@ -1,22 +1,22 @@
 # scripts/import_events_from_csv.py
-# One-off CSV → DB importer for Events.
-# Usage: python scripts/import_events_from_csv.py [path/to/events.csv]
+# CSV → DB importer for Events. Idempotent: rows are keyed by dedupe_id and
+# upserted in chunks, so re-running on the same file is close to a no-op.
+# Usage: python scripts/import_events_from_csv.py [path/to/events.csv] [--chunk-size N] [--workers N] [--embed]
 
-import os, sys, csv, re
+import os, sys, csv, re, hashlib, argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, date, time
+from functools import lru_cache
 from zoneinfo import ZoneInfo
-from typing import Optional
+from typing import Optional, Iterable, Iterator, List, Dict, Tuple
 from pathlib import Path
 
 # ------------------------------------------------------
 # Project paths & CSV defaults
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 DEFAULT_CSV = PROJECT_ROOT / "external_data" / "events.csv"
-
-# Allow override via CLI: python scripts/import_events_from_csv.py path/to/file.csv
-CSV_PATH = Path(sys.argv[1]).resolve() if len(sys.argv) > 1 else DEFAULT_CSV
-if not CSV_PATH.exists():
-    raise FileNotFoundError(f"CSV not found: {CSV_PATH}")
+DEFAULT_CHUNK_SIZE = 500
 
 # Timezone for combining date+time
 TZ = ZoneInfo("America/New_York")
@@ -44,13 +44,41 @@ COLS = {
 # Import app DB (scripts/ is sibling to backend/)
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend"))
 sys.path.append(ROOT)
+# The server runs from backend/, so its ANN store lives at backend/.ann_store
+os.environ.setdefault("ANN_STORE_DIR", os.path.join(ROOT, ".ann_store"))
 
-from db.database import SessionLocal, engine
+from sqlalchemy import select
+from db.database import SessionLocal, engine, ensure_schema
 from db.models import Event, Base  # Event has: src_url, starts_at/ends_at (ISO strings), evidence_urls (JSON/list)
 
+if engine.dialect.name == "postgresql":
+    from sqlalchemy.dialects.postgresql import insert as _dialect_insert
+else:
+    from sqlalchemy.dialects.sqlite import insert as _dialect_insert
+
+# Event columns written by the importer (besides dedupe_id / timestamps)
+UPSERT_FIELDS = (
+    "title", "description", "src_url", "starts_at", "ends_at", "venue", "location",
+    "latitude", "longitude", "tags", "organizers", "price_amount", "price_currency",
+    "people_cap", "source", "evidence_urls",
+)
+
+RECURRING_WORDS = {"daily", "weekly", "ongoing", "various", "multiple dates"}
+
+# Precompiled patterns for the loose date/time parsers
+_RE_DATE_WITH_TIME = re.compile(r"^\d{4}-\d{2}-\d{2}\s+\d")
+_RE_ORDINAL = re.compile(r"(\d+)(st|nd|rd|th)\b", re.IGNORECASE)
+_RE_DATE_RANGE = re.compile(
+    r"^\s*([A-Za-z]+\.?\s+\d{1,2})(?:,?\s*(\d{4}))?\s+(?:to|through|-)\s+([A-Za-z]+\.?\s+\d{1,2})(?:,?\s*(\d{4}))?\s*$",
+    re.IGNORECASE,
+)
+_RE_MONTH_DAY = re.compile(r"^\s*([A-Za-z]+)\.?\s+(\d{1,2})\s*$")
+_RE_AMPM_SUFFIX = re.compile(r"(\d)(am|pm)$")
+
 # ------------------------------------------------------
 # Helpers
 
+@lru_cache(maxsize=4096)  # feeds repeat the same few hundred date strings
 def _parse_date_loose(s: str) -> Optional[date]:
     """
     Robust date parser for messy CSVs.
@@ -69,18 +97,14 @@ def _parse_date_loose(s: str) -> Optional[date]:
         return None
 
     # If includes time like "2025-09-20 19:00", take date portion
-    if re.match(r"^\d{4}-\d{2}-\d{2}\s+\d", s):
+    if _RE_DATE_WITH_TIME.match(s):
         s = s.split(" ")[0]
 
     # Remove ordinal suffixes (1st, 2nd, 3rd, 4th)
-    s_norm = re.sub(r"(\d+)(st|nd|rd|th)\b", r"\1", s, flags=re.IGNORECASE)
+    s_norm = _RE_ORDINAL.sub(r"\1", s)
 
     # Ranges: "September 1 through November 30[, 2025]" or "Sep 1 to Nov 30, 2025"
-    m = re.search(
-        r"^\s*([A-Za-z]+\.?\s+\d{1,2})(?:,?\s*(\d{4}))?\s+(?:to|through|-)\s+([A-Za-z]+\.?\s+\d{1,2})(?:,?\s*(\d{4}))?\s*$",
-        s_norm,
-        re.IGNORECASE,
-    )
+    m = _RE_DATE_RANGE.search(s_norm)
     if m:
         start_str, start_year, end_str, end_year = m.groups()
         # Prefer explicit year if present (start or end)
@@ -101,11 +125,11 @@ def _parse_date_loose(s: str) -> Optional[date]:
         return None
 
     # Keywords → treat as recurring; choose policy: set to "today"
-    if s_norm.lower() in {"daily", "weekly", "ongoing", "various", "multiple dates"}:
+    if s_norm.lower() in RECURRING_WORDS:
         return datetime.now(TZ).date()
 
     # "Month Day" (no year) → assume this year (or next if already passed)
-    m2 = re.match(r"^\s*([A-Za-z]+)\.?\s+(\d{1,2})\s*$", s_norm)
+    m2 = _RE_MONTH_DAY.match(s_norm)
     if m2:
         mon, day = m2.groups()
         yr = datetime.now(TZ).year
@@ -139,6 +163,7 @@ def _parse_date_loose(s: str) -> Optional[date]:
     return None
 
 
+@lru_cache(maxsize=1024)
 def _parse_time_loose(s: str) -> Optional[time]:
     s = (s or "").strip().lower()
     if not s or s in {"tbd", "n/a", "na"}:
@@ -148,7 +173,7 @@ def _parse_time_loose(s: str) -> Optional[time]:
     if s in {"midnight", "12 midnight"}:
         return time(0, 0)
     # Normalize "7pm" → "7 pm"
-    s = re.sub(r"(\d)(am|pm)$", r"\1 \2", s)
+    s = _RE_AMPM_SUFFIX.sub(r"\1 \2", s)
     for fmt in ("%H:%M", "%H:%M:%S", "%I:%M %p", "%I %p"):
         try:
             return datetime.strptime(s.upper(), fmt).time()
@@ -202,67 +227,240 @@ def _combine_iso(d: date, t: Optional[time]) -> Optional[str]:
         return None
     return datetime(d.year, d.month, d.day, t.hour, t.minute, tzinfo=TZ).isoformat()
 
-# ------------------------------------------------------
-# Main
+def _norm_key_part(s: Optional[str]) -> str:
+    return " ".join((s or "").lower().split())
+
+
+def _dedupe_id(title: str, date_key: str, host: Optional[str]) -> str:
+    """Stable id from normalized (title, date, organizer/venue)."""
+    raw = "|".join(_norm_key_part(x) for x in (title, date_key, host))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _row_to_record(idx: int, row: Dict[str, str]) -> Tuple[Optional[dict], Optional[tuple]]:
+    """CSV row -> (Event column dict, None) or (None, (row, title, problem))."""
+    title = (row.get(COLS["title"]) or "").strip()
+    if not title:
+        return None, (idx, "(no title)", "missing title")
+
+    raw_date = (row.get(COLS["date"]) or "").strip()
+    d = _parse_date_loose(raw_date)
+    if not d:
+        return None, (idx, title[:60], f"bad date: {raw_date!r}")
+
+    t_start = _parse_time_loose(row.get(COLS["start_time"], ""))
+    t_end   = _parse_time_loose(row.get(COLS["end_time"], ""))
+
+    # Merge Tags + Category, then possibly add 'recurring'
+    tags_from_csv = row.get(COLS["tags"])
+    category_from_csv = row.get(COLS["category"])
+    tags = _merge_tags(tags_from_csv, category_from_csv)
+
+    recurring = raw_date.lower() in RECURRING_WORDS
+    if recurring:
+        tags = _merge_tags(tags, "recurring")
+
+    organizers = _csv_to_str(row.get(COLS["company"]))  # company → organizers
+    venue = (row.get(COLS["venue"]) or "").strip() or None
+    location = (row.get(COLS["location"]) or "").strip() or "TBD"
+
+    # Recurring rows resolve to "today"; key them on the keyword so they stay stable
+    date_key = raw_date.lower() if recurring else d.isoformat()
+
+    rec = dict(
+        dedupe_id=_dedupe_id(title, date_key, organizers or venue or location),
+        title=title,
+        description=(row.get(COLS["description"]) or "").strip() or None,
+        src_url=(row.get(COLS["src_url"]) or "").strip() or None,
+        starts_at=_combine_iso(d, t_start) or _combine_iso(d, time(0, 0)),
+        ends_at=_combine_iso(d, t_end),
+        venue=venue,
+        location=location,
+        latitude=_to_float(row.get(COLS["latitude"])),
+        longitude=_to_float(row.get(COLS["longitude"])),
+        tags=tags,
+        organizers=organizers,
+        price_amount=_to_float(row.get(COLS["price_amount"])),
+        price_currency=(row.get(COLS["price_currency"]) or "").strip() or "USD",  # model default
+        people_cap=_to_int(row.get(COLS["people_cap"])),
+        source="cache",   # keep within allowed enum for API responses
+        evidence_urls=[], # keep as empty list unless you have sources
+    )
+    return rec, None
 
-def main():
-    db = SessionLocal()
-    inserted = 0
+
+def _iter_rows(path: Path) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Stream (row number, row) pairs; header is row 1."""
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        for idx, row in enumerate(csv.DictReader(f), start=2):
+            yield idx, row
+
+
+def _chunked(it: Iterable, size: int) -> Iterator[list]:
+    buf = []
+    for x in it:
+        buf.append(x)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def _parse_chunk(chunk: List[Tuple[int, Dict[str, str]]]) -> Tuple[List[dict], int, List[tuple]]:
+    """Parse one chunk of rows -> (records, skipped count, first problems). Runs in worker processes."""
+    records, problems = [], []
     skipped = 0
-    problems = []
+    for idx, row in chunk:
+        rec, problem = _row_to_record(idx, row)
+        if problem:
+            skipped += 1
+            if len(problems) < 15:
+                problems.append(problem)
+            continue
+        records.append(rec)
+    return records, skipped, problems
 
-    with open(CSV_PATH, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for idx, row in enumerate(reader, start=2):  # header is row 1
-            title = (row.get(COLS["title"]) or "").strip()
-            if not title:
-                skipped += 1
-                problems.append((idx, "(no title)", "missing title"))
-                continue
 
-            raw_date = (row.get(COLS["date"]) or "").strip()
-            d = _parse_date_loose(raw_date)
-            if not d:
-                skipped += 1
-                problems.append((idx, title[:60], f"bad date: {raw_date!r}"))
-                continue
+def _parse_chunks(chunks: Iterable[list], workers: int) -> Iterator[Tuple[List[dict], int, List[tuple]]]:
+    """
+    Yield parsed chunks in file order. With workers > 1 chunks are parsed in a
+    process pool, keeping a bounded number in flight so memory stays flat.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield _parse_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(_parse_chunk, chunk))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def _upsert_stmt():
+    stmt = _dialect_insert(Event)
+    return stmt.on_conflict_do_update(
+        index_elements=[Event.dedupe_id],
+        set_={**{f: stmt.excluded[f] for f in UPSERT_FIELDS}, "updated_at": stmt.excluded.updated_at},
+    )
+
 
-            t_start = _parse_time_loose(row.get(COLS["start_time"], ""))
-            t_end   = _parse_time_loose(row.get(COLS["end_time"], ""))
-
-            # Merge Tags + Category, then possibly add 'recurring'
-            tags_from_csv = row.get(COLS["tags"])
-            category_from_csv = row.get(COLS["category"])
-            tags = _merge_tags(tags_from_csv, category_from_csv)
-
-            if raw_date.lower() in {"daily", "weekly", "ongoing", "various", "multiple dates"}:
-                tags = _merge_tags(tags, "recurring")
-
-            ev = Event(
-                title=title,
-                description=(row.get(COLS["description"]) or "").strip() or None,
-                src_url=(row.get(COLS["src_url"]) or "").strip() or None,
-                starts_at=_combine_iso(d, t_start) or _combine_iso(d, time(0, 0)),
-                ends_at=_combine_iso(d, t_end),
-                venue=(row.get(COLS["venue"]) or "").strip() or None,
-                location=(row.get(COLS["location"]) or "").strip() or "TBD",
-                latitude=_to_float(row.get(COLS["latitude"])),
-                longitude=_to_float(row.get(COLS["longitude"])),
-                tags=tags,
-                organizers=_csv_to_str(row.get(COLS["company"])),  # company → organizers
-                price_amount=_to_float(row.get(COLS["price_amount"])),
-                price_currency=(row.get(COLS["price_currency"]) or "").strip() or None,
-                people_cap=_to_int(row.get(COLS["people_cap"])),
-                source="cache",   # keep within allowed enum for API responses
-                evidence_urls=[], # keep as empty list unless you have sources
-            )
-
-            db.add(ev)
+def _upsert_records(db, records: List[dict]) -> Tuple[int, int, int, List[str]]:
+    """
+    Classify a chunk against what is stored and write only new/changed rows
+    with one INSERT ... ON CONFLICT(dedupe_id) DO UPDATE.
+    Returns (inserted, updated, unchanged, dedupe_ids written).
+    """
+    by_id = {r["dedupe_id"]: r for r in records}  # last one wins within a chunk
+    cols = [getattr(Event, f) for f in UPSERT_FIELDS]
+    existing = {
+        row.dedupe_id: row
+        for row in db.execute(
+            select(Event.dedupe_id, *cols).where(Event.dedupe_id.in_(list(by_id)))
+        )
+    }
+
+    now = datetime.utcnow()
+    inserted = updated = unchanged = 0
+    to_write = []
+    for did, rec in by_id.items():
+        cur = existing.get(did)
+        if cur is None:
             inserted += 1
+        elif any(getattr(cur, f) != rec[f] for f in UPSERT_FIELDS):
+            updated += 1
+        else:
+            unchanged += 1
+            continue
+        to_write.append({**rec, "created_at": now, "updated_at": now})
+
+    if to_write:
+        db.execute(_upsert_stmt(), to_write)
+    return inserted, updated, unchanged, [r["dedupe_id"] for r in to_write]
 
-    db.commit()
+# ------------------------------------------------------
+# Main
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Import events from CSV (idempotent upsert on dedupe_id).")
+    ap.add_argument("csv_path", nargs="?", default=str(DEFAULT_CSV))
+    ap.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="parser processes (1 = parse in this process)")
+    ap.add_argument("--embed", action="store_true",
+                    help="embed new/changed events after each batch and update the ANN index")
+    args = ap.parse_args(argv)
+
+    if args.embed:
+        # Pulls in the embedding client; only needed for this stage
+        from sqlalchemy.orm import noload
+        import ann_index
+        import migration
+        from indexing import embed_and_index_events, index_events, calls_for, EmbedStats
+        embed_stats = EmbedStats()
+
+    csv_path = Path(args.csv_path).resolve()
+    if not csv_path.exists():
+        raise FileNotFoundError(f"CSV not found: {csv_path}")
+
+    ensure_schema()
+    if args.embed:
+        # Embed with the model the live tables are on (the old one while a migration runs)
+        serving = migration.serving()
+        provider = migration.serving_provider()
+    db = SessionLocal()
+    inserted = updated = unchanged = skipped = 0
+    problems = []
 
-    print(f"Imported {inserted} events from {os.path.relpath(CSV_PATH)}; skipped {skipped}.")
+    try:
+        # Rows are parsed in parallel; this process is the single DB writer
+        chunks = _chunked(_iter_rows(csv_path), args.chunk_size)
+        for records, n_skipped, chunk_problems in _parse_chunks(chunks, args.workers):
+            skipped += n_skipped
+            problems.extend(chunk_problems[: 15 - len(problems)])
+            if not records:
+                continue
+            ins, upd, same, written = _upsert_records(db, records)
+            db.commit()
+            inserted += ins
+            updated += upd
+            unchanged += same
+
+            if args.embed and written:
+                events = (
+                    db.query(Event)
+                      .options(noload(Event.attendees), noload(Event.embedding))
+                      .filter(Event.dedupe_id.in_(written))
+                      .all()
+                )
+                pending = []
+                embed_stats += embed_and_index_events(
+                    db, events, serving.model_name, provider=provider, dim=serving.dim,
+                    defer_index=pending,
+                )
+                db.commit()
+                # Only after the commit, so the index never has labels without rows
+                embed_stats.index_writes += index_events(pending)
+        if args.embed:
+            ann_index.save_index()  # one save per touched index, at the end
+    finally:
+        db.close()
+
+    print(
+        f"Imported {os.path.relpath(csv_path)}: inserted {inserted}, updated {updated}, "
+        f"unchanged {unchanged}; skipped {skipped}."
+    )
+    if args.embed:
+        # Unchanged CSV rows never reach the embed stage; count them as avoided too
+        embed_stats.unchanged += unchanged
+        embed_stats.index_writes_avoided += unchanged
+        embed_stats.embed_calls_avoided = calls_for(inserted + updated + unchanged) - embed_stats.embed_calls
+        print(f"Embedding: {embed_stats.summary()}.")
     if problems:
         print("Skipped rows (first 15):")
         for r in problems[:15]:
@@ -0,0 +1,248 @@
+# scripts/tune_ann.py
+# Recall/latency sweep for one ANN index key. Loads the key's vectors from
+# event_embeddings (or generates synthetic ones), computes exact top-k with
+# NumPy as ground truth, builds hnswlib indexes over an M x ef_construction grid
+# and measures recall@k and per-query latency for each ef.
+# With --write, the cheapest config meeting --recall-target is saved to
+# ANN_STORE_DIR/ann_tuning.json, which ann_index reads per key.
+# --coarse-dim D evaluates two-stage search instead: the index holds the first D
+# dims (re-normalized) and the top k * --rerank-factor hits are reranked exactly
+# against the full vectors, as ann_index does with ANN_COARSE_DIM.
+# Usage: python scripts/tune_ann.py --model gemini-embedding-001 [--dim 1536] [--k 10]
+#            [--recall-target 0.95] [--M 16,32] [--ef-construction 100,200]
+#            [--ef 16,32,64,128,256] [--queries 200] [--synthetic N] [--write] [--json out.json]
+#            [--coarse-dim 256 --rerank-factor 2,4,8]
+
+import os, sys, argparse, json, time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import hnswlib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "backend"))
+sys.path.append(ROOT)
+# The server runs from backend/, so its ANN store lives at backend/.ann_store
+os.environ.setdefault("ANN_STORE_DIR", os.path.join(ROOT, ".ann_store"))
+
+TASK_DOCUMENT, TASK_QUERY = "RETRIEVAL_DOCUMENT", "RETRIEVAL_QUERY"
+
+
+def _ints(s: str) -> List[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def _normalize(a: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(a, axis=1, keepdims=True)
+    n[n == 0] = 1.0
+    return a / n
+
+
+def load_key_vectors(model: str, task: str, dim: Optional[int]) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    """(dim, labels, data, real query vectors) for a stored key; dim defaults to the largest group."""
+    from sqlalchemy import func
+    from db.database import SessionLocal
+    from db.models import EventEmbedding, UserQueryEmbedding
+
+    with SessionLocal() as db:
+        if dim is None:
+            row = (
+                db.query(EventEmbedding.dim, func.count())
+                .filter(EventEmbedding.model_name == model, EventEmbedding.task_type == task)
+                .group_by(EventEmbedding.dim)
+                .order_by(func.count().desc())
+                .first()
+            )
+            if row is None:
+                sys.exit(f"No event_embeddings rows for model={model} task={task}")
+            dim = row[0]
+        rows = (
+            db.query(EventEmbedding.event_id, EventEmbedding.vector)
+            .filter(EventEmbedding.model_name == model, EventEmbedding.task_type == task,
+                    EventEmbedding.dim == dim)
+            .all()
+        )
+        qrows = (
+            db.query(UserQueryEmbedding.vector)
+            .filter(UserQueryEmbedding.model_name == model, UserQueryEmbedding.task_type == TASK_QUERY,
+                    UserQueryEmbedding.dim == dim)
+            .all()
+        )
+    labels = np.array([r.event_id for r in rows], dtype=np.int64)
+    data = np.array([json.loads(r.vector) for r in rows], dtype=np.float32).reshape(-1, dim)
+    queries = np.array([json.loads(r.vector) for r in qrows], dtype=np.float32).reshape(-1, dim)
+    return dim, labels, data, queries
+
+
+def sample_queries(data: np.ndarray, real: np.ndarray, n: int, rng: np.random.Generator) -> np.ndarray:
+    """Real user query vectors first, topped up with perturbed event vectors."""
+    out = [real[rng.permutation(len(real))[:n]]] if len(real) else []
+    extra = n - (len(out[0]) if out else 0)
+    if extra > 0:
+        base = data[rng.integers(0, len(data), extra)]
+        noise = rng.standard_normal(base.shape).astype(np.float32) * 0.05
+        out.append(_normalize(base) + noise)
+    return _normalize(np.concatenate(out).astype(np.float32))
+
+
+def exact_topk(data: np.ndarray, queries: np.ndarray, k: int, chunk: int = 256) -> np.ndarray:
+    """Row indexes of the exact cosine top-k for each query."""
+    normed = _normalize(data)
+    out = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(0, len(queries), chunk):
+        sims = queries[i:i + chunk] @ normed.T
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(sims, part, axis=1).argsort(axis=1)[:, ::-1]
+        out[i:i + chunk] = np.take_along_axis(part, order, axis=1)
+    return out
+
+
+def _prefix(a: np.ndarray, d: int) -> np.ndarray:
+    return _normalize(a[:, :d]).astype(np.float32)
+
+
+def sweep(
+    data: np.ndarray,
+    queries: np.ndarray,
+    truth: np.ndarray,
+    k: int,
+    Ms: List[int],
+    efcs: List[int],
+    efs: List[int],
+    coarse_dim: int = 0,
+    rerank_factors: List[int] = (1,),
+) -> List[Dict]:
+    """
+    One result per (M, ef_construction, ef[, rerank_factor]). With coarse_dim the
+    index is built on prefixes and latency includes the exact rerank.
+    """
+    full = _normalize(data)
+    build = _prefix(data, coarse_dim) if coarse_dim else data
+    qbuild = _prefix(queries, coarse_dim) if coarse_dim else queries
+    factors = rerank_factors if coarse_dim else [1]
+    ids = np.arange(len(data), dtype=np.int64)
+    results = []
+    for M in Ms:
+        for efc in efcs:
+            index = hnswlib.Index(space="cosine", dim=build.shape[1])
+            t0 = time.perf_counter()
+            index.init_index(max_elements=len(data), M=M, ef_construction=efc)
+            index.add_items(build, ids)
+            build_s = time.perf_counter() - t0
+            for f in factors:
+                n = min(k * f, len(data))
+                for ef in efs:
+                    index.set_ef(max(ef, n))
+                    lat, hits = [], 0
+                    for qi, q in enumerate(qbuild):
+                        t0 = time.perf_counter()
+                        found, _ = index.knn_query(q[None, :], k=n)
+                        top = found[0]
+                        if coarse_dim:
+                            sims = full[top] @ queries[qi]
+                            top = top[np.argsort(-sims)[:k]]
+                        lat.append(time.perf_counter() - t0)
+                        hits += len(set(top.tolist()) & set(truth[qi].tolist()))
+                    lat.sort()
+                    row = {
+                        "M": M, "ef_construction": efc, "ef": max(ef, n),
+                        "recall": hits / (len(queries) * k),
+                        "p50_ms": lat[len(lat) // 2] * 1000,
+                        "p95_ms": lat[int(0.95 * (len(lat) - 1))] * 1000,
+                        "build_s": build_s,
+                    }
+                    if coarse_dim:
+                        row.update(coarse_dim=coarse_dim, rerank_factor=f)
+                    results.append(row)
+                    print("M={M:<3} efc={ef_construction:<4} ef={ef:<4} {rr}recall@{k}={recall:.4f} "
+                          "p50={p50_ms:.3f}ms p95={p95_ms:.3f}ms build={build_s:.2f}s".format(
+                              k=k, rr=f"rerank={f:<3} " if coarse_dim else "", **row))
+    return results
+
+
+def pick(results: List[Dict], target: float) -> Optional[Dict]:
+    """Cheapest config meeting the recall target: lowest p50, then smaller M / ef_construction."""
+    ok = [r for r in results if r["recall"] >= target]
+    if not ok:
+        return None
+    return min(ok, key=lambda r: (round(r["p50_ms"], 3), r["M"], r["ef_construction"], r["ef"],
+                                  r.get("rerank_factor", 0)))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Sweep hnswlib parameters for recall@k vs latency.")
+    ap.add_argument("--model", help="model_name of the stored key (default: the provider's model)")
+    ap.add_argument("--task", default=TASK_DOCUMENT)
+    ap.add_argument("--dim", type=int, help="default: the dim with the most rows (or 768 with --synthetic)")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--recall-target", type=float, default=0.95)
+    ap.add_argument("--M", default="16,32")
+    ap.add_argument("--ef-construction", default="100,200")
+    ap.add_argument("--ef", default="16,32,64,128,256")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--synthetic", type=int, metavar="N", help="use N random unit vectors instead of the DB")
+    ap.add_argument("--coarse-dim", type=int, default=0, help="evaluate two-stage search on a D-dim prefix index")
+    ap.add_argument("--rerank-factor", default="2,4,8", help="candidates per result to rerank (with --coarse-dim)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--write", action="store_true", help="save the chosen config to ann_tuning.json")
+    ap.add_argument("--json", help="also write all sweep results to this file")
+    args = ap.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    model = args.model
+    if model is None:
+        from embeddings import EMBED_MODEL as model
+    if args.synthetic:
+        dim = args.dim or 768
+        data = _normalize(rng.standard_normal((args.synthetic, dim)).astype(np.float32))
+        real = np.empty((0, dim), dtype=np.float32)
+    else:
+        dim, _, data, real = load_key_vectors(model, args.task, args.dim)
+    if len(data) <= args.k:
+        sys.exit(f"Need more than k={args.k} vectors, have {len(data)}")
+    key = (model, args.task, dim)
+    print(f"Key {key}: {len(data)} vectors, {min(len(real), args.queries)} real queries")
+
+    queries = sample_queries(data, real, args.queries, rng)
+    t0 = time.perf_counter()
+    truth = exact_topk(data, queries, args.k)
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    print(f"Exact top-{args.k}: {exact_ms:.3f}ms/query (NumPy brute force)")
+
+    if args.coarse_dim and not 0 < args.coarse_dim < dim:
+        sys.exit(f"--coarse-dim must be between 1 and {dim - 1}")
+    results = sweep(data, queries, truth, args.k, _ints(args.M), _ints(args.ef_construction), _ints(args.ef),
+                    coarse_dim=args.coarse_dim, rerank_factors=_ints(args.rerank_factor))
+    best = pick(results, args.recall_target)
+    if best is None:
+        top = max(results, key=lambda r: r["recall"])
+        print(f"No config reached recall {args.recall_target}; best was {top['recall']:.4f} "
+              f"(M={top['M']}, ef_construction={top['ef_construction']}, ef={top['ef']})")
+    else:
+        rr = f" coarse_dim={best['coarse_dim']} rerank_factor={best['rerank_factor']}" if args.coarse_dim else ""
+        print(f"Chosen: M={best['M']} ef_construction={best['ef_construction']} ef={best['ef']}{rr} "
+              f"recall={best['recall']:.4f} p50={best['p50_ms']:.3f}ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"key": list(key), "k": args.k, "n": len(data), "exact_ms": exact_ms,
+                       "results": results, "chosen": best}, f, indent=2)
+    if args.write and best is not None:
+        import ann_index
+        cfg = {
+            "M": best["M"], "ef_construction": best["ef_construction"], "ef": best["ef"], "k": args.k,
+            "recall": round(best["recall"], 4), "recall_target": args.recall_target,
+            "n": len(data), "tuned_at": int(time.time()),
+        }
+        prev = ann_index.tuning_for(key) or {}
+        # the sweep tunes hnsw parameters; keep the key's backend and shard choices
+        cfg.update({f: prev[f] for f in ("backend", "shards") if f in prev})
+        if args.coarse_dim:
+            # ef was measured for k * rerank_factor candidates
+            cfg.update(coarse_dim=args.coarse_dim, rerank_factor=best["rerank_factor"],
+                       k=args.k * best["rerank_factor"])
+        ann_index.save_tuning(key, cfg)
+        print(f"Wrote tuning for {ann_index.key_name(key)}; rebuild the index to apply M/ef_construction.")
+
+
+if __name__ == "__main__":
+    main()
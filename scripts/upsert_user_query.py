@@ -21,9 +21,29 @@ INTENT = os.getenv("INTENT_TEXT",
     "location: Newark DE (~50km); prefer free evening events"
 )
 
+# Many users at once: INTENTS_FILE is JSONL of {"user_id": ..., "intent": "..."}; the
+# intents are embedded in batches and sent to the bulk endpoint in one request.
+INTENTS_FILE = os.getenv("INTENTS_FILE")
+BATCH = 100  # texts per embed_content call
+
 # 2) embed with RETRIEVAL_QUERY
 client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
 cfg = types.EmbedContentConfig(task_type="RETRIEVAL_QUERY", output_dimensionality=DIM or None)
+
+if INTENTS_FILE:
+    with open(INTENTS_FILE) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    lines = []
+    for i in range(0, len(rows), BATCH):
+        chunk = rows[i:i + BATCH]
+        res = client.models.embed_content(model=MODEL, contents=[r["intent"] for r in chunk], config=cfg)
+        lines += [json.dumps({"user_id": r["user_id"], "vector": e.values}) for r, e in zip(chunk, res.embeddings)]
+    r = requests.post(f"{BASE}/api/embeddings/users/bulk?{urlencode({'model_name': MODEL})}",
+                      data="\n".join(lines), headers={"Content-Type": "application/x-ndjson"}, timeout=120)
+    r.raise_for_status()
+    print("Bulk upserted user query embeddings:", r.json())
+    raise SystemExit(0)
+
 res = client.models.embed_content(model=MODEL, contents=INTENT, config=cfg)
 vec = res.embeddings[0].values
 